@@ -0,0 +1,52 @@
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+
+class FrameRing:
+    """
+    Ring of fixed-size frame slots in shared memory, to pass the frames of a video from
+    the HTTP front end to a model server without pickling them: the producer writes a
+    frame into a free slot and sends its slot index over the job socket, and the
+    consumer sends the slot index back once it's done with the frame, which frees the
+    slot. The producer creates (and unlinks) the ring, the consumer attaches to it by
+    name.
+    """
+
+    def __init__(self, shm, num_slots, frame_shape):
+        self.shm = shm
+        self.num_slots = num_slots
+        self.frame_shape = tuple(frame_shape)
+        self.slots = np.ndarray(
+            (num_slots, *self.frame_shape), dtype=np.uint8, buffer=shm.buf
+        )
+
+    @classmethod
+    def create(cls, num_slots, frame_shape):
+        size = num_slots * int(np.prod(frame_shape))
+        shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        return cls(shm, num_slots, frame_shape)
+
+    @classmethod
+    def attach(cls, name, num_slots, frame_shape):
+        shm = shared_memory.SharedMemory(name=name)
+        # the producer owns the segment: don't let the resource tracker of this
+        # (long-lived) process unlink it or warn about it at exit
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm, num_slots, frame_shape)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def __getitem__(self, slot):
+        """The frame in a slot (a view on the shared memory)."""
+        return self.slots[slot]
+
+    def close(self):
+        # the views on the buffer must be released before closing it
+        self.slots = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
@@ -0,0 +1,167 @@
+"""
+Client of the model servers (`api.model_server`) for the HTTP front end, which doesn't
+load any model: it decodes the frames of a video and submits a masking job to a model
+replica, passing the frames through a shared-memory `FrameRing`.
+"""
+
+import itertools
+import os
+import socket
+import time
+from collections import deque
+from multiprocessing.connection import (
+    Connection,
+    answer_challenge,
+    deliver_challenge,
+    wait,
+)
+
+from api.frame_ring import FrameRing
+from api.model_server import (
+    MODEL_SERVER_AUTHKEY,
+    MODEL_SERVER_DEVICES,
+    get_socket_path,
+)
+from utils.demo_utils import change_video
+from utils.video_utils import read_frames
+
+# Number of frame slots of the shared-memory ring of a job, i.e. max number of frames
+# in flight between the front end and the model server
+FRAME_RING_SLOTS = int(os.getenv("FRAME_RING_SLOTS", "8"))
+
+# Timeout (secs) to connect to a model replica, and interval to retry connecting to the
+# replicas which are down while waiting for a free one
+MODEL_SERVER_CONNECT_TIMEOUT = float(os.getenv("MODEL_SERVER_CONNECT_TIMEOUT", "2"))
+
+# Max time (secs) a job waits for a replica to be free while they're all busy
+MODEL_SERVER_QUEUE_TIMEOUT = float(os.getenv("MODEL_SERVER_QUEUE_TIMEOUT", "600"))
+
+# replica to try first for the next job, to spread the jobs across the replicas
+_next_replica = itertools.count()
+
+
+class ModelServerUnavailable(Exception):
+    pass
+
+
+class ModelServerBusy(Exception):
+    pass
+
+
+def _open_replica(socket_path):
+    """
+    Open a connection to a model replica, without the handshake of
+    `multiprocessing.connection.Client`, which the replica only starts once it accepts
+    the connection between two jobs (the connection is then readable). Raises a
+    TimeoutError or BlockingIOError if the replica is running but can't take more
+    connections, or another OSError if it's down.
+    """
+    with socket.socket(socket.AF_UNIX) as sock:
+        sock.settimeout(MODEL_SERVER_CONNECT_TIMEOUT)
+        sock.connect(socket_path)
+        # the connection does blocking reads and writes
+        sock.setblocking(True)
+        return Connection(sock.detach())
+
+
+def connect():
+    """
+    Connect to the first free model replica. While they're all busy, the job waits
+    (up to `MODEL_SERVER_QUEUE_TIMEOUT`) with a pending connection to each running
+    replica, which serve them in order.
+    """
+    deadline = time.monotonic() + MODEL_SERVER_QUEUE_TIMEOUT
+    pending = {}  # pending connection by device
+    try:
+        while True:
+            start = next(_next_replica)
+            any_running = False
+            for i in range(len(MODEL_SERVER_DEVICES)):
+                device = MODEL_SERVER_DEVICES[(start + i) % len(MODEL_SERVER_DEVICES)]
+                if device in pending:
+                    continue
+                try:
+                    pending[device] = _open_replica(get_socket_path(device))
+                except (TimeoutError, BlockingIOError):
+                    any_running = True  # its queue of connections is full
+                except OSError:
+                    pass  # down, retried on the next round
+            if not pending and not any_running:
+                raise ModelServerUnavailable(
+                    f"No model server is running on devices {MODEL_SERVER_DEVICES}"
+                )
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise ModelServerBusy(
+                    f"The model servers were busy for {MODEL_SERVER_QUEUE_TIMEOUT:.0f} s"
+                )
+
+            # wait for a replica to accept its connection, retrying the replicas which
+            # are down every MODEL_SERVER_CONNECT_TIMEOUT
+            ready = wait(
+                list(pending.values()), min(remaining, MODEL_SERVER_CONNECT_TIMEOUT)
+            )
+            for device, conn in list(pending.items()):
+                if conn not in ready:
+                    continue
+                del pending[device]
+                try:
+                    answer_challenge(conn, MODEL_SERVER_AUTHKEY)
+                    deliver_challenge(conn, MODEL_SERVER_AUTHKEY)
+                except (OSError, EOFError):
+                    conn.close()  # the replica exited
+                    continue
+                except BaseException:
+                    conn.close()
+                    raise
+                return conn
+    finally:
+        # the replicas reject the abandoned connections when they accept them
+        for conn in pending.values():
+            conn.close()
+
+
+def submit_mask_video(input_video_path: str, prompt: str, output_video_path: str):
+    """
+    Mask a video as `api.video_masker.mask_video`, on a model server. Returns the
+    (code, message) of `mask_video`.
+    """
+    change_video(input_video_path, clip_frames=300)
+    frames = read_frames(input_video_path, max_secs=10)
+    first_frame = next(frames, None)
+    if first_frame is None:
+        return -1, "No frames could be decoded."
+
+    ring = FrameRing.create(FRAME_RING_SLOTS, first_frame.shape)
+    try:
+        with connect() as conn:
+            conn.send(
+                {
+                    "type": "job",
+                    "prompt": prompt,
+                    "output_path": os.path.abspath(output_video_path),
+                    "shm_name": ring.name,
+                    "num_slots": ring.num_slots,
+                    "frame_shape": ring.frame_shape,
+                }
+            )
+            free_slots = deque(range(ring.num_slots))
+            for frame in itertools.chain([first_frame], frames):
+                if not free_slots:
+                    # wait for the model server to be done with a frame
+                    free_slots.append(conn.recv()["slot"])
+                slot = free_slots.popleft()
+                ring[slot][...] = frame
+                conn.send({"type": "frame", "slot": slot})
+            conn.send({"type": "end"})
+
+            while (message := conn.recv())["type"] == "release":
+                pass
+            if message["type"] == "error":
+                raise RuntimeError(message["message"])
+            return message["code"], message["message"]
+    except (EOFError, ConnectionError) as e:
+        raise ModelServerUnavailable(f"The model server closed the connection: {e}")
+    finally:
+        ring.close()
+        ring.unlink()
@@ -0,0 +1,128 @@
+"""
+Model server of the masking API: a long-lived inference process per device, which
+loads the models (`api.video_masker`) once and runs the masking jobs submitted by the
+HTTP front end (`api.server`, through `api.model_client`) over a local Unix socket, one
+job at a time. The frames of a job are passed through a shared-memory `FrameRing`, and
+only small control messages go through the socket:
+
+    client -> server: {"type": "job", "prompt", "output_path", "shm_name", "num_slots", "frame_shape"}
+    client -> server: {"type": "frame", "slot"}  (for each frame)
+    server -> client: {"type": "release", "slot"}  (once the frame of the slot is copied)
+    client -> server: {"type": "end"}
+    server -> client: {"type": "result", "code", "message"} or {"type": "error", "message"}
+
+Start one replica per GPU (each restarted if it crashes) from the repository root with
+`python -m api.model_server --devices 0 1`, then the HTTP front end with
+`python -m api.server` (with the same MODEL_SERVER_DEVICES).
+"""
+
+import argparse
+import multiprocessing
+import os
+import time
+import traceback
+from multiprocessing.connection import AuthenticationError, Listener
+
+from api.frame_ring import FrameRing
+
+# Directory of the Unix sockets of the model servers, key authenticating the clients,
+# and devices (GPU indices) with a model replica
+MODEL_SERVER_SOCKET_DIR = os.getenv("MODEL_SERVER_SOCKET_DIR", "/tmp")
+MODEL_SERVER_AUTHKEY = os.getenv("MODEL_SERVER_AUTHKEY", "video-masking").encode()
+MODEL_SERVER_DEVICES = os.getenv("MODEL_SERVER_DEVICES", "0").split(",")
+
+# Delay before restarting a replica that exited
+RESTART_DELAY_SECS = 5
+
+
+def get_socket_path(device):
+    return os.path.join(MODEL_SERVER_SOCKET_DIR, f"video-masking-model-{device}.sock")
+
+
+def run_job(video_masker, conn):
+    """Receive the frames of a job from a client, mask them and send back the result."""
+    job = conn.recv()
+    # the frames are kept in memory (for the annotated video) along with their resized
+    # images for the video predictor, which are prepared as the frames arrive
+    frames, images = [], []
+    ring = FrameRing.attach(job["shm_name"], job["num_slots"], job["frame_shape"])
+    try:
+        while (message := conn.recv())["type"] == "frame":
+            frame = ring[message["slot"]].copy()
+            conn.send({"type": "release", "slot": message["slot"]})
+            frames.append(frame)
+            images.append(video_masker.resize_frame(frame))
+    finally:
+        ring.close()
+
+    try:
+        code, message = video_masker.mask_video_frames(
+            frames, images, job["prompt"], job["output_path"]
+        )
+    except Exception as e:
+        traceback.print_exc()
+        conn.send({"type": "error", "message": str(e)})
+        return
+    conn.send({"type": "result", "code": code, "message": message})
+
+
+def serve(device):
+    """Run the model replica of a device: load the models, then run the jobs."""
+    # the replica only sees its device (as "cuda:0"), which must be set before CUDA is
+    # initialized by the models
+    os.environ["CUDA_VISIBLE_DEVICES"] = str(device)
+    from api import video_masker
+
+    socket_path = get_socket_path(device)
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    # the socket only exists once the models are loaded, so the clients don't submit
+    # jobs to a replica which isn't ready
+    with Listener(
+        socket_path, family="AF_UNIX", backlog=64, authkey=MODEL_SERVER_AUTHKEY
+    ) as listener:
+        print(f"Model server of device {device} listening on {socket_path}")
+        while True:
+            try:
+                conn = listener.accept()
+            except (AuthenticationError, EOFError, OSError) as e:
+                print(f"Rejected a client: {e}")
+                continue
+            with conn:
+                try:
+                    run_job(video_masker, conn)
+                except (EOFError, OSError) as e:
+                    print(f"Client disconnected: {e}")
+                except Exception:
+                    traceback.print_exc()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", nargs="+", default=MODEL_SERVER_DEVICES)
+    args = parser.parse_args()
+
+    # a fresh interpreter per replica (CUDA can't be used in forked processes)
+    context = multiprocessing.get_context("spawn")
+    processes = {}
+    try:
+        while True:
+            for device in args.devices:
+                process = processes.get(device)
+                if process is not None and process.is_alive():
+                    continue
+                if process is not None:
+                    print(
+                        f"Model server of device {device} exited with code "
+                        f"{process.exitcode}, restarting it"
+                    )
+                processes[device] = context.Process(target=serve, args=(device,))
+                processes[device].start()
+            time.sleep(RESTART_DELAY_SECS)
+    finally:
+        for process in processes.values():
+            process.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,10 +2,12 @@ from fastapi import FastAPI, File, UploadFile, Form, HTTPException
 from fastapi.responses import FileResponse
 from fastapi.staticfiles import StaticFiles
 import uvicorn
+import asyncio
 import shutil
 import os
 from pathlib import Path
-from api.video_masker import mask_video
+# the models run in the model servers (`api.model_server`), not in the HTTP workers
+from api.model_client import ModelServerBusy, ModelServerUnavailable, submit_mask_video
 from utils.demo_utils import change_video
 import gdown
 import subprocess
@@ -74,7 +76,10 @@ async def mask_video_endpoint(file: UploadFile = File(...), prompt: str = Form()
     # 2. Run masking
     try:
         output_path = OUTPUT_DIR / f"masked_{file_name}"
-        code, message = mask_video(str(input_path), prompt, str(output_path))
+        # (in a thread, so the worker keeps serving other requests meanwhile)
+        code, message = await asyncio.to_thread(
+            submit_mask_video, str(input_path), prompt, str(output_path)
+        )
         print(f"Code: {code}")
         print(f"Message: {message}")
         if code < 0:
@@ -82,6 +87,10 @@ async def mask_video_endpoint(file: UploadFile = File(...), prompt: str = Form()
                 "status": "Failure",
                 "message": f"Code error {code}: {message}"
             }
+    except ModelServerUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except ModelServerBusy as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
@@ -124,4 +133,6 @@ app.mount("/static", StaticFiles(directory=str(OUTPUT_DIR)), name="static")
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("api.server:app", host="127.0.0.1", port=9446, reload=True)# , timeout_keep_alive=2160, keep_alive_timeout=2160)
+    # the HTTP workers are light (the models run in the model servers), so there can be
+    # many of them
+    uvicorn.run("api.server:app", host="127.0.0.1", port=9446, workers=int(os.getenv("API_WORKERS", "4")))# , timeout_keep_alive=2160, keep_alive_timeout=2160)
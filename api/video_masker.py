@@ -9,10 +9,13 @@ from sam2.build_sam import build_sam2_video_predictor, build_sam2
 from sam2.sam2_image_predictor import SAM2ImagePredictor
 from transformers import AutoProcessor, AutoModelForZeroShotObjectDetection 
 from utils.track_utils import sample_points_from_masks
-from utils.video_utils import create_video_from_images
+from utils.text_embedding_cache import enable_text_embedding_cache
+from utils.tiled_detection import detect_tiled_hf
+from utils.image_feature_cache import enable_image_feature_cache
+from utils.video_utils import create_video_from_images, read_frames
 from datetime import datetime
-import subprocess
-from utils.demo_utils import change_video, get_video_info
+import hashlib
+from utils.demo_utils import change_video
 
 """
 Step 1: Environment settings and model initialization
@@ -38,78 +41,44 @@ model_id = "IDEA-Research/grounding-dino-tiny"
 device = "cuda" if torch.cuda.is_available() else "cpu"
 processor = AutoProcessor.from_pretrained(model_id)
 grounding_model = AutoModelForZeroShotObjectDetection.from_pretrained(model_id).to(device)
+# the same prompt is used on every keyframe, so its text embeddings are computed once
+enable_text_embedding_cache(grounding_model)
+# the image features of the recent first frames are kept, so that re-masking a video
+# with another prompt only re-runs the text-conditioned parts of Grounding DINO
+image_feature_cache = enable_image_feature_cache(grounding_model)
 
-def save_frames(input_video_path: str, video_dir: str):
-    vidcap = cv2.VideoCapture(input_video_path)
-    fps = vidcap.get(cv2.CAP_PROP_FPS)
-    max_frames = fps * 10
-    success, image = vidcap.read()
-    count = 1
-    while success and count <= max_frames:
-        cv2.imwrite(os.path.join(video_dir, f"{count:05d}.jpg"), image)
-        success, image = vidcap.read()
-        count += 1
-    vidcap.release()
-
-def save_frames2(input_video_path: str, video_dir: str, info):
-    stream = info["streams"][0]
-    fps_str = stream["r_frame_rate"]
-    fps = eval(fps_str) if fps_str != "0/0" else 30
-    width = stream["width"]
-    height = stream["height"]
-    max_frames = int(fps * 30)
-
-    ffmpeg_cmd = [
-        "ffmpeg",
-        "-i", input_video_path,
-        "-f", "image2pipe",
-        "-pix_fmt", "rgb24",
-        "-vcodec", "rawvideo",
-        "-"
-    ]
-
-    process = subprocess.Popen(ffmpeg_cmd, stdout=subprocess.PIPE, bufsize=10**8)
-
-    frame_size = width * height * 3
-    count = 1
-
-    while count <= max_frames:
-        raw_frame = process.stdout.read(frame_size)
-        if not raw_frame:
-            break
-
-        # Convert bytes to numpy array
-        frame = np.frombuffer(raw_frame, dtype=np.uint8).reshape((height, width, 3))
-
-        # Save as JPEG
-        img = Image.fromarray(frame)
-        img.save(os.path.join(video_dir, f"{count:05d}.jpg"), "JPEG")
-
-        count += 1
-
-    process.stdout.close()
-    process.wait()
+def resize_frame(image: np.ndarray) -> torch.Tensor:
+    """
+    Resize a (BGR) frame to the input size of the video predictor, as a uint8 [3, S, S]
+    RGB tensor (as the frames loaded from a directory by `init_state`).
+    """
+    image_size = video_predictor.image_size
+    img_pil = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    return torch.from_numpy(np.array(img_pil.resize((image_size, image_size)))).permute(2, 0, 1)
 
 
 def mask_video(input_video_path: str, prompt: str, output_video_path: str):
     change_video(input_video_path, clip_frames=300)
-    current_time = datetime.now().time()
-    video_dir = f"api/input/{current_time}"
-    os.makedirs(video_dir)
-    
-    save_frames(input_video_path, video_dir)
-    # info = get_video_info(input_video_path)
-    # save_frames2(input_video_path, video_dir, info)
+    frames = list(read_frames(input_video_path, max_secs=10))
+    return mask_video_frames(frames, [resize_frame(frame) for frame in frames], prompt, output_video_path)
 
-    # scan all the JPEG frame names in this directory
-    frame_names = [
-        p for p in os.listdir(video_dir)
-        if os.path.splitext(p)[-1] in [".jpg", ".jpeg", ".JPG", ".JPEG"]
-    ]
-    frame_names.sort(key=lambda p: int(os.path.splitext(p)[0]))
+
+def mask_video_frames(frames, images, prompt: str, output_video_path: str):
+    """
+    Mask the decoded (BGR) frames of a video, given with their `resize_frame` images, and
+    write the masked video to `output_video_path`. The frames are passed to the video
+    predictor in memory, without saving them as JPEG files.
+    """
+    if len(frames) == 0:
+        return -1, "No frames could be decoded."
+    current_time = datetime.now().time()
+    video_height, video_width = frames[0].shape[:2]
     # init video predictor state
     try:
-        inference_state = video_predictor.init_state(video_path=video_dir)
+        images = torch.stack(images).to(video_predictor.device)
+        inference_state = video_predictor.init_state(
+            preloaded_frames=(images, video_height, video_width)
+        )
     except RuntimeError as e:
         print("CUDA ran out of memory. Check logs: sudo journatlctl -u video-masking -n 20")
         return -1, "CUDA ran out of memory."
@@ -121,23 +90,15 @@ def mask_video(input_video_path: str, prompt: str, output_video_path: str):
     """
 
     # prompt grounding dino to get the box coordinates on specific frame
-    img_path = os.path.join(video_dir, frame_names[ann_frame_idx])
-    image = Image.open(img_path)
+    image = Image.fromarray(cv2.cvtColor(frames[ann_frame_idx], cv2.COLOR_BGR2RGB))
 
-    # run Grounding DINO on the image
-    inputs = processor(images=image, text=prompt, return_tensors="pt").to(device)
-    with torch.no_grad():
-        outputs = grounding_model(**inputs)
-
-    results = processor.post_process_grounded_object_detection(
-        outputs,
-        inputs.input_ids,
-        box_threshold=0.25,
-        text_threshold=0.3,
-        target_sizes=[image.size[::-1]]
-    )
+    # run Grounding DINO on the image (on batched tiles for high-resolution frames, to keep small objects),
+    # the frames being keyed by their content since each upload is a new video
+    frame_key = hashlib.md5(frames[ann_frame_idx].tobytes()).hexdigest()
+    with image_feature_cache.frame(frame_key):
+        results = [detect_tiled_hf(grounding_model, processor, image, prompt, box_threshold=0.25, text_threshold=0.3)]
     # prompt SAM image predictor to get the mask for the object
-    image_predictor.set_image(np.array(image.convert("RGB")))
+    image_predictor.set_image(np.array(image))
 
     # process the detection results
     input_boxes = results[0]["boxes"].cpu().numpy()
@@ -226,7 +187,7 @@ def mask_video(input_video_path: str, prompt: str, output_video_path: str):
 
     ID_TO_OBJECTS = {i: obj for i, obj in enumerate(OBJECTS, start=1)}
     for frame_idx, segments in video_segments.items():
-        img = cv2.imread(os.path.join(video_dir, frame_names[frame_idx]))
+        img = frames[frame_idx]
         
         object_ids = list(segments.keys())
         masks = list(segments.values())
@@ -252,7 +213,6 @@ def mask_video(input_video_path: str, prompt: str, output_video_path: str):
     create_video_from_images(save_dir, output_video_path)
     change_video(output_video_path, force=True)
 
-    shutil.rmtree(video_dir)
     shutil.rmtree(save_dir)
 
     print("Masking complete.")
@@ -3,12 +3,17 @@
 # This source code is licensed under the license found in the
 # LICENSE file in the root directory of this source tree.
 
+import functools
 import logging
-from typing import Any, Generator
+from typing import Any, Generator, List, Tuple
+
+import numpy as np
 
 from app_conf import (
+    DATA_PATH,
     GALLERY_PATH,
     GALLERY_PREFIX,
+    MASK_STREAM_QUEUE_SIZE,
     POSTERS_PATH,
     POSTERS_PREFIX,
     UPLOADS_PATH,
@@ -19,7 +24,14 @@ from data.schema import schema
 from data.store import set_videos
 from flask import Flask, make_response, Request, request, Response, send_from_directory
 from flask_cors import CORS
-from inference.data_types import PropagateDataResponse, PropagateInVideoRequest
+from inference.data_types import PropagateInVideoRequest
+from inference.mask_stream import (
+    encode_binary_frame,
+    encode_incremental_binary_frame,
+    encode_incremental_json_frame,
+    encode_json_frame,
+    stream_in_thread,
+)
 from inference.multipart import MultipartResponseBuilder
 from inference.predictor import InferenceAPI
 from strawberry.flask.views import GraphQLView
@@ -33,6 +45,9 @@ videos = preload_data()
 set_videos(videos)
 
 inference_api = InferenceAPI()
+inference_api.preload_videos(
+    [f"{DATA_PATH}/{video.path}" for video in videos.values()]
+)
 
 
 @app.route("/healthy")
@@ -80,37 +95,93 @@ def propagate_in_video() -> Response:
     args = {
         "session_id": data["session_id"],
         "start_frame_index": data.get("start_frame_index", 0),
+        # "json" (default) for JSON-encoded COCO RLE masks, or "binary" for the binary
+        # format of `inference.mask_stream`
+        "mask_format": data.get("mask_format", "json"),
+        # only send the masks that changed since the last ones sent (see
+        # `PropagateInVideoRequest.incremental`)
+        "incremental": bool(data.get("incremental", False)),
     }
+    if args["mask_format"] not in ["json", "binary"]:
+        return make_response(f"unknown mask format {args['mask_format']}", 400)
 
     boundary = "frame"
     frame = gen_track_with_mask_stream(boundary, **args)
     return Response(frame, mimetype="multipart/x-savi-stream; boundary=" + boundary)
 
 
+def gen_propagated_masks(
+    request: PropagateInVideoRequest,
+) -> Generator[Tuple[int, List[int], np.ndarray], None, None]:
+    with inference_api.autocast_context():
+        yield from inference_api.propagate_masks_in_video(request=request)
+
+
 def gen_track_with_mask_stream(
     boundary: str,
     session_id: str,
     start_frame_index: int,
+    mask_format: str = "json",
+    incremental: bool = False,
 ) -> Generator[bytes, None, None]:
-    with inference_api.autocast_context():
-        request = PropagateInVideoRequest(
-            type="propagate_in_video",
-            session_id=session_id,
-            start_frame_index=start_frame_index,
+    request = PropagateInVideoRequest(
+        type="propagate_in_video",
+        session_id=session_id,
+        start_frame_index=start_frame_index,
+        incremental=incremental,
+    )
+    if mask_format == "binary":
+        encode_frame = encode_binary_frame
+        if incremental:
+            encode_frame = encode_incremental_binary_frame
+        headers = {
+            "Content-Type": "application/octet-stream",
+            "Mask-Type": "RLE-varint-delta" if incremental else "RLE-varint",
+        }
+    else:
+        encode_frame = encode_json_frame
+        if incremental:
+            encode_frame = encode_incremental_json_frame
+        headers = {
+            "Content-Type": "application/json; charset=utf-8",
+            "Mask-Type": "RLE[]",
+        }
+    num_frames = inference_api.get_num_propagated_frames(request)
+    sent_masks = None
+    if incremental:
+        # the interactive requests of the session wait for this stream to be sent
+        # before updating the masks it tracks (see `SentMasks`)
+        sent_masks = inference_api.get_sent_masks(request)
+        generation = sent_masks.begin_stream()
+        encode_frame = functools.partial(
+            encode_frame, sent_masks, generation=generation
         )
 
-        for chunk in inference_api.propagate_in_video(request=request):
+    try:
+        # The inference runs in a background thread (holding the inference lock),
+        # while the masks are encoded and sent from this thread
+        frames = stream_in_thread(
+            gen_propagated_masks(request), MASK_STREAM_QUEUE_SIZE
+        )
+        for frame_count, (frame_idx, obj_ids, masks) in enumerate(frames, start=1):
+            body = encode_frame(frame_idx, obj_ids, masks)
+            if body is None:
+                # an incremental propagation skips the frames where no mask changed
+                continue
             yield MultipartResponseBuilder.build(
                 boundary=boundary,
                 headers={
-                    "Content-Type": "application/json; charset=utf-8",
-                    "Frame-Current": "-1",
-                    # Total frames minus the reference frame
-                    "Frame-Total": "-1",
-                    "Mask-Type": "RLE[]",
+                    **headers,
+                    # Number of frames propagated so far and in total (the start
+                    # frame is propagated in both directions)
+                    "Frame-Current": str(frame_count),
+                    "Frame-Total": str(num_frames),
                 },
-                body=chunk.to_json().encode("UTF-8"),
+                body=body,
             ).get_message()
+    finally:
+        if sent_masks is not None:
+            sent_masks.end_stream()
 
 
 class MyGraphQLView(GraphQLView):
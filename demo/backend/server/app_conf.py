@@ -42,12 +42,40 @@ UPLOADS_PREFIX = "uploads"
 # Path where all uploaded videos are stored
 UPLOADS_PATH = DATA_PATH / UPLOADS_PREFIX
 
+# Max total size (in GB) of the uploaded videos kept in UPLOADS_PATH, and max age
+# (in hours) since they were last uploaded. The least recently uploaded videos
+# are evicted first.
+UPLOADS_MAX_SIZE_BYTES = int(float(os.getenv("UPLOADS_MAX_SIZE_GB", "10")) * 2**30)
+UPLOADS_MAX_AGE_SEC = float(os.getenv("UPLOADS_MAX_AGE_HOURS", "168")) * 3600
+
+# Max number of propagated frames whose masks are waiting to be encoded and sent
+# by /propagate_in_video (the inference runs ahead of the encoding up to this number)
+MASK_STREAM_QUEUE_SIZE = int(os.getenv("MASK_STREAM_QUEUE_SIZE", "8"))
+
+# Max time an interactive request waits for the incremental /propagate_in_video of its
+# session to be sent (the masks tracked for the session are reset if it's still running)
+MASK_STREAM_WAIT_SEC = float(os.getenv("MASK_STREAM_WAIT_SEC", "10"))
+
+# Stop a re-propagation (e.g. after a correction) once the masks of all the objects
+# match those of the previous propagation with at least this IoU on as many
+# consecutive frames as the model has memory frames, and reuse the previous masks
+# beyond (see `SAM2VideoPredictor.propagate_in_video`). 0 disables the early stop.
+PROPAGATION_EARLY_STOP_IOU = float(os.getenv("PROPAGATION_EARLY_STOP_IOU", "0.99"))
+
 # Prefix for video posters (1st frame of video)
 POSTERS_PREFIX = "posters"
 
 # Path where all posters are stored
 POSTERS_PATH = DATA_PATH / POSTERS_PREFIX
 
+# Whether to cache the decoded frames of the gallery videos (resized for the model, as
+# uint8) in memory-mapped files, so starting a session on
+# a gallery video doesn't decode it, and whether to also cache the backbone features
+# of their first frame. The files should be on a local disk.
+FRAME_CACHE_GALLERY = os.getenv("FRAME_CACHE_GALLERY", "1") == "1"
+FRAME_CACHE_FEATURES = os.getenv("FRAME_CACHE_FEATURES", "1") == "1"
+FRAME_CACHE_PATH = Path(os.getenv("FRAME_CACHE_PATH", str(DATA_PATH / "frame_cache")))
+
 # Make sure any of those paths exist
 os.makedirs(DATA_PATH, exist_ok=True)
 os.makedirs(GALLERY_PATH, exist_ok=True)
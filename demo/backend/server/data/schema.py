@@ -3,7 +3,6 @@
 # This source code is licensed under the license found in the
 # LICENSE file in the root directory of this source tree.
 
-import hashlib
 import os
 import shutil
 import tempfile
@@ -38,7 +37,20 @@ from data.data_types import (
 )
 from data.loader import get_video
 from data.store import get_videos
-from data.transcoder import get_video_metadata, transcode, VideoMetadata
+from data.transcoder import (
+    get_encode_settings,
+    get_video_metadata,
+    transcode,
+    VideoMetadata,
+)
+from data.upload_cache import (
+    add_cached_upload,
+    evict_uploads,
+    get_cached_upload,
+    get_upload_cache_key,
+    hash_file,
+    save_upload,
+)
 from inference.data_types import (
     AddPointsRequest,
     CancelPropagateInVideoRequest,
@@ -259,10 +271,10 @@ class Mutation:
 def get_file_hash(video_path_or_file) -> str:
     if isinstance(video_path_or_file, str):
         with open(video_path_or_file, "rb") as in_f:
-            result = hashlib.sha256(in_f.read()).hexdigest()
+            result = hash_file(in_f)
     else:
         video_path_or_file.seek(0)
-        result = hashlib.sha256(video_path_or_file.read()).hexdigest()
+        result = hash_file(video_path_or_file)
     return result
 
 
@@ -291,13 +303,30 @@ def process_video(
     """
     Process file upload including video trimming and content moderation checks.
 
+    The transcoded videos are cached by the hash of the upload, the trim window
+    and the encode settings, so re-uploading a video returns its previously
+    transcoded video without transcoding it again.
+
     Returns the filepath, s3_file_key, hash & video metaedata as a tuple.
     """
+    start_time_sec, duration_time_sec = _get_start_sec_duration_sec(
+        max_time=max_time,
+        start_time_sec=start_time_sec,
+        duration_time_sec=duration_time_sec,
+    )
     with tempfile.TemporaryDirectory() as tempdir:
         in_path = f"{tempdir}/in.mp4"
         out_path = f"{tempdir}/out.mp4"
-        with open(in_path, "wb") as in_f:
-            in_f.write(file.read())
+        source_hash = save_upload(file, in_path)
+
+        cache_key = get_upload_cache_key(
+            source_hash, start_time_sec, duration_time_sec, get_encode_settings()
+        )
+        cached_upload = get_cached_upload(cache_key)
+        if cached_upload is not None:
+            filepath, out_video_metadata = cached_upload
+            file_key = UPLOADS_PREFIX + "/" + os.path.basename(filepath)
+            return filepath, file_key, out_video_metadata
 
         try:
             video_metadata = get_video_metadata(in_path)
@@ -312,12 +341,6 @@ def process_video(
         if video_metadata.duration_sec in (None, 0):
             raise Exception("video container does time duration metadata")
 
-        start_time_sec, duration_time_sec = _get_start_sec_duration_sec(
-            max_time=max_time,
-            start_time_sec=start_time_sec,
-            duration_time_sec=duration_time_sec,
-        )
-
         # Transcode video to make sure videos returned to the app are all in
         # the same format, duration, resolution, fps.
         transcode(
@@ -347,6 +370,8 @@ def process_video(
 
         assert filepath is not None and file_key is not None
         shutil.move(out_path, filepath)
+        add_cached_upload(cache_key, filepath, out_video_metadata)
+        evict_uploads(keep=[filepath])
 
         return filepath, file_key, out_video_metadata
 
@@ -9,7 +9,7 @@ import os
 import shutil
 import subprocess
 from dataclasses import dataclass
-from typing import Optional
+from typing import Any, Dict, Optional
 
 import av
 from app_conf import FFMPEG_NUM_THREADS
@@ -32,6 +32,21 @@ class VideoMetadata:
     video_start_time: float
 
 
+def get_encode_settings() -> Dict[str, Any]:
+    """
+    Return the settings of the transcoded videos (including the transcode version),
+    which identify a transcoded video together with its source and trim window.
+    """
+    return {
+        "codec": os.environ.get("VIDEO_ENCODE_CODEC", "libx264"),
+        "crf": int(os.environ.get("VIDEO_ENCODE_CRF", "23")),
+        "fps": int(os.environ.get("VIDEO_ENCODE_FPS", "24")),
+        "max_w": int(os.environ.get("VIDEO_ENCODE_MAX_WIDTH", "1280")),
+        "max_h": int(os.environ.get("VIDEO_ENCODE_MAX_HEIGHT", "720")),
+        "version": TRANSCODE_VERSION,
+    }
+
+
 def transcode(
     in_path: str,
     out_path: str,
@@ -39,24 +54,20 @@ def transcode(
     seek_t: float,
     duration_time_sec: float,
 ):
-    codec = os.environ.get("VIDEO_ENCODE_CODEC", "libx264")
-    crf = int(os.environ.get("VIDEO_ENCODE_CRF", "23"))
-    fps = int(os.environ.get("VIDEO_ENCODE_FPS", "24"))
-    max_w = int(os.environ.get("VIDEO_ENCODE_MAX_WIDTH", "1280"))
-    max_h = int(os.environ.get("VIDEO_ENCODE_MAX_HEIGHT", "720"))
+    settings = get_encode_settings()
     verbose = ast.literal_eval(os.environ.get("VIDEO_ENCODE_VERBOSE", "False"))
 
     normalize_video(
         in_path=in_path,
         out_path=out_path,
-        max_w=max_w,
-        max_h=max_h,
+        max_w=settings["max_w"],
+        max_h=settings["max_h"],
         seek_t=seek_t,
         max_time=duration_time_sec,
         in_metadata=in_metadata,
-        codec=codec,
-        crf=crf,
-        fps=fps,
+        codec=settings["codec"],
+        crf=settings["crf"],
+        fps=settings["fps"],
         verbose=verbose,
     )
 
@@ -0,0 +1,164 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, BinaryIO, Dict, Iterable, List, Optional, Tuple
+
+from app_conf import UPLOADS_MAX_AGE_SEC, UPLOADS_MAX_SIZE_BYTES, UPLOADS_PATH
+from data.transcoder import VideoMetadata
+
+logger = logging.getLogger(__name__)
+
+# Size of the chunks read when streaming and hashing files
+HASH_CHUNK_SIZE = 1 << 20
+
+# Index of the transcoded uploads, with one entry per (source hash, trim window,
+# encode settings) pointing to the transcoded video in UPLOADS_PATH
+UPLOADS_INDEX_PATH = UPLOADS_PATH / ".index"
+
+os.makedirs(UPLOADS_INDEX_PATH, exist_ok=True)
+
+
+def hash_file(file: BinaryIO, chunk_size: int = HASH_CHUNK_SIZE) -> str:
+    """
+    Return the sha256 hex digest of a file object from its current position,
+    reading it in chunks.
+    """
+    file_hash = hashlib.sha256()
+    for chunk in iter(lambda: file.read(chunk_size), b""):
+        file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def save_upload(file: BinaryIO, path: str, chunk_size: int = HASH_CHUNK_SIZE) -> str:
+    """
+    Stream an uploaded file to disk in chunks, and return the sha256 hex digest
+    of its content (computed while it's written).
+    """
+    file_hash = hashlib.sha256()
+    with open(path, "wb") as out_f:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            file_hash.update(chunk)
+            out_f.write(chunk)
+    return file_hash.hexdigest()
+
+
+def get_upload_cache_key(
+    source_hash: str,
+    start_time_sec: float,
+    duration_time_sec: float,
+    encode_settings: Dict[str, Any],
+) -> str:
+    """
+    Return the key of the transcoded video of an upload, which identifies its
+    source content, trim window and encode settings.
+    """
+    key = {
+        "source_hash": source_hash,
+        "start_time_sec": start_time_sec,
+        "duration_time_sec": duration_time_sec,
+        "encode_settings": encode_settings,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def _get_index_entry_path(cache_key: str) -> str:
+    return os.path.join(UPLOADS_INDEX_PATH, f"{cache_key}.json")
+
+
+def get_cached_upload(cache_key: str) -> Optional[Tuple[str, VideoMetadata]]:
+    """
+    Return the filepath and metadata of the transcoded video of a cache key, or
+    None if it's not in the index (or was evicted).
+    """
+    entry_path = _get_index_entry_path(cache_key)
+    try:
+        with open(entry_path, "r") as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    filepath = os.path.join(UPLOADS_PATH, entry["filename"])
+    try:
+        # refresh the age of the video for the eviction policy
+        os.utime(filepath)
+    except FileNotFoundError:
+        os.remove(entry_path)
+        return None
+    return filepath, VideoMetadata.from_dict(entry["metadata"])
+
+
+def add_cached_upload(
+    cache_key: str, filepath: str, video_metadata: VideoMetadata
+) -> None:
+    """
+    Add the transcoded video of a cache key (in UPLOADS_PATH) to the index.
+    """
+    entry = {
+        "filename": os.path.basename(filepath),
+        "metadata": video_metadata.to_dict(),
+    }
+    entry_path = _get_index_entry_path(cache_key)
+    # write the entry atomically, as concurrent requests might read it
+    tmp_path = f"{entry_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(entry, f)
+    os.replace(tmp_path, entry_path)
+
+
+def evict_uploads(
+    max_size_bytes: int = UPLOADS_MAX_SIZE_BYTES,
+    max_age_sec: float = UPLOADS_MAX_AGE_SEC,
+    keep: Iterable[str] = (),
+) -> List[str]:
+    """
+    Remove the transcoded videos of UPLOADS_PATH which were last uploaded more than
+    `max_age_sec` ago, then the least recently uploaded ones until their total
+    size is at most `max_size_bytes` (except the `keep` filepaths), along with
+    their index entries. Return the removed filepaths.
+    """
+    keep = {os.path.abspath(p) for p in keep}
+    files = []
+    for entry in os.scandir(UPLOADS_PATH):
+        if entry.is_file() and entry.name.endswith(".mp4"):
+            stat = entry.stat()
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+    # least recently uploaded first
+    files.sort()
+
+    now = time.time()
+    total_size = sum(size for _, size, _ in files)
+    removed = []
+    for mtime, size, path in files:
+        if now - mtime <= max_age_sec and total_size <= max_size_bytes:
+            break
+        if os.path.abspath(path) in keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_size -= size
+        removed.append(path)
+
+    if removed:
+        removed_filenames = {os.path.basename(p) for p in removed}
+        for entry in os.scandir(UPLOADS_INDEX_PATH):
+            try:
+                with open(entry.path, "r") as f:
+                    filename = json.load(f)["filename"]
+            except (OSError, ValueError, KeyError):
+                continue
+            if filename in removed_filenames:
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+        logger.info(f"evicted {len(removed)} uploaded videos from {UPLOADS_PATH}")
+    return removed
@@ -111,6 +111,21 @@ class PropagateInVideoRequest(BaseRequest):
     type: str
     session_id: str
     start_frame_index: int
+    # Only send the masks that changed since the last ones sent to the client (see
+    # `inference.mask_stream.SentMasks`). The client merges the streamed frames into
+    # the masks it holds, by frame index and object id:
+    # - a frame that isn't streamed keeps all its masks,
+    # - an object that isn't in a streamed frame keeps its mask on this frame,
+    # - an object in a streamed frame gets the streamed mask, or in the binary format
+    #   with the `MASK_KIND_XOR` kind, the XOR of the streamed mask with its mask on
+    #   this frame.
+    # The masks held by the client must be exactly the last ones sent by the server,
+    # including the masks returned by the other requests of the session (e.g. by
+    # `add_points` or `remove_object`, after which the removed object is dropped from
+    # all the frames, and nothing after `clear_points_in_video`). A client that stops
+    # consuming a stream before its end (e.g. after `cancel_propagate_in_video`) must
+    # make its next propagation non-incremental, which sends all the masks again.
+    incremental: bool = False
 
 
 @dataclass_json
@@ -0,0 +1,168 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import hashlib
+import json
+import logging
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import torch
+from data.upload_cache import hash_file
+
+logger = logging.getLogger(__name__)
+
+# Version of the cached frames, to bump whenever the frame preprocessing changes
+FRAME_CACHE_VERSION = 2
+
+
+@dataclass
+class CachedVideo:
+    # Key of the cached frames, from the content of the video and the preprocessing
+    frames_key: str
+    # Resized frames (num_frames x 3 x image_size x image_size) as uint8, memory-mapped
+    # read-only from disk (copy-on-write), to be normalized with `normalize_frames`
+    images: torch.Tensor
+    video_height: int
+    video_width: int
+    # The "backbone_fpn" and "vision_pos_enc" outputs of the first frame, if they
+    # were precomputed
+    first_frame_backbone_out: Optional[Dict[str, List[torch.Tensor]]] = None
+
+
+def _write_frames(
+    video_path: str, image_size: int, frames_path: str
+) -> Dict[str, Any]:
+    """
+    Decode and resize the frames of a video as in
+    `sam2.utils.misc.load_video_frames_from_video_file`, and write them to a uint8
+    .npy file one frame at a time (so the whole video is never held in memory). Return
+    the metadata of the video.
+    """
+    import decord
+
+    decord.bridge.set_bridge("torch")
+    video_height, video_width, _ = decord.VideoReader(video_path).next().shape
+    reader = decord.VideoReader(video_path, width=image_size, height=image_size)
+    images = np.lib.format.open_memmap(
+        frames_path,
+        mode="w+",
+        dtype=np.uint8,
+        shape=(len(reader), 3, image_size, image_size),
+    )
+    num_frames = 0
+    for frame in reader:
+        images[num_frames] = frame.permute(2, 0, 1).numpy()
+        num_frames += 1
+    images.flush()
+    del images
+    return {
+        "num_frames": num_frames,
+        "video_height": video_height,
+        "video_width": video_width,
+    }
+
+
+class FrameCache:
+    """
+    Cache of the frames of known videos (e.g. the gallery videos), resized for the
+    model and stored in uint8 .npy files on local disk.
+    The files are memory-mapped read-only and shared by all the sessions on a video,
+    so starting a session doesn't decode the video. The backbone features of the
+    first frame can also be precomputed and cached, so starting a session doesn't run
+    the image encoder either.
+
+    The files are keyed by the content of the videos and the preprocessing (and the
+    model for the features), so they are reused across restarts of the server.
+    """
+
+    def __init__(self, cache_path: Path, image_size: int, model_key: str) -> None:
+        self.cache_path = cache_path
+        self.image_size = image_size
+        self.model_key = model_key
+        # cached videos by the real path of their video file
+        self.videos: Dict[str, CachedVideo] = {}
+        os.makedirs(self.cache_path, exist_ok=True)
+
+    def _get_frames_key(self, video_path: str) -> str:
+        with open(video_path, "rb") as f:
+            source_hash = hash_file(f)
+        key = {
+            "source_hash": source_hash,
+            "image_size": self.image_size,
+            "version": FRAME_CACHE_VERSION,
+        }
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+    def _get_features_path(self, frames_key: str) -> str:
+        features_key = hashlib.sha256(
+            f"{frames_key}:{self.model_key}".encode()
+        ).hexdigest()
+        return os.path.join(self.cache_path, f"{features_key}.features.pt")
+
+    def add_video(self, video_path: str) -> CachedVideo:
+        """
+        Add a video to the cache, decoding it to the cache directory unless it's
+        already there.
+        """
+        frames_key = self._get_frames_key(video_path)
+        frames_path = os.path.join(self.cache_path, f"{frames_key}.frames.npy")
+        metadata_path = os.path.join(self.cache_path, f"{frames_key}.json")
+        # the metadata is written last, so a missing metadata file means that the
+        # frames are missing or incomplete (e.g. the server was stopped while writing)
+        try:
+            with open(metadata_path, "r") as f:
+                metadata = json.load(f)
+        except (OSError, ValueError):
+            logger.info(f"decoding {video_path} to the frame cache")
+            tmp_path = f"{frames_path}.{os.getpid()}.tmp.npy"
+            metadata = _write_frames(video_path, self.image_size, tmp_path)
+            os.replace(tmp_path, frames_path)
+            tmp_path = f"{metadata_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(metadata, f)
+            os.replace(tmp_path, metadata_path)
+
+        # copy-on-write mapping, so the frames are shared read-only across sessions
+        # and any (unexpected) write stays private instead of corrupting the file
+        images = np.load(frames_path, mmap_mode="c")[: metadata["num_frames"]]
+        video = CachedVideo(
+            frames_key=frames_key,
+            images=torch.from_numpy(images),
+            video_height=metadata["video_height"],
+            video_width=metadata["video_width"],
+        )
+        features_path = self._get_features_path(frames_key)
+        if os.path.exists(features_path):
+            video.first_frame_backbone_out = torch.load(
+                features_path, mmap=True, weights_only=True
+            )
+        self.videos[os.path.realpath(video_path)] = video
+        return video
+
+    def add_first_frame_features(
+        self, video_path: str, backbone_out: Dict[str, Any]
+    ) -> None:
+        """
+        Cache the backbone features (the output of `forward_image`) of the first
+        frame of a cached video.
+        """
+        video = self.videos[os.path.realpath(video_path)]
+        first_frame_backbone_out = {
+            key: [x.cpu() for x in backbone_out[key]]
+            for key in ["backbone_fpn", "vision_pos_enc"]
+        }
+        features_path = self._get_features_path(video.frames_key)
+        tmp_path = f"{features_path}.{os.getpid()}.tmp"
+        torch.save(first_frame_backbone_out, tmp_path)
+        os.replace(tmp_path, features_path)
+        video.first_frame_backbone_out = first_frame_backbone_out
+
+    def get(self, video_path: str) -> Optional[CachedVideo]:
+        """Return the cached video of a video file, or None if it's not cached."""
+        return self.videos.get(os.path.realpath(video_path))
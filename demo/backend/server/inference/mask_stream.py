@@ -0,0 +1,457 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Encoding of the masks streamed by /propagate_in_video, either as JSON (a
+`PropagateDataResponse` with COCO RLE strings, the default) or in a compact binary
+format. A binary frame is a sequence of unsigned LEB128 varints:
+
+    frame_index height width num_objects
+    (object_id num_counts delta_1 ... delta_{num_counts}) * num_objects
+
+where the counts are the lengths of the alternating runs of 0s and 1s (starting with
+0s) of each mask flattened in column-major order, as the uncompressed counts of a COCO
+RLE. As in the compressed COCO RLE strings, each count is stored as its (zigzag-encoded)
+difference with the count two runs before (i.e. the previous run of the same value),
+which is small for the masks of objects spanning several columns.
+
+An incremental propagation (`PropagateInVideoRequest.incremental`) only sends what
+changed since the last masks sent to the client (tracked by `SentMasks`): the frames
+where no mask changed are skipped, and the other frames only contain the objects whose
+mask changed. In the binary format, these frames are:
+
+    frame_index height width num_objects
+    (object_id kind num_counts delta_1 ... delta_{num_counts}) * num_objects
+
+where `kind` is `MASK_KIND_FULL` if the counts are those of the new mask, or
+`MASK_KIND_XOR` if they are those of the XOR of the new mask with the last one sent
+for the object on the frame (whichever is shorter). See `PropagateInVideoRequest` for
+how a client merges them.
+"""
+
+import queue
+from threading import Condition, Event, Lock, Thread
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+import numpy as np
+from inference.data_types import Mask, PropagateDataResponse, PropagateDataValue
+from pycocotools.mask import encode as encode_masks
+
+T = TypeVar("T")
+
+# Kinds of the masks of the frames of an incremental propagation in the binary format
+MASK_KIND_FULL = 0
+MASK_KIND_XOR = 1
+
+
+def get_rle_mask_list(
+    object_ids: List[int], masks: np.ndarray
+) -> List[PropagateDataValue]:
+    """
+    Return a list of data values, i.e. list of object/mask combos.
+    """
+    return [
+        get_mask_for_object(object_id=object_id, mask=mask)
+        for object_id, mask in zip(object_ids, masks)
+    ]
+
+
+def get_mask_for_object(object_id: int, mask: np.ndarray) -> PropagateDataValue:
+    """
+    Create a data value for an object/mask combo.
+    """
+    mask_rle = encode_masks(np.array(mask, dtype=np.uint8, order="F"))
+    mask_rle["counts"] = mask_rle["counts"].decode()
+    return PropagateDataValue(
+        object_id=object_id,
+        mask=Mask(
+            size=mask_rle["size"],
+            counts=mask_rle["counts"],
+        ),
+    )
+
+
+def encode_json_frame(
+    frame_index: int, object_ids: List[int], masks: np.ndarray
+) -> bytes:
+    """Encode the masks of the objects on a frame as a JSON `PropagateDataResponse`."""
+    response = PropagateDataResponse(
+        frame_index=frame_index,
+        results=get_rle_mask_list(object_ids=object_ids, masks=masks),
+    )
+    return response.to_json().encode("UTF-8")
+
+
+def encode_varints(values: np.ndarray) -> bytes:
+    """Encode non-negative integers as unsigned LEB128 varints."""
+    values = np.asarray(values, dtype=np.uint64)
+    num_bytes = np.ones(len(values), dtype=np.int64)
+    high_bits = values >> np.uint64(7)
+    while high_bits.any():
+        num_bytes += high_bits > 0
+        high_bits >>= np.uint64(7)
+    max_num_bytes = num_bytes.max(initial=0)
+    # byte k of each value, with the continuation bit set on all but its last byte
+    data = np.empty((len(values), max_num_bytes), dtype=np.uint8)
+    for k in range(max_num_bytes):
+        data[:, k] = (values >> np.uint64(7 * k)) & np.uint64(0x7F)
+        data[:, k] |= np.where(k < num_bytes - 1, 0x80, 0).astype(np.uint8)
+    return data[np.arange(max_num_bytes) < num_bytes[:, None]].tobytes()
+
+
+def decode_varints(data: bytes) -> np.ndarray:
+    """Decode a sequence of unsigned LEB128 varints."""
+    data = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero((data & 0x80) == 0)
+    if len(ends) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    # position of each byte in its varint
+    positions = np.arange(len(data)) - np.repeat(starts, ends - starts + 1)
+    groups = (data & 0x7F).astype(np.uint64) << (7 * positions).astype(np.uint64)
+    return np.add.reduceat(groups, starts)
+
+
+def get_rle_counts(masks: np.ndarray) -> List[np.ndarray]:
+    """
+    Return the uncompressed COCO RLE counts of masks (num_masks x height x width), i.e.
+    the lengths of the alternating runs of 0s and 1s (starting with 0s) of each mask
+    flattened in column-major order.
+    """
+    masks = np.asarray(masks, dtype=bool)
+    num_masks, height, width = masks.shape
+    size = height * width
+    if num_masks == 0:
+        return []
+    # Find the transitions in the row-major layout of the masks (which avoids
+    # transposing them), then sort their (few) positions in column-major order: the
+    # transitions within a column, and between the end of a column and the start of
+    # the next one
+    inds = np.flatnonzero(masks[:, 1:, :] != masks[:, :-1, :])
+    mask_inds, inds = np.divmod(inds, (height - 1) * width)
+    rows, cols = np.divmod(inds, width)
+    positions = [mask_inds * size + cols * height + rows + 1]
+    inds = np.flatnonzero(masks[:, 0, 1:] != masks[:, -1, :-1])
+    mask_inds, cols = np.divmod(inds, width - 1)
+    positions.append(mask_inds * size + (cols + 1) * height)
+    positions = np.sort(np.concatenate(positions))
+    splits = np.searchsorted(positions, np.arange(1, num_masks) * size)
+
+    counts = []
+    for mask_idx, mask_positions in enumerate(np.split(positions, splits)):
+        # a mask starting with 1s starts with an empty run of 0s
+        start = [0, 0] if size > 0 and masks[mask_idx, 0, 0] else [0]
+        mask_positions = mask_positions - mask_idx * size
+        counts.append(np.diff(np.concatenate([start, mask_positions, [size]])))
+    return counts
+
+
+def _encode_count_deltas(counts: np.ndarray) -> np.ndarray:
+    deltas = counts.astype(np.int64)
+    deltas[2:] -= counts[:-2]
+    # zigzag encoding of the signed differences
+    return np.where(deltas >= 0, 2 * deltas, -2 * deltas - 1)
+
+
+def _decode_count_deltas(values: np.ndarray) -> np.ndarray:
+    deltas = np.where(values % 2 == 0, values // 2, -(values + 1) // 2)
+    counts = np.empty_like(deltas)
+    counts[0::2] = np.cumsum(deltas[0::2])
+    counts[1::2] = np.cumsum(deltas[1::2])
+    return counts
+
+
+def encode_binary_frame(
+    frame_index: int, object_ids: List[int], masks: np.ndarray
+) -> bytes:
+    """Encode the masks of the objects on a frame in the binary format."""
+    height, width = masks.shape[-2:]
+    values = [np.array([frame_index, height, width, len(object_ids)])]
+    for object_id, counts in zip(object_ids, get_rle_counts(masks)):
+        values.append(np.array([object_id, len(counts)]))
+        values.append(_encode_count_deltas(counts))
+    return encode_varints(np.concatenate(values))
+
+
+def decode_binary_frame(
+    data: bytes,
+) -> Tuple[int, Tuple[int, int], List[Tuple[int, np.ndarray]]]:
+    """
+    Decode a frame in the binary format, returns the frame index, the size (height,
+    width) of the masks and the RLE counts of each object id.
+    """
+    values = decode_varints(data).astype(np.int64)
+    frame_index, height, width, num_objects = values[:4].tolist()
+    results = []
+    offset = 4
+    for _ in range(num_objects):
+        object_id, num_counts = values[offset : offset + 2].tolist()
+        offset += 2
+        counts = _decode_count_deltas(values[offset : offset + num_counts])
+        results.append((object_id, counts))
+        offset += num_counts
+    return frame_index, (height, width), results
+
+
+def decode_rle_counts(counts: np.ndarray, size: Tuple[int, int]) -> np.ndarray:
+    """Decode uncompressed COCO RLE counts to a binary mask of a given size."""
+    height, width = size
+    values = np.arange(len(counts)) % 2
+    return np.repeat(values.astype(bool), counts).reshape(width, height).T
+
+
+def xor_rle_counts(counts: np.ndarray, other_counts: np.ndarray) -> np.ndarray:
+    """
+    Return the RLE counts of the XOR of two masks of the same size given by their RLE
+    counts, which are the runs between the positions where exactly one of the masks
+    changes value. As XOR is its own inverse, this also applies an XOR delta to a mask.
+    """
+    size = int(np.sum(counts))
+    positions = np.setxor1d(np.cumsum(counts)[:-1], np.cumsum(other_counts)[:-1])
+    return np.diff(np.concatenate([[0], positions, [size]])).astype(np.int64)
+
+
+def _encode_rle(counts: np.ndarray) -> bytes:
+    return encode_varints(_encode_count_deltas(counts))
+
+
+def _decode_rle(data: bytes) -> np.ndarray:
+    return _decode_count_deltas(decode_varints(data).astype(np.int64))
+
+
+class SentMasks:
+    """
+    The last masks sent to the client of a session, by frame and object, stored as
+    their varint-encoded RLE counts (a few KB per mask) to find what changed in the
+    next incremental propagation.
+    They are only tracked once the client requested an incremental propagation, and
+    must then be updated with every mask sent to the client (including the masks
+    returned by the interactive requests).
+
+    The masks of an incremental propagation are tracked by the thread sending them,
+    which runs between `begin_stream` and `end_stream` (after the inference released
+    its lock), while the interactive requests update them from other threads. These
+    requests should first wait for the streams in flight (`wait_for_streams`), and call
+    `reset_if_streaming` under the inference lock: if a stream is still running, the
+    tracked masks are forgotten, and the rest of the stream is sent in full without
+    being tracked, so the masks held by the client and the tracked ones don't drift.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.masks: Dict[int, Dict[int, bytes]] = {}
+        # incremented by each reset during a stream, to tell the stale streams
+        self.generation = 0
+        self.num_streams = 0
+        self.lock = Lock()
+        self.streams_done = Condition(self.lock)
+
+    def set_enabled(self, enabled: bool) -> None:
+        """Start or stop tracking the masks (stopping forgets the tracked masks)."""
+        with self.lock:
+            self.enabled = enabled
+            if not enabled:
+                self.masks.clear()
+
+    def clear(self) -> None:
+        """Forget the tracked masks, e.g. when the client clears all its masks."""
+        with self.lock:
+            self.masks.clear()
+
+    def remove_object(self, object_id: int) -> None:
+        with self.lock:
+            for frame_masks in self.masks.values():
+                frame_masks.pop(object_id, None)
+
+    def begin_stream(self) -> int:
+        """Start sending an incremental propagation, returns its generation."""
+        with self.lock:
+            self.num_streams += 1
+            return self.generation
+
+    def end_stream(self) -> None:
+        with self.lock:
+            self.num_streams -= 1
+            self.streams_done.notify_all()
+
+    def wait_for_streams(self, timeout: float) -> bool:
+        """Wait for the incremental propagations in flight to be sent."""
+        with self.lock:
+            return self.streams_done.wait_for(lambda: self.num_streams == 0, timeout)
+
+    def reset_if_streaming(self) -> bool:
+        """
+        Forget the tracked masks if an incremental propagation is still being sent
+        (and make it stale), returns whether they were reset.
+        """
+        with self.lock:
+            if self.num_streams == 0:
+                return False
+            self.masks.clear()
+            self.generation += 1
+            return True
+
+    def update(
+        self, frame_index: int, object_ids: List[int], masks: np.ndarray
+    ) -> None:
+        """Track masks sent to the client (if the tracking is enabled)."""
+        if self.enabled:
+            self.get_changes(frame_index, object_ids, masks, allow_xor=False)
+
+    def get_changes(
+        self,
+        frame_index: int,
+        object_ids: List[int],
+        masks: np.ndarray,
+        allow_xor: bool = True,
+        generation: Optional[int] = None,
+    ) -> List[Tuple[int, int, np.ndarray]]:
+        """
+        Track the masks of the objects on a frame, and return the kind
+        (`MASK_KIND_FULL` or `MASK_KIND_XOR`) and RLE counts of those that changed
+        since they were last tracked, by object id. The masks of a stale stream (whose
+        `generation` is older than the last reset) are all returned in full and
+        untracked.
+        """
+        with self.lock:
+            stale = generation is not None and generation != self.generation
+            frame_masks = self.masks.setdefault(frame_index, {})
+            changes = []
+            for object_id, counts in zip(object_ids, get_rle_counts(masks)):
+                if stale:
+                    # the client may end up with this mask or the one of the
+                    # interactive request which reset the tracked masks
+                    frame_masks.pop(object_id, None)
+                    changes.append((object_id, MASK_KIND_FULL, counts))
+                    continue
+                rle = _encode_rle(counts)
+                last_rle = frame_masks.get(object_id)
+                if rle == last_rle:
+                    continue
+                frame_masks[object_id] = rle
+                if allow_xor and last_rle is not None:
+                    xor_counts = xor_rle_counts(_decode_rle(last_rle), counts)
+                    if len(xor_counts) < len(counts):
+                        changes.append((object_id, MASK_KIND_XOR, xor_counts))
+                        continue
+                changes.append((object_id, MASK_KIND_FULL, counts))
+            return changes
+
+
+def encode_incremental_json_frame(
+    sent_masks: SentMasks,
+    frame_index: int,
+    object_ids: List[int],
+    masks: np.ndarray,
+    generation: Optional[int] = None,
+) -> Optional[bytes]:
+    """
+    Encode the masks that changed on a frame as a JSON `PropagateDataResponse` (with
+    full masks), or return None if none changed. `generation` is the one returned by
+    `SentMasks.begin_stream` for the stream.
+    """
+    changes = sent_masks.get_changes(
+        frame_index, object_ids, masks, allow_xor=False, generation=generation
+    )
+    if len(changes) == 0:
+        return None
+    changed_object_ids = {object_id for object_id, _, _ in changes}
+    inds = [
+        i for i, object_id in enumerate(object_ids) if object_id in changed_object_ids
+    ]
+    return encode_json_frame(frame_index, [object_ids[i] for i in inds], masks[inds])
+
+
+def encode_incremental_binary_frame(
+    sent_masks: SentMasks,
+    frame_index: int,
+    object_ids: List[int],
+    masks: np.ndarray,
+    generation: Optional[int] = None,
+) -> Optional[bytes]:
+    """
+    Encode the masks that changed on a frame in the binary format of the incremental
+    propagations, or return None if none changed. `generation` is the one returned by
+    `SentMasks.begin_stream` for the stream.
+    """
+    changes = sent_masks.get_changes(
+        frame_index, object_ids, masks, generation=generation
+    )
+    if len(changes) == 0:
+        return None
+    height, width = masks.shape[-2:]
+    values = [np.array([frame_index, height, width, len(changes)])]
+    for object_id, kind, counts in changes:
+        values.append(np.array([object_id, kind, len(counts)]))
+        values.append(_encode_count_deltas(counts))
+    return encode_varints(np.concatenate(values))
+
+
+def decode_incremental_binary_frame(
+    data: bytes,
+) -> Tuple[int, Tuple[int, int], List[Tuple[int, int, np.ndarray]]]:
+    """
+    Decode a frame in the binary format of the incremental propagations, returns the
+    frame index, the size (height, width) of the masks and the kind and RLE counts of
+    each changed object id.
+    """
+    values = decode_varints(data).astype(np.int64)
+    frame_index, height, width, num_objects = values[:4].tolist()
+    results = []
+    offset = 4
+    for _ in range(num_objects):
+        object_id, kind, num_counts = values[offset : offset + 3].tolist()
+        offset += 3
+        counts = _decode_count_deltas(values[offset : offset + num_counts])
+        results.append((object_id, kind, counts))
+        offset += num_counts
+    return frame_index, (height, width), results
+
+
+def stream_in_thread(items: Iterable[T], max_queue_size: int) -> Iterator[T]:
+    """
+    Iterate `items` in a background thread and yield them through a bounded queue, so
+    the consumer (e.g. encoding and sending the masks) runs in parallel with the
+    producer (e.g. the inference), which stays at most `max_queue_size` items ahead.
+    Closing the returned generator stops the background thread after its current item
+    (and closes `items` if it's a generator).
+    """
+    item_queue = queue.Queue(maxsize=max_queue_size)
+    stopped = Event()
+
+    def _put(entry) -> bool:
+        while not stopped.is_set():
+            try:
+                item_queue.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce():
+        iterator = iter(items)
+        try:
+            for item in iterator:
+                if not _put((item, None)):
+                    break
+        except Exception as e:
+            _put((None, e))
+        finally:
+            if hasattr(iterator, "close"):
+                iterator.close()
+            _put((None, StopIteration()))
+
+    thread = Thread(target=_produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, exception = item_queue.get()
+            if isinstance(exception, StopIteration):
+                return
+            if exception is not None:
+                raise exception
+            yield item
+    finally:
+        stopped.set()
@@ -9,11 +9,19 @@ import os
 import uuid
 from pathlib import Path
 from threading import Lock
-from typing import Any, Dict, Generator, List
+from typing import Any, Dict, Generator, List, Tuple
 
 import numpy as np
 import torch
-from app_conf import APP_ROOT, MODEL_SIZE
+from app_conf import (
+    APP_ROOT,
+    FRAME_CACHE_FEATURES,
+    FRAME_CACHE_GALLERY,
+    FRAME_CACHE_PATH,
+    MASK_STREAM_WAIT_SEC,
+    MODEL_SIZE,
+    PROPAGATION_EARLY_STOP_IOU,
+)
 from inference.data_types import (
     AddMaskRequest,
     AddPointsRequest,
@@ -24,17 +32,18 @@ from inference.data_types import (
     ClearPointsInVideoResponse,
     CloseSessionRequest,
     CloseSessionResponse,
-    Mask,
     PropagateDataResponse,
-    PropagateDataValue,
     PropagateInVideoRequest,
     RemoveObjectRequest,
     RemoveObjectResponse,
     StartSessionRequest,
     StartSessionResponse,
 )
-from pycocotools.mask import decode as decode_masks, encode as encode_masks
+from inference.frame_cache import FrameCache
+from inference.mask_stream import get_rle_mask_list, SentMasks
+from pycocotools.mask import decode as decode_masks
 from sam2.build_sam import build_sam2_video_predictor
+from sam2.utils.misc import normalize_frames
 
 
 logger = logging.getLogger(__name__)
@@ -91,6 +100,41 @@ class InferenceAPI:
         )
         self.inference_lock = Lock()
 
+        self.frame_cache = None
+        if FRAME_CACHE_GALLERY:
+            # the cached features depend on the model weights and on the precision
+            # they're computed in (see `autocast_context`)
+            checkpoint_stat = os.stat(checkpoint)
+            model_key = (
+                f"{model_cfg}:{checkpoint}:{checkpoint_stat.st_size}:"
+                f"{checkpoint_stat.st_mtime_ns}:{device.type}"
+            )
+            self.frame_cache = FrameCache(
+                FRAME_CACHE_PATH, self.predictor.image_size, model_key
+            )
+
+    def preload_videos(self, video_paths: List[str]) -> None:
+        """
+        Add known videos (e.g. the gallery videos) to the frame cache, and precompute
+        the backbone features of their first frame if FRAME_CACHE_FEATURES is set.
+        """
+        if self.frame_cache is None:
+            return
+        for video_path in video_paths:
+            try:
+                video = self.frame_cache.add_video(video_path)
+            except Exception:
+                logger.exception(f"failed to add {video_path} to the frame cache")
+                continue
+            if FRAME_CACHE_FEATURES and video.first_frame_backbone_out is None:
+                with self.autocast_context(), self.inference_lock:
+                    with torch.inference_mode():
+                        image = normalize_frames(video.images[0].to(self.device))
+                        image = image.unsqueeze(0)
+                        backbone_out = self.predictor.forward_image(image)
+                self.frame_cache.add_first_frame_features(video_path, backbone_out)
+        logger.info(f"{len(self.frame_cache.videos)} videos in the frame cache")
+
     def autocast_context(self):
         if self.device.type == "cuda":
             return torch.autocast("cuda", dtype=torch.bfloat16)
@@ -103,13 +147,32 @@ class InferenceAPI:
             # for MPS devices, we offload the video frames to CPU by default to avoid
             # memory fragmentation in MPS (which sometimes crashes the entire process)
             offload_video_to_cpu = self.device.type == "mps"
-            inference_state = self.predictor.init_state(
-                request.path,
-                offload_video_to_cpu=offload_video_to_cpu,
+            cached_video = (
+                self.frame_cache.get(request.path)
+                if self.frame_cache is not None
+                else None
             )
+            if cached_video is not None:
+                # the cached frames stay memory-mapped on CPU and each frame is moved
+                # to the device when it's used
+                inference_state = self.predictor.init_state(
+                    offload_video_to_cpu=True,
+                    preloaded_frames=(
+                        cached_video.images,
+                        cached_video.video_height,
+                        cached_video.video_width,
+                    ),
+                    first_frame_backbone_out=cached_video.first_frame_backbone_out,
+                )
+            else:
+                inference_state = self.predictor.init_state(
+                    request.path,
+                    offload_video_to_cpu=offload_video_to_cpu,
+                )
             self.session_states[session_id] = {
                 "canceled": False,
                 "state": inference_state,
+                "sent_masks": SentMasks(),
             }
             return StartSessionResponse(session_id=session_id)
 
@@ -120,8 +183,10 @@ class InferenceAPI:
     def add_points(
         self, request: AddPointsRequest, test: str = ""
     ) -> PropagateDataResponse:
+        self.__wait_for_mask_streams(request.session_id)
         with self.autocast_context(), self.inference_lock:
             session = self.__get_session(request.session_id)
+            self.__reset_sent_masks_if_streaming(session)
             inference_state = session["state"]
 
             frame_idx = request.frame_index
@@ -142,8 +207,9 @@ class InferenceAPI:
             )
 
             masks_binary = (masks > self.score_thresh)[:, 0].cpu().numpy()
+            session["sent_masks"].update(frame_idx, object_ids, masks_binary)
 
-            rle_mask_list = self.__get_rle_mask_list(
+            rle_mask_list = get_rle_mask_list(
                 object_ids=object_ids, masks=masks_binary
             )
 
@@ -158,6 +224,7 @@ class InferenceAPI:
         - mask is a numpy array of shape [H_im, W_im] (containing 1 for foreground and 0 for background).
         Note: providing an input mask would overwrite any previous input points on this frame.
         """
+        self.__wait_for_mask_streams(request.session_id)
         with self.autocast_context(), self.inference_lock:
             session_id = request.session_id
             frame_idx = request.frame_index
@@ -173,6 +240,7 @@ class InferenceAPI:
                 f"add mask on frame {frame_idx} in session {session_id}: {obj_id=}, {mask.shape=}"
             )
             session = self.__get_session(session_id)
+            self.__reset_sent_masks_if_streaming(session)
             inference_state = session["state"]
 
             frame_idx, obj_ids, video_res_masks = self.model.add_new_mask(
@@ -182,8 +250,9 @@ class InferenceAPI:
                 mask=torch.tensor(mask > 0),
             )
             masks_binary = (video_res_masks > self.score_thresh)[:, 0].cpu().numpy()
+            session["sent_masks"].update(frame_idx, obj_ids, masks_binary)
 
-            rle_mask_list = self.__get_rle_mask_list(
+            rle_mask_list = get_rle_mask_list(
                 object_ids=obj_ids, masks=masks_binary
             )
 
@@ -198,6 +267,7 @@ class InferenceAPI:
         """
         Remove all input points in a specific frame.
         """
+        self.__wait_for_mask_streams(request.session_id)
         with self.autocast_context(), self.inference_lock:
             session_id = request.session_id
             frame_idx = request.frame_index
@@ -207,6 +277,7 @@ class InferenceAPI:
                 f"clear inputs on frame {frame_idx} in session {session_id}: {obj_id=}"
             )
             session = self.__get_session(session_id)
+            self.__reset_sent_masks_if_streaming(session)
             inference_state = session["state"]
             frame_idx, obj_ids, video_res_masks = (
                 self.predictor.clear_all_prompts_in_frame(
@@ -214,8 +285,9 @@ class InferenceAPI:
                 )
             )
             masks_binary = (video_res_masks > self.score_thresh)[:, 0].cpu().numpy()
+            session["sent_masks"].update(frame_idx, obj_ids, masks_binary)
 
-            rle_mask_list = self.__get_rle_mask_list(
+            rle_mask_list = get_rle_mask_list(
                 object_ids=obj_ids, masks=masks_binary
             )
 
@@ -230,32 +302,40 @@ class InferenceAPI:
         """
         Remove all input points in all frames throughout the video.
         """
+        self.__wait_for_mask_streams(request.session_id)
         with self.autocast_context(), self.inference_lock:
             session_id = request.session_id
             logger.info(f"clear all inputs across the video in session {session_id}")
             session = self.__get_session(session_id)
+            self.__reset_sent_masks_if_streaming(session)
             inference_state = session["state"]
             self.predictor.reset_state(inference_state)
+            session["sent_masks"].clear()
             return ClearPointsInVideoResponse(success=True)
 
     def remove_object(self, request: RemoveObjectRequest) -> RemoveObjectResponse:
         """
         Remove an object id from the tracking state.
         """
+        self.__wait_for_mask_streams(request.session_id)
         with self.autocast_context(), self.inference_lock:
             session_id = request.session_id
             obj_id = request.object_id
             logger.info(f"remove object in session {session_id}: {obj_id=}")
             session = self.__get_session(session_id)
+            self.__reset_sent_masks_if_streaming(session)
             inference_state = session["state"]
             new_obj_ids, updated_frames = self.predictor.remove_object(
                 inference_state, obj_id
             )
 
+            session["sent_masks"].remove_object(obj_id)
+
             results = []
             for frame_index, video_res_masks in updated_frames:
                 masks = (video_res_masks > self.score_thresh)[:, 0].cpu().numpy()
-                rle_mask_list = self.__get_rle_mask_list(
+                session["sent_masks"].update(frame_index, new_obj_ids, masks)
+                rle_mask_list = get_rle_mask_list(
                     object_ids=new_obj_ids, masks=masks
                 )
                 results.append(
@@ -270,13 +350,47 @@ class InferenceAPI:
     def propagate_in_video(
         self, request: PropagateInVideoRequest
     ) -> Generator[PropagateDataResponse, None, None]:
+        """
+        Propagate existing input points in all frames to track the object across video,
+        and return the RLE-encoded masks on each frame.
+        """
+        for frame_idx, obj_ids, masks_binary in self.propagate_masks_in_video(request):
+            yield PropagateDataResponse(
+                frame_index=frame_idx,
+                results=get_rle_mask_list(object_ids=obj_ids, masks=masks_binary),
+            )
+
+    def get_num_propagated_frames(self, request: PropagateInVideoRequest) -> int:
+        """
+        Return the number of frames returned by a propagation: all the frames of the
+        video, with the start frame returned in both directions.
+        """
+        session = self.__get_session(request.session_id)
+        return session["state"]["num_frames"] + 1
+
+    def get_sent_masks(self, request: PropagateInVideoRequest) -> SentMasks:
+        """
+        Return the last masks sent to the client of a session, for the encoding of
+        an incremental propagation.
+        """
+        session = self.__get_session(request.session_id)
+        return session["sent_masks"]
+
+    def propagate_masks_in_video(
+        self, request: PropagateInVideoRequest
+    ) -> Generator[Tuple[int, List[int], np.ndarray], None, None]:
         session_id = request.session_id
         start_frame_idx = request.start_frame_index
         propagation_direction = "both"
         max_frame_num_to_track = None
+        # a re-propagation stops tracking once the masks match the previous ones
+        early_stop_iou_thresh = PROPAGATION_EARLY_STOP_IOU or None
 
         """
-        Propagate existing input points in all frames to track the object across video.
+        Propagate existing input points in all frames to track the object across video,
+        and return the frame index, the object ids and the binary masks (as a numpy
+        array) on each frame, leaving their encoding to the caller (which can then run
+        outside of the inference lock).
         """
 
         # Note that as this method is a generator, we also need to use autocast_context
@@ -291,6 +405,9 @@ class InferenceAPI:
             try:
                 session = self.__get_session(session_id)
                 session["canceled"] = False
+                # a non-incremental propagation sends all the masks, so there's
+                # nothing to track until the client asks for an incremental one
+                session["sent_masks"].set_enabled(request.incremental)
 
                 inference_state = session["state"]
                 if propagation_direction not in ["both", "forward", "backward"]:
@@ -305,6 +422,7 @@ class InferenceAPI:
                         start_frame_idx=start_frame_idx,
                         max_frame_num_to_track=max_frame_num_to_track,
                         reverse=False,
+                        early_stop_iou_thresh=early_stop_iou_thresh,
                     ):
                         if session["canceled"]:
                             return None
@@ -313,15 +431,7 @@ class InferenceAPI:
                         masks_binary = (
                             (video_res_masks > self.score_thresh)[:, 0].cpu().numpy()
                         )
-
-                        rle_mask_list = self.__get_rle_mask_list(
-                            object_ids=obj_ids, masks=masks_binary
-                        )
-
-                        yield PropagateDataResponse(
-                            frame_index=frame_idx,
-                            results=rle_mask_list,
-                        )
+                        yield frame_idx, obj_ids, masks_binary
 
                 # Then doing the backward propagation (reverse in time)
                 if propagation_direction in ["both", "backward"]:
@@ -330,6 +440,7 @@ class InferenceAPI:
                         start_frame_idx=start_frame_idx,
                         max_frame_num_to_track=max_frame_num_to_track,
                         reverse=True,
+                        early_stop_iou_thresh=early_stop_iou_thresh,
                     ):
                         if session["canceled"]:
                             return None
@@ -338,15 +449,7 @@ class InferenceAPI:
                         masks_binary = (
                             (video_res_masks > self.score_thresh)[:, 0].cpu().numpy()
                         )
-
-                        rle_mask_list = self.__get_rle_mask_list(
-                            object_ids=obj_ids, masks=masks_binary
-                        )
-
-                        yield PropagateDataResponse(
-                            frame_index=frame_idx,
-                            results=rle_mask_list,
-                        )
+                        yield frame_idx, obj_ids, masks_binary
             finally:
                 # Log upon completion (so that e.g. we can see if two propagations happen in parallel).
                 # Using `finally` here to log even when the tracking is aborted with GeneratorExit.
@@ -361,33 +464,6 @@ class InferenceAPI:
         session["canceled"] = True
         return CancelPorpagateResponse(success=True)
 
-    def __get_rle_mask_list(
-        self, object_ids: List[int], masks: np.ndarray
-    ) -> List[PropagateDataValue]:
-        """
-        Return a list of data values, i.e. list of object/mask combos.
-        """
-        return [
-            self.__get_mask_for_object(object_id=object_id, mask=mask)
-            for object_id, mask in zip(object_ids, masks)
-        ]
-
-    def __get_mask_for_object(
-        self, object_id: int, mask: np.ndarray
-    ) -> PropagateDataValue:
-        """
-        Create a data value for an object/mask combo.
-        """
-        mask_rle = encode_masks(np.array(mask, dtype=np.uint8, order="F"))
-        mask_rle["counts"] = mask_rle["counts"].decode()
-        return PropagateDataValue(
-            object_id=object_id,
-            mask=Mask(
-                size=mask_rle["size"],
-                counts=mask_rle["counts"],
-            ),
-        )
-
     def __get_session(self, session_id: str):
         session = self.session_states.get(session_id, None)
         if session is None:
@@ -396,6 +472,27 @@ class InferenceAPI:
             )
         return session
 
+    def __wait_for_mask_streams(self, session_id: str) -> None:
+        """
+        Wait (outside of the inference lock) for the incremental propagation of a
+        session in flight to be sent, before an interactive request updates the masks
+        tracked for it.
+        """
+        session = self.__get_session(session_id)
+        if not session["sent_masks"].wait_for_streams(MASK_STREAM_WAIT_SEC):
+            logger.warning(
+                f"incremental propagation still running in session {session_id}"
+            )
+
+    def __reset_sent_masks_if_streaming(self, session) -> None:
+        """
+        Reset the masks tracked for a session (under the inference lock) if an
+        incremental propagation started or is still being sent after
+        `__wait_for_mask_streams`.
+        """
+        if session["sent_masks"].reset_if_streaming():
+            logger.info("reset the masks tracked during an incremental propagation")
+
     def __get_session_stats(self):
         """Get a statistics string for live sessions and their GPU usage."""
         # print both the session ids and their video frame numbers
@@ -1,4 +1,3 @@
-import copy
 import os
 
 import cv2
@@ -10,7 +9,11 @@ from sam2.build_sam import build_sam2, build_sam2_video_predictor
 from sam2.sam2_image_predictor import SAM2ImagePredictor
 from transformers import AutoModelForZeroShotObjectDetection, AutoProcessor
 from utils.common_utils import CommonUtils
+from utils.keyframe_scheduler import KeyframeScheduler, get_object_score_logits
+from utils.image_feature_cache import enable_image_feature_cache
 from utils.mask_dictionary_model import MaskDictionaryModel, ObjectInfo
+from utils.tiled_detection import detect_tiled_hf
+from utils.text_embedding_cache import enable_text_embedding_cache
 from utils.track_utils import sample_points_from_masks
 from utils.video_utils import create_video_from_images
 
@@ -26,12 +29,15 @@ class GroundingDinoPredictor:
     Wrapper for using a GroundingDINO model for zero-shot object detection.
     """
 
-    def __init__(self, model_id="IDEA-Research/grounding-dino-tiny", device="cuda"):
+    def __init__(
+        self, model_id="IDEA-Research/grounding-dino-tiny", device="cuda", image_size=800
+    ):
         """
         Initialize the GroundingDINO predictor.
         Args:
             model_id (str): HuggingFace model ID to load.
             device (str): Device to run the model on ('cuda' or 'cpu').
+            image_size (int): Shorter side of the model inputs (lower is faster).
         """
         from transformers import AutoModelForZeroShotObjectDetection, AutoProcessor
 
@@ -40,6 +46,13 @@ class GroundingDinoPredictor:
         self.model = AutoModelForZeroShotObjectDetection.from_pretrained(model_id).to(
             device
         )
+        # the prompt only changes with `set_prompt`, so its text embeddings are
+        # computed once instead of on every detection frame
+        enable_text_embedding_cache(self.model)
+        # the image features of the recent frames are kept, so that a frame can be
+        # queried again with another prompt without re-running the image backbone
+        self.image_cache = enable_image_feature_cache(self.model)
+        self.image_size = image_size
 
     def predict(
         self,
@@ -47,32 +60,33 @@ class GroundingDinoPredictor:
         text_prompts: str,
         box_threshold=0.25,
         text_threshold=0.25,
+        frame_key=None,
     ):
         """
-        Perform object detection using text prompts.
+        Perform object detection using text prompts (on batched tiles for
+        high-resolution frames, see `detect_tiled_hf`).
         Args:
             image (PIL.Image.Image): Input RGB image.
             text_prompts (str): Text prompt describing target objects.
             box_threshold (float): Confidence threshold for box selection.
             text_threshold (float): Confidence threshold for text match.
+            frame_key (hashable, optional): Key identifying the frame, to cache its
+                image features (see `ImageBackboneCache.frame`).
         Returns:
             Tuple[Tensor, List[str]]: Bounding boxes and matched class labels.
         """
-        inputs = self.processor(
-            images=image, text=text_prompts, return_tensors="pt"
-        ).to(self.device)
-        with torch.no_grad():
-            outputs = self.model(**inputs)
-
-        results = self.processor.post_process_grounded_object_detection(
-            outputs,
-            inputs.input_ids,
-            box_threshold=box_threshold,
-            text_threshold=text_threshold,
-            target_sizes=[image.size[::-1]],
-        )
+        with self.image_cache.frame(frame_key):
+            results = detect_tiled_hf(
+                self.model,
+                self.processor,
+                image,
+                text_prompts,
+                box_threshold=box_threshold,
+                text_threshold=text_threshold,
+                image_size=self.image_size,
+            )
 
-        return results[0]["boxes"], results[0]["labels"]
+        return results["boxes"], results["labels"]
 
 
 class SAM2ImageSegmentor:
@@ -141,6 +155,8 @@ class IncrementalObjectTracker:
         device="cuda",
         prompt_text="car.",
         detection_interval=20,
+        min_detection_interval=5,
+        keyframe_image_size=800,
     ):
         """
         Initialize an incremental object tracker using GroundingDINO and SAM2.
@@ -150,15 +166,24 @@ class IncrementalObjectTracker:
             sam2_ckpt_path (str): Path to SAM2 model checkpoint.
             device (str): Device to run the models on ('cuda' or 'cpu').
             prompt_text (str): Initial text prompt for detection.
-            detection_interval (int): Frame interval between full detections.
+            detection_interval (int): Maximum frame interval between full detections.
+            min_detection_interval (int): Minimum frame interval between full detections,
+                which run sooner than `detection_interval` when objects are lost, their
+                masks change or the frame content changes (see `KeyframeScheduler`).
+                Set it to `detection_interval` to detect at a fixed interval.
+            keyframe_image_size (int): Shorter side of the GroundingDINO inputs on the
+                detection frames (lower runs the image backbone faster).
         """
         self.device = device
         self.detection_interval = detection_interval
         self.prompt_text = prompt_text
+        self.keyframe_scheduler = KeyframeScheduler(
+            min_interval=min_detection_interval, max_interval=detection_interval
+        )
 
         # Load models
         self.grounding_predictor = GroundingDinoPredictor(
-            model_id=grounding_model_id, device=device
+            model_id=grounding_model_id, device=device, image_size=keyframe_image_size
         )
         self.sam2_segmentor = SAM2ImageSegmentor(
             sam_model_cfg=sam2_model_cfg,
@@ -174,6 +199,9 @@ class IncrementalObjectTracker:
         self.inference_state["images"] = torch.empty((0, 3, 1024, 1024), device=device)
         self.total_frames = 0
         self.objects_count = 0
+        # unlike `total_frames`, never reset (it keys the cached image features)
+        self.frame_serial = 0
+        self.last_keyframe = None
         self.frame_cache_limit = detection_interval - 1  # or higher depending on memory
 
         # Store tracking results
@@ -193,8 +221,8 @@ class IncrementalObjectTracker:
 
         img_pil = Image.fromarray(image_np)
 
-        # Step 1: Perform detection every detection_interval frames
-        if self.total_frames % self.detection_interval == 0:
+        # Step 1: Perform detection when the keyframe scheduler decides to (at most every detection_interval frames)
+        if self.keyframe_scheduler.should_detect(self.total_frames, image_np):
             if (
                 self.inference_state["video_height"] is None
                 or self.inference_state["video_width"] is None
@@ -218,7 +246,12 @@ class IncrementalObjectTracker:
                 ) = image_np.shape[:2]
 
             # 1.1 GroundingDINO object detection
-            boxes, labels = self.grounding_predictor.predict(img_pil, self.prompt_text)
+            frame_key = self.frame_serial
+            self.frame_serial += 1
+            self.last_keyframe = (frame_key, img_pil)
+            boxes, labels = self.grounding_predictor.predict(
+                img_pil, self.prompt_text, frame_key=frame_key
+            )
             if boxes.shape[0] == 0:
                 return
 
@@ -257,8 +290,10 @@ class IncrementalObjectTracker:
                     object_info.mask,
                 )
 
-            self.track_dict = copy.deepcopy(mask_dict)
+            # share the mask buffers instead of deep-copying them
+            self.track_dict = mask_dict.copy()
             self.last_mask_dict = mask_dict
+            self.keyframe_scheduler.add_keyframe(self.total_frames, image_np)
 
         else:
             # Step 2: Use incremental tracking for intermediate frames
@@ -273,22 +308,21 @@ class IncrementalObjectTracker:
         )
 
         # Step 4: Update the mask dictionary based on tracked masks
-        frame_masks = MaskDictionaryModel()
-        for i, obj_id in enumerate(obj_ids):
-            out_mask = video_res_masks[i] > 0.0
-            object_info = ObjectInfo(
-                instance_id=obj_id,
-                mask=out_mask[0],
-                class_name=self.track_dict.get_target_class_name(obj_id),
-                logit=self.track_dict.get_target_logit(obj_id),
-            )
-            object_info.update_box()
-            frame_masks.labels[obj_id] = object_info
-            frame_masks.mask_name = f"mask_{frame_idx:05d}.npy"
-            frame_masks.mask_height = out_mask.shape[-2]
-            frame_masks.mask_width = out_mask.shape[-1]
+        frame_masks = MaskDictionaryModel(mask_name=f"mask_{frame_idx:05d}.npy")
+        # the object masks are views of a single (n, h, w) tensor, with their boxes computed at once
+        frame_masks.set_tracking_masks(
+            obj_ids,
+            video_res_masks[:, 0] > 0.0,
+            class_names=[self.track_dict.get_target_class_name(obj_id) for obj_id in obj_ids],
+            logits=[self.track_dict.get_target_logit(obj_id) for obj_id in obj_ids],
+        )
 
-        self.last_mask_dict = copy.deepcopy(frame_masks)
+        self.last_mask_dict = frame_masks
+        self.keyframe_scheduler.update(
+            self.total_frames,
+            frame_masks,
+            get_object_score_logits(self.inference_state, frame_idx),
+        )
 
         # Step 5: Build mask array
         H, W = image_np.shape[:2]
@@ -316,7 +350,8 @@ class IncrementalObjectTracker:
         to force a new object detection.
         """
         self.prompt_text = new_prompt
-        self.total_frames = 0  # Trigger immediate re-detection
+        self.total_frames = 0
+        self.keyframe_scheduler.reset()  # Trigger immediate re-detection
         self.inference_state = self.video_predictor.init_state()
         self.inference_state["images"] = torch.empty(
             (0, 3, 1024, 1024), device=self.device
@@ -326,6 +361,25 @@ class IncrementalObjectTracker:
 
         print(f"[Prompt Updated] New prompt: '{new_prompt}'. Tracker state reset.")
 
+    def query_prompt(self, prompt: str, box_threshold=0.25, text_threshold=0.25):
+        """
+        Detect the objects of a prompt on the last detection frame, e.g. to preview
+        a prompt edit before `set_prompt`. The image features of the frame are
+        cached, so only the text-conditioned encoder and decoder run again.
+        Returns:
+            Tuple[Tensor, List[str]]: Bounding boxes and matched class labels.
+        """
+        if self.last_keyframe is None:
+            raise RuntimeError("No frame was detected yet.")
+        frame_key, img_pil = self.last_keyframe
+        return self.grounding_predictor.predict(
+            img_pil,
+            prompt,
+            box_threshold=box_threshold,
+            text_threshold=text_threshold,
+            frame_key=frame_key,
+        )
+
     def save_current_state(self, output_dir, raw_image: np.ndarray = None):
         """
         Save the current mask, metadata, raw image, and annotated result.
@@ -529,6 +583,7 @@ def main():
     finally:
         cap.release()
         cv2.destroyAllWindows()
+        print(f"[Info] {tracker.keyframe_scheduler.summary()}")
         print("[Done] Live inference complete.")
 
 
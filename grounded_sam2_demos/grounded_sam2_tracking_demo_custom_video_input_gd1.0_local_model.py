@@ -9,7 +9,8 @@ from tqdm import tqdm
 from PIL import Image
 from sam2.build_sam import build_sam2_video_predictor, build_sam2
 from sam2.sam2_image_predictor import SAM2ImagePredictor 
-from grounding_dino.groundingdino.util.inference import load_model, load_image, predict
+from grounding_dino.groundingdino.util.inference import load_model, load_image
+from utils.tiled_detection import detect_tiled
 from utils.track_utils import sample_points_from_masks
 from utils.video_utils import create_video_from_images
 
@@ -36,7 +37,7 @@ grounding_model = load_model(
     model_config_path=GROUNDING_DINO_CONFIG, 
     model_checkpoint_path=GROUNDING_DINO_CHECKPOINT,
     device=DEVICE
-)
+).to(DEVICE)
 
 
 # init sam image predictor and video predictor model
@@ -86,18 +87,17 @@ Step 2: Prompt Grounding DINO 1.5 with Cloud API for box coordinates
 img_path = os.path.join(SOURCE_VIDEO_FRAME_DIR, frame_names[ann_frame_idx])
 image_source, image = load_image(img_path)
 
-boxes, confidences, labels = predict(
+# the frame is sliced into batched tiles if its resolution is high (to keep small objects)
+boxes, confidences, labels = detect_tiled(
     model=grounding_model,
-    image=image,
+    image=image_source,
     caption=TEXT_PROMPT,
     box_threshold=BOX_THRESHOLD,
     text_threshold=TEXT_THRESHOLD,
 )
 
-# process the box prompt for SAM 2
-h, w, _ = image_source.shape
-boxes = boxes * torch.Tensor([w, h, w, h])
-input_boxes = box_convert(boxes=boxes, in_fmt="cxcywh", out_fmt="xyxy").numpy()
+# process the box prompt for SAM 2 (the boxes are already in (x1, y1, x2, y2) frame coordinates)
+input_boxes = boxes.numpy()
 confidences = confidences.numpy().tolist()
 class_names = labels
 
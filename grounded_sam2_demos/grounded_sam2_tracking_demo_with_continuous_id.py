@@ -10,9 +10,11 @@ from transformers import AutoProcessor, AutoModelForZeroShotObjectDetection
 from utils.track_utils import sample_points_from_masks
 from utils.video_utils import create_video_from_images
 from utils.common_utils import CommonUtils
-from utils.mask_dictionary_model import MaskDictionaryModel, ObjectInfo
-import json
-import copy
+from utils.mask_dictionary_model import MaskDictionaryModel
+from utils.label_map_store import LabelMapWriter
+from utils.text_embedding_cache import enable_text_embedding_cache
+from utils.keyframe_scheduler import KeyframeScheduler, get_object_score_logits
+from utils.tiled_detection import detect_tiled_hf
 
 """
 Step 1: Environment settings and model initialization
@@ -40,6 +42,8 @@ image_predictor = SAM2ImagePredictor(sam2_image_model)
 model_id = "IDEA-Research/grounding-dino-tiny"
 processor = AutoProcessor.from_pretrained(model_id)
 grounding_model = AutoModelForZeroShotObjectDetection.from_pretrained(model_id).to(device)
+# the same prompt is used on every keyframe, so its text embeddings are computed once
+enable_text_embedding_cache(grounding_model)
 
 
 # setup the input image and text prompt for SAM 2 and Grounding DINO
@@ -54,11 +58,10 @@ output_dir = "./outputs"
 output_video_path = "./outputs/output.mp4"
 # create the output directory
 CommonUtils.creat_dirs(output_dir)
-mask_data_dir = os.path.join(output_dir, "mask_data")
-json_data_dir = os.path.join(output_dir, "json_data")
+# all the per-frame label maps and labels are saved in a single chunked store
+label_store_dir = os.path.join(output_dir, "label_maps")
 result_dir = os.path.join(output_dir, "result")
-CommonUtils.creat_dirs(mask_data_dir)
-CommonUtils.creat_dirs(json_data_dir)
+label_writer = LabelMapWriter(label_store_dir)
 # scan all the JPEG frame names in this directory
 frame_names = [
     p for p in os.listdir(video_dir)
@@ -68,7 +71,14 @@ frame_names.sort(key=lambda p: int(os.path.splitext(p)[0]))
 
 # init video predictor state
 inference_state = video_predictor.init_state(video_path=video_dir, offload_video_to_cpu=True, async_loading_frames=True)
-step = 20 # the step to sample frames for Grounding DINO predictor
+step = 60 # the maximum step between the frames on which Grounding DINO runs
+# the detection runs again sooner when the tracking signals or the frame content change
+# (instead of every 20 frames)
+keyframe_scheduler = KeyframeScheduler(min_interval=5, max_interval=step)
+
+def read_small_frame(frame_idx):
+    # the frame difference signal of the scheduler only needs a low-res grayscale frame
+    return cv2.imread(os.path.join(video_dir, frame_names[frame_idx]), cv2.IMREAD_REDUCED_GRAYSCALE_8)
 
 sam2_masks = MaskDictionaryModel()
 PROMPT_TYPE_FOR_VIDEO = "mask" # box, mask or point
@@ -78,27 +88,19 @@ objects_count = 0
 Step 2: Prompt Grounding DINO and SAM image predictor to get the box and mask for all frames
 """
 print("Total frames:", len(frame_names))
-for start_frame_idx in range(0, len(frame_names), step):
+start_frame_idx = 0
+while start_frame_idx < len(frame_names):
 # prompt grounding dino to get the box coordinates on specific frame
     print("start_frame_idx", start_frame_idx)
+    keyframe_scheduler.add_keyframe(start_frame_idx, read_small_frame(start_frame_idx))
     # continue
     img_path = os.path.join(video_dir, frame_names[start_frame_idx])
     image = Image.open(img_path)
     image_base_name = frame_names[start_frame_idx].split(".")[0]
     mask_dict = MaskDictionaryModel(promote_type = PROMPT_TYPE_FOR_VIDEO, mask_name = f"mask_{image_base_name}.npy")
 
-    # run Grounding DINO on the image
-    inputs = processor(images=image, text=text, return_tensors="pt").to(device)
-    with torch.no_grad():
-        outputs = grounding_model(**inputs)
-
-    results = processor.post_process_grounded_object_detection(
-        outputs,
-        inputs.input_ids,
-        box_threshold=0.25,
-        text_threshold=0.25,
-        target_sizes=[image.size[::-1]]
-    )
+    # run Grounding DINO on the image (on batched tiles for high-resolution frames, to keep small objects)
+    results = [detect_tiled_hf(grounding_model, processor, image, text, box_threshold=0.25, text_threshold=0.25)]
 
     # prompt SAM image predictor to get the mask for the object
     image_predictor.set_image(np.array(image.convert("RGB")))
@@ -145,8 +147,16 @@ for start_frame_idx in range(0, len(frame_names), step):
 
     
     if len(mask_dict.labels) == 0:
-        mask_dict.save_empty_mask_and_json(mask_data_dir, json_data_dir, image_name_list = frame_names[start_frame_idx:start_frame_idx+step])
+        # nothing to track, wait for the frame content to change (or for `step` frames)
+        next_start_frame_idx = start_frame_idx + 1
+        while next_start_frame_idx < len(frame_names) and not keyframe_scheduler.should_detect(
+            next_start_frame_idx, read_small_frame(next_start_frame_idx)
+        ):
+            next_start_frame_idx += 1
+        for frame_name in frame_names[start_frame_idx:next_start_frame_idx]:
+            label_writer.add_frame(frame_name.split(".")[0], mask_dict)
         print("No object detected in the frame, skip the frame {}".format(start_frame_idx))
+        start_frame_idx = next_start_frame_idx
         continue
     else: 
         video_predictor.reset_state(inference_state)
@@ -159,45 +169,40 @@ for start_frame_idx in range(0, len(frame_names), step):
                     object_info.mask,
                 )
         
-        video_segments = {}  # output the following {step} frames tracking masks
+        video_segments = {}  # output the tracking masks until the next keyframe (at most {step} frames)
+        next_start_frame_idx = len(frame_names)
         for out_frame_idx, out_obj_ids, out_mask_logits in video_predictor.propagate_in_video(inference_state, max_frame_num_to_track=step, start_frame_idx=start_frame_idx):
-            frame_masks = MaskDictionaryModel()
-            
-            for i, out_obj_id in enumerate(out_obj_ids):
-                out_mask = (out_mask_logits[i] > 0.0) # .cpu().numpy()
-                object_info = ObjectInfo(instance_id = out_obj_id, mask = out_mask[0], class_name = mask_dict.get_target_class_name(out_obj_id))
-                object_info.update_box()
-                frame_masks.labels[out_obj_id] = object_info
-                image_base_name = frame_names[out_frame_idx].split(".")[0]
-                frame_masks.mask_name = f"mask_{image_base_name}.npy"
-                frame_masks.mask_height = out_mask.shape[-2]
-                frame_masks.mask_width = out_mask.shape[-1]
-
+            image_base_name = frame_names[out_frame_idx].split(".")[0]
+            frame_masks = MaskDictionaryModel(mask_name = f"mask_{image_base_name}.npy")
+            # the object masks are views of a single (n, h, w) tensor, with their boxes computed at once
+            out_masks = (out_mask_logits[:, 0] > 0.0)
+            class_names = [mask_dict.get_target_class_name(out_obj_id) for out_obj_id in out_obj_ids]
+            frame_masks.set_tracking_masks(out_obj_ids, out_masks, class_names)
+            # share the mask buffers instead of deep-copying them
+            sam2_masks = frame_masks.copy()
+
+            keyframe_scheduler.update(out_frame_idx, frame_masks, get_object_score_logits(inference_state, out_frame_idx))
+            if out_frame_idx > start_frame_idx and keyframe_scheduler.should_detect(out_frame_idx, read_small_frame(out_frame_idx)):
+                # re-run the detection on this frame (its tracked masks are matched with the new detections)
+                next_start_frame_idx = out_frame_idx
+                break
             video_segments[out_frame_idx] = frame_masks
-            sam2_masks = copy.deepcopy(frame_masks)
 
         print("video_segments:", len(video_segments))
     """
-    Step 5: save the tracking masks and json files
+    Step 5: save the tracking label maps and labels
     """
     for frame_idx, frame_masks_info in video_segments.items():
-        mask = frame_masks_info.labels
-        mask_img = torch.zeros(frame_masks_info.mask_height, frame_masks_info.mask_width)
-        for obj_id, obj_info in mask.items():
-            mask_img[obj_info.mask == True] = obj_id
-
-        mask_img = mask_img.numpy().astype(np.uint16)
-        np.save(os.path.join(mask_data_dir, frame_masks_info.mask_name), mask_img)
+        label_writer.add_frame(frame_names[frame_idx].split(".")[0], frame_masks_info)
+    start_frame_idx = next_start_frame_idx
 
-        json_data = frame_masks_info.to_dict()
-        json_data_path = os.path.join(json_data_dir, frame_masks_info.mask_name.replace(".npy", ".json"))
-        with open(json_data_path, "w") as f:
-            json.dump(json_data, f)
+label_writer.close()
+print(keyframe_scheduler.summary(fixed_interval=20))
 
 
 """
 Step 6: Draw the results and save the video
 """
-CommonUtils.draw_masks_and_box_with_supervision(video_dir, mask_data_dir, json_data_dir, result_dir)
+CommonUtils.draw_masks_and_box_with_supervision_from_store(video_dir, label_store_dir, result_dir)
 
 create_video_from_images(result_dir, output_video_path, frame_rate=15)
\ No newline at end of file
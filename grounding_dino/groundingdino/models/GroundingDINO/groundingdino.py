@@ -15,6 +15,7 @@
 # Copyright (c) 2020 SenseTime. All Rights Reserved.
 # ------------------------------------------------------------------------
 import copy
+from collections import OrderedDict
 from typing import List
 
 import torch
@@ -74,6 +75,7 @@ class GroundingDINO(nn.Module):
         text_encoder_type="bert-base-uncased",
         sub_sentence_present=True,
         max_text_len=256,
+        text_cache_size=16,
     ):
         """Initializes the model.
         Parameters:
@@ -82,6 +84,8 @@ class GroundingDINO(nn.Module):
             num_queries: number of object queries, ie detection slot. This is the maximal number of objects
                          Conditional DETR can detect in a single image. For COCO, we recommend 100 queries.
             aux_loss: True if auxiliary decoding losses (loss at each decoder layer) are to be used.
+            text_cache_size: number of encoded captions to keep in the text embedding cache
+                             (used at inference only, 0 to disable it). See `get_text_dict`.
         """
         super().__init__()
         self.num_queries = num_queries
@@ -91,6 +95,8 @@ class GroundingDINO(nn.Module):
         self.nheads = nheads
         self.max_text_len = 256
         self.sub_sentence_present = sub_sentence_present
+        self.text_cache_size = text_cache_size
+        self._text_cache = OrderedDict()
 
         # setting query dim
         self.query_dim = query_dim
@@ -224,30 +230,9 @@ class GroundingDINO(nn.Module):
     def init_ref_points(self, use_num_queries):
         self.refpoint_embed = nn.Embedding(use_num_queries, self.query_dim)
 
-    def forward(self, samples: NestedTensor, targets: List = None, **kw):
-        """The forward expects a NestedTensor, which consists of:
-           - samples.tensor: batched images, of shape [batch_size x 3 x H x W]
-           - samples.mask: a binary mask of shape [batch_size x H x W], containing 1 on padded pixels
-
-        It returns a dict with the following elements:
-           - "pred_logits": the classification logits (including no-object) for all queries.
-                            Shape= [batch_size x num_queries x num_classes]
-           - "pred_boxes": The normalized boxes coordinates for all queries, represented as
-                           (center_x, center_y, width, height). These values are normalized in [0, 1],
-                           relative to the size of each individual image (disregarding possible padding).
-                           See PostProcess for information on how to retrieve the unnormalized bounding box.
-           - "aux_outputs": Optional, only returned when auxilary losses are activated. It is a list of
-                            dictionnaries containing the two above keys for each decoder layer.
-        """
-        if targets is None:
-            captions = kw["captions"]
-        else:
-            captions = [t["caption"] for t in targets]
-
-        # encoder texts
-        tokenized = self.tokenizer(captions, padding="longest", return_tensors="pt").to(
-            samples.device
-        )
+    def encode_text(self, captions: List[str], device):
+        """Run the text branch (tokenizer and BERT encoder) on a batch of captions."""
+        tokenized = self.tokenizer(captions, padding="longest", return_tensors="pt").to(device)
         (
             text_self_attention_masks,
             position_ids,
@@ -295,6 +280,78 @@ class GroundingDINO(nn.Module):
             "position_ids": position_ids,  # bs, 195
             "text_self_attention_masks": text_self_attention_masks,  # bs, 195,195
         }
+        return text_dict
+
+    def _normalize_caption(self, caption: str):
+        # the BERT tokenizer ignores the surrounding whitespaces (and the case, if
+        # it is uncased), so these captions have the same embeddings
+        caption = caption.strip()
+        if getattr(self.tokenizer, "do_lower_case", False):
+            caption = caption.lower()
+        return caption
+
+    def get_text_dict(self, captions: List[str], device):
+        """
+        Same as `encode_text`, with the outputs kept in a LRU cache keyed by the
+        (normalized) captions at inference, so that the text branch runs once per
+        prompt rather than once per image when the same prompt is used on a video.
+        """
+        use_cache = (
+            self.text_cache_size > 0 and not self.training and not torch.is_grad_enabled()
+        )
+        if not use_cache:
+            return self.encode_text(captions, device)
+
+        device = torch.device(device)
+        captions = [self._normalize_caption(c) for c in captions]
+        key = (tuple(captions), str(device), torch.is_autocast_enabled(device.type))
+        text_dict = self._text_cache.get(key)
+        if text_dict is None:
+            text_dict = self.encode_text(captions, device)
+            self._text_cache[key] = text_dict
+            while len(self._text_cache) > self.text_cache_size:
+                self._text_cache.popitem(last=False)
+        else:
+            self._text_cache.move_to_end(key)
+        # the transformer replaces the "encoded_text" entry of the dict it gets
+        return dict(text_dict)
+
+    def clear_text_cache(self):
+        self._text_cache.clear()
+
+    def train(self, mode: bool = True):
+        # the cached text embeddings are stale once the weights are trained
+        self.clear_text_cache()
+        return super().train(mode)
+
+    def forward(self, samples: NestedTensor, targets: List = None, **kw):
+        """The forward expects a NestedTensor, which consists of:
+           - samples.tensor: batched images, of shape [batch_size x 3 x H x W]
+           - samples.mask: a binary mask of shape [batch_size x H x W], containing 1 on padded pixels
+
+        It returns a dict with the following elements:
+           - "pred_logits": the classification logits (including no-object) for all queries.
+                            Shape= [batch_size x num_queries x num_classes]
+           - "pred_boxes": The normalized boxes coordinates for all queries, represented as
+                           (center_x, center_y, width, height). These values are normalized in [0, 1],
+                           relative to the size of each individual image (disregarding possible padding).
+                           See PostProcess for information on how to retrieve the unnormalized bounding box.
+           - "aux_outputs": Optional, only returned when auxilary losses are activated. It is a list of
+                            dictionnaries containing the two above keys for each decoder layer.
+
+        The captions are given as `captions=[...]` (or in the targets), or already encoded as
+        `text_dict=model.get_text_dict(captions, device)`.
+        """
+        # encoder texts (unless they were precomputed with `get_text_dict`)
+        text_dict = kw.get("text_dict")
+        if text_dict is None:
+            if targets is None:
+                captions = kw["captions"]
+            else:
+                captions = [t["caption"] for t in targets]
+            text_dict = self.get_text_dict(captions, samples.device)
+        else:
+            text_dict = dict(text_dict)
 
         # import ipdb; ipdb.set_trace()
         if isinstance(samples, (list, torch.Tensor)):
@@ -133,6 +133,79 @@ def multi_scale_deformable_attn_pytorch(
     return output.transpose(1, 2).contiguous()
 
 
+def multi_scale_deformable_attn_cpu(
+    value: torch.Tensor,
+    value_spatial_shapes: torch.Tensor,
+    value_level_start_index: torch.Tensor,
+    sampling_locations: torch.Tensor,
+    attention_weights: torch.Tensor,
+) -> torch.Tensor:
+    """
+    Same as `multi_scale_deformable_attn_pytorch`, but fusing the bilinear sampling
+    and the attention-weighted sum into a single `F.embedding_bag` call: each query
+    of each head is a bag of the (levels x 4 corners x points) value rows it samples,
+    weighted by the product of the bilinear and attention weights. This avoids the
+    per-level `F.grid_sample` calls and the stacked (bs*heads, dims, queries,
+    levels*points) intermediate, which dominate the latency on CPU.
+    """
+    bs, num_value, num_heads, embed_dims = value.shape
+    _, num_queries, _, num_levels, num_points, _ = sampling_locations.shape
+    if value_level_start_index is None:
+        areas = value_spatial_shapes[:, 0] * value_spatial_shapes[:, 1]
+        value_level_start_index = torch.cat((areas.new_zeros(1), areas.cumsum(0)[:-1]))
+
+    # first row of each (batch, head) in the value table
+    head_start = torch.arange(bs * num_heads, device=value.device, dtype=torch.int32)
+    head_start = (head_start * num_value).view(bs, 1, num_heads, 1)
+
+    # one bag per (batch, query, head), with the (levels x 4 corners x points) samples;
+    # the index arithmetic is done level by level (with the level shape as python
+    # scalars) on the samples, and only expanded to the 4 bilinear corners at the end
+    indices = torch.empty(
+        (bs, num_queries, num_heads, num_levels * 4, num_points),
+        device=value.device,
+        dtype=torch.int32,
+    )
+    weights = []
+    for level, (H_, W_) in enumerate(value_spatial_shapes.tolist()):
+        # pixel coordinates of the sampling locations (align_corners=False convention)
+        x = sampling_locations[:, :, :, level, :, 0] * W_ - 0.5
+        y = sampling_locations[:, :, :, level, :, 1] * H_ - 0.5
+        x0 = x.floor()
+        y0 = y.floor()
+        dx = x - x0
+        dy = y - y0
+        x0 = x0.int()
+        y0 = y0.int()
+
+        # bilinear weights, zeroed for the corners out of the feature map (padding_mode="zeros")
+        attn = attention_weights[:, :, :, level]
+        wx0 = (1 - dx) * ((x0 >= 0) & (x0 < W_))
+        wx1 = dx * ((x0 >= -1) & (x0 < W_ - 1))
+        wy0 = (1 - dy) * ((y0 >= 0) & (y0 < H_)) * attn
+        wy1 = dy * ((y0 >= -1) & (y0 < H_ - 1)) * attn
+        weights += [wy0 * wx0, wy0 * wx1, wy1 * wx0, wy1 * wx1]
+
+        # rows of the corners in the value table (clamped, their weight being 0 when out of the map)
+        start = head_start + int(value_level_start_index[level])
+        x1 = (x0 + 1).clamp_(0, W_ - 1)
+        x0 = x0.clamp_(0, W_ - 1)
+        row0 = y0.clamp(0, H_ - 1).mul_(W_).add_(start)
+        row1 = (y0 + 1).clamp_(0, H_ - 1).mul_(W_).add_(start)
+        torch.add(row0, x0, out=indices[:, :, :, 4 * level])
+        torch.add(row0, x1, out=indices[:, :, :, 4 * level + 1])
+        torch.add(row1, x0, out=indices[:, :, :, 4 * level + 2])
+        torch.add(row1, x1, out=indices[:, :, :, 4 * level + 3])
+
+    num_bags = bs * num_queries * num_heads
+    indices = indices.view(num_bags, -1)
+    weights = torch.stack(weights, dim=3).view(num_bags, -1).to(value.dtype)
+    value_table = value.transpose(1, 2).reshape(bs * num_heads * num_value, embed_dims)
+    output = F.embedding_bag(indices, value_table, per_sample_weights=weights, mode="sum")
+    # bs*num_queries*num_heads, embed_dims -> bs, num_queries, num_heads*embed_dims
+    return output.view(bs, num_queries, num_heads * embed_dims)
+
+
 class MultiScaleDeformableAttention(nn.Module):
     """Multi-Scale Deformable Attention Module used in Deformable-DETR
 
@@ -346,6 +419,10 @@ class MultiScaleDeformableAttention(nn.Module):
 
             if halffloat:
                 output = output.half()
+        elif value.device.type == "cpu":
+            output = multi_scale_deformable_attn_cpu(
+                value, spatial_shapes, level_start_index, sampling_locations, attention_weights
+            )
         else:
             output = multi_scale_deformable_attn_pytorch(
                 value, spatial_shapes, sampling_locations, attention_weights
@@ -1,4 +1,5 @@
-from typing import Tuple, List
+from functools import lru_cache
+from typing import Tuple, List, Union
 
 import cv2
 import numpy as np
@@ -6,11 +7,10 @@ import supervision as sv
 import torch
 from PIL import Image
 from torchvision.ops import box_convert
-import bisect
 
 import grounding_dino.groundingdino.datasets.transforms as T
 from grounding_dino.groundingdino.models import build_model
-from grounding_dino.groundingdino.util.misc import clean_state_dict
+from grounding_dino.groundingdino.util.misc import clean_state_dict, nested_tensor_from_tensor_list
 from grounding_dino.groundingdino.util.slconfig import SLConfig
 from grounding_dino.groundingdino.util.utils import get_phrases_from_posmap
 
@@ -36,10 +36,11 @@ def load_model(model_config_path: str, model_checkpoint_path: str, device: str =
     return model
 
 
-def load_image(image_path: str) -> Tuple[np.array, torch.Tensor]:
+def load_image(image_path: str, image_size: int = 800) -> Tuple[np.array, torch.Tensor]:
+    # a lower `image_size` (shorter side of the model input) runs the backbone faster
     transform = T.Compose(
         [
-            T.RandomResize([800], max_size=1333),
+            T.RandomResize([image_size], max_size=round(image_size * 1333 / 800)),
             T.ToTensor(),
             T.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
         ]
@@ -50,51 +51,133 @@ def load_image(image_path: str) -> Tuple[np.array, torch.Tensor]:
     return image, image_transformed
 
 
-def predict(
+class PhraseTable:
+    """
+    Decode the phrases of the detections of a caption from their token masks.
+
+    The caption is tokenized once, and the phrase of each distinct set of tokens
+    (a detection usually selects the tokens of one of the phrases of the caption)
+    is decoded once with `tokenizer.decode` and kept in a table, instead of being
+    decoded for every detection by `get_phrases_from_posmap`.
+    """
+
+    def __init__(self, caption: str, tokenizer):
+        self.tokenizer = tokenizer
+        self.tokenized = tokenizer(caption)
+        input_ids = self.tokenized["input_ids"]
+        # the [CLS], [SEP] and "." tokens that delimit the phrases of the caption
+        self.sep_idx = [i for i in range(len(input_ids)) if input_ids[i] in [101, 102, 1012]]
+        self.phrases = {}
+
+    def spans(self, token_idx: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        The (left, right) separators around the tokens `token_idx` (as in `predict`
+        with `remove_combined=True`), computed on the device of `token_idx`.
+        """
+        sep_idx = torch.as_tensor(self.sep_idx, device=token_idx.device)
+        insert_idx = torch.searchsorted(sep_idx, token_idx).clamp(max=len(self.sep_idx) - 1)
+        return sep_idx[insert_idx - 1], sep_idx[insert_idx]
+
+    def __call__(self, token_masks: np.ndarray) -> List[str]:
+        """Decode the phrases of (n, max_text_len) boolean token masks."""
+        input_ids = self.tokenized["input_ids"]
+        phrases = []
+        for token_mask in token_masks:
+            key = token_mask.tobytes()
+            phrase = self.phrases.get(key)
+            if phrase is None:
+                token_ids = [input_ids[i] for i in np.flatnonzero(token_mask)]
+                phrase = self.tokenizer.decode(token_ids).replace('.', '')
+                self.phrases[key] = phrase
+            phrases.append(phrase)
+        return phrases
+
+
+@lru_cache(maxsize=32)
+def get_phrase_table(caption: str, tokenizer) -> PhraseTable:
+    return PhraseTable(caption, tokenizer)
+
+
+def predict_batch(
         model,
-        image: torch.Tensor,
-        caption: str,
+        images: List[torch.Tensor],
+        captions: Union[str, List[str]],
         box_threshold: float,
         text_threshold: float,
-        device: str = "cuda",
         remove_combined: bool = False
-) -> Tuple[torch.Tensor, torch.Tensor, List[str]]:
-    caption = preprocess_caption(caption=caption)
+) -> List[Tuple[torch.Tensor, torch.Tensor, List[str]]]:
+    """
+    Batched version of `predict`: the images (of possibly different sizes) are
+    padded into a single `NestedTensor` and run through the model at once, with
+    either one caption shared by all the images or one caption per image. The
+    detections are thresholded on the device of the model, and only the kept ones
+    are copied to the CPU. The model is expected to already be on its device.
 
-    model = model.to(device)
-    image = image.to(device)
+    Returns the (boxes, logits, phrases) of each image, as returned by `predict`.
+    """
+    device = next(model.parameters()).device
+    if isinstance(captions, str):
+        captions = [captions] * len(images)
+    assert len(captions) == len(images), "expected one caption per image"
+    captions = [preprocess_caption(caption=caption) for caption in captions]
+    samples = nested_tensor_from_tensor_list([image.to(device) for image in images])
 
     with torch.no_grad():
-        outputs = model(image[None], captions=[caption])
-
-    prediction_logits = outputs["pred_logits"].cpu().sigmoid()[0]  # prediction_logits.shape = (nq, 256)
-    prediction_boxes = outputs["pred_boxes"].cpu()[0]  # prediction_boxes.shape = (nq, 4)
+        outputs = model(samples, captions=captions)
 
-    mask = prediction_logits.max(dim=1)[0] > box_threshold
+    prediction_logits = outputs["pred_logits"].sigmoid()  # prediction_logits.shape = (bs, nq, 256)
+    prediction_boxes = outputs["pred_boxes"]  # prediction_boxes.shape = (bs, nq, 4)
+    scores, token_idx = prediction_logits.max(dim=2)
+    mask = scores > box_threshold
+    image_idx = mask.nonzero(as_tuple=True)[0]
     logits = prediction_logits[mask]  # logits.shape = (n, 256)
-    boxes = prediction_boxes[mask]  # boxes.shape = (n, 4)
-
-    tokenizer = model.tokenizer
-    tokenized = tokenizer(caption)
-    
+    token_masks = logits > text_threshold
+    # same tokens as `get_phrases_from_posmap`, which drops the [CLS] token and the tokens from 255 on
+    token_masks[:, 0] = False
+    token_masks[:, 255:] = False
+    tables = [get_phrase_table(caption, model.tokenizer) for caption in captions]
     if remove_combined:
-        sep_idx = [i for i in range(len(tokenized['input_ids'])) if tokenized['input_ids'][i] in [101, 102, 1012]]
-        
-        phrases = []
-        for logit in logits:
-            max_idx = logit.argmax()
-            insert_idx = bisect.bisect_left(sep_idx, max_idx)
-            right_idx = sep_idx[insert_idx]
-            left_idx = sep_idx[insert_idx - 1]
-            phrases.append(get_phrases_from_posmap(logit > text_threshold, tokenized, tokenizer, left_idx, right_idx).replace('.', ''))
-    else:
-        phrases = [
-            get_phrases_from_posmap(logit > text_threshold, tokenized, tokenizer).replace('.', '')
-            for logit
-            in logits
-        ]
+        # keep the tokens between the separators around the best token of each detection
+        positions = torch.arange(token_masks.shape[1], device=device)
+        token_idx = token_idx[mask]
+        for caption in set(captions):
+            table = get_phrase_table(caption, model.tokenizer)
+            image_ids = [i for i in range(len(images)) if captions[i] == caption]
+            in_image = torch.isin(image_idx, torch.as_tensor(image_ids, device=device))
+            left_idx, right_idx = table.spans(token_idx[in_image])
+            in_span = (positions > left_idx[:, None]) & (positions < right_idx[:, None])
+            token_masks[in_image] &= in_span
+
+    boxes = prediction_boxes[mask].cpu()
+    scores = scores[mask].cpu()
+    token_masks = token_masks.cpu().numpy()
+    counts = torch.bincount(image_idx, minlength=len(images)).tolist()
+    results = []
+    for table, image_boxes, image_scores, image_token_masks in zip(
+        tables, boxes.split(counts), scores.split(counts), np.split(token_masks, np.cumsum(counts)[:-1])
+    ):
+        results.append((image_boxes, image_scores, table(image_token_masks)))
+    return results
 
-    return boxes, logits.max(dim=1)[0], phrases
+
+def predict(
+        model,
+        image: torch.Tensor,
+        caption: str,
+        box_threshold: float,
+        text_threshold: float,
+        device: str = "cuda",
+        remove_combined: bool = False
+) -> Tuple[torch.Tensor, torch.Tensor, List[str]]:
+    model = model.to(device)
+    return predict_batch(
+        model=model,
+        images=[image],
+        captions=caption,
+        box_threshold=box_threshold,
+        text_threshold=text_threshold,
+        remove_combined=remove_combined
+    )[0]
 
 
 def annotate(image_source: np.ndarray, boxes: torch.Tensor, logits: torch.Tensor, phrases: List[str]) -> np.ndarray:
@@ -216,24 +299,46 @@ class Model:
         box_annotator = sv.BoxAnnotator()
         annotated_image = box_annotator.annotate(scene=image, detections=detections)
         """
+        return self.predict_batch_with_classes(
+            images=[image],
+            classes=classes,
+            box_threshold=box_threshold,
+            text_threshold=text_threshold
+        )[0]
+
+    def predict_batch_with_classes(
+        self,
+        images: List[np.ndarray],
+        classes: List[str],
+        box_threshold: float,
+        text_threshold: float
+    ) -> List[sv.Detections]:
+        """
+        Same as `predict_with_classes` for a batch of images (e.g. the keyframes of
+        a video), run through the model at once. Returns the detections of each image.
+        """
         caption = ". ".join(classes)
-        processed_image = Model.preprocess_image(image_bgr=image).to(self.device)
-        boxes, logits, phrases = predict(
+        processed_images = [
+            Model.preprocess_image(image_bgr=image).to(self.device) for image in images
+        ]
+        results = predict_batch(
             model=self.model,
-            image=processed_image,
-            caption=caption,
+            images=processed_images,
+            captions=caption,
             box_threshold=box_threshold,
-            text_threshold=text_threshold,
-            device=self.device)
-        source_h, source_w, _ = image.shape
-        detections = Model.post_process_result(
-            source_h=source_h,
-            source_w=source_w,
-            boxes=boxes,
-            logits=logits)
-        class_id = Model.phrases2classes(phrases=phrases, classes=classes)
-        detections.class_id = class_id
-        return detections
+            text_threshold=text_threshold)
+        detections_list = []
+        for image, (boxes, logits, phrases) in zip(images, results):
+            source_h, source_w, _ = image.shape
+            detections = Model.post_process_result(
+                source_h=source_h,
+                source_w=source_w,
+                boxes=boxes,
+                logits=logits)
+            class_id = Model.phrases2classes(phrases=phrases, classes=classes)
+            detections.class_id = class_id
+            detections_list.append(detections)
+        return detections_list
 
     @staticmethod
     def preprocess_image(image_bgr: np.ndarray) -> torch.Tensor:
@@ -75,6 +75,9 @@ def build_sam2(
     mode="eval",
     hydra_overrides_extra=[],
     apply_postprocessing=True,
+    runtime="torch",
+    runtime_dir=None,
+    quantize=None,
     **kwargs,
 ):
 
@@ -94,6 +97,8 @@ def build_sam2(
     model = model.to(device)
     if mode == "eval":
         model.eval()
+    _quantize(model, quantize, runtime)
+    _enable_runtime(model, ckpt_path, runtime, runtime_dir)
     return model
 
 
@@ -104,6 +109,9 @@ def build_sam2_video_predictor(
     mode="eval",
     hydra_overrides_extra=[],
     apply_postprocessing=True,
+    runtime="torch",
+    runtime_dir=None,
+    quantize=None,
     **kwargs,
 ):
     hydra_overrides = [
@@ -131,6 +139,8 @@ def build_sam2_video_predictor(
     model = model.to(device)
     if mode == "eval":
         model.eval()
+    _quantize(model, quantize, runtime)
+    _enable_runtime(model, ckpt_path, runtime, runtime_dir)
     return model
 
 
@@ -154,6 +164,34 @@ def build_sam2_video_predictor_hf(model_id, **kwargs):
     )
 
 
+def _quantize(model, quantize, runtime):
+    # dynamic int8 quantization of the transformer blocks for CPU inference,
+    # see sam2.utils.quantization
+    if quantize is None:
+        return
+    if quantize != "int8":
+        raise ValueError(f"unsupported quantization {quantize}, expected None or 'int8'")
+    if runtime != "torch":
+        raise ValueError("quantization is only supported with the torch runtime")
+    from sam2.utils.quantization import quantize_sam2
+
+    quantize_sam2(model)
+
+
+def _enable_runtime(model, ckpt_path, runtime, runtime_dir):
+    # run the model components with their ONNX or TorchScript graphs (exported next to
+    # the checkpoint by default) instead of PyTorch, see sam2.utils.export
+    if runtime == "torch":
+        return
+    from sam2.utils.export import enable_exported_runtime
+
+    if runtime_dir is None:
+        if ckpt_path is None:
+            raise ValueError(f"runtime_dir is required for the {runtime} runtime without a checkpoint")
+        runtime_dir = f"{os.path.splitext(ckpt_path)[0]}_{runtime}"
+    enable_exported_runtime(model, runtime_dir, backend=runtime)
+
+
 def _load_checkpoint(model, ckpt_path):
     if ckpt_path is not None:
         sd = torch.load(ckpt_path, map_location="cpu", weights_only=True)["model"]
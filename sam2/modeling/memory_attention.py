@@ -4,7 +4,7 @@
 # This source code is licensed under the license found in the
 # LICENSE file in the root directory of this source tree.
 
-from typing import Optional
+from typing import List, Optional, Tuple
 
 import torch
 from torch import nn, Tensor
@@ -63,11 +63,16 @@ class MemoryAttentionLayer(nn.Module):
         tgt = tgt + self.dropout1(tgt2)
         return tgt
 
-    def _forward_ca(self, tgt, memory, query_pos, pos, num_k_exclude_rope=0):
+    def _forward_ca(
+        self, tgt, memory, query_pos, pos, num_k_exclude_rope=0, kv_prefix=None
+    ):
         kwds = {}
         if num_k_exclude_rope > 0:
             assert isinstance(self.cross_attn_image, RoPEAttention)
             kwds = {"num_k_exclude_rope": num_k_exclude_rope}
+        if kv_prefix is not None:
+            assert isinstance(self.cross_attn_image, RoPEAttention)
+            kwds["kv_prefix"] = kv_prefix
 
         # Cross-Attention
         tgt2 = self.norm2(tgt)
@@ -87,11 +92,14 @@ class MemoryAttentionLayer(nn.Module):
         pos: Optional[Tensor] = None,
         query_pos: Optional[Tensor] = None,
         num_k_exclude_rope: int = 0,
+        kv_prefix: Optional[Tuple[Tensor, Tensor]] = None,
     ) -> torch.Tensor:
 
         # Self-Attn, Cross-Attn
         tgt = self._forward_sa(tgt, query_pos)
-        tgt = self._forward_ca(tgt, memory, query_pos, pos, num_k_exclude_rope)
+        tgt = self._forward_ca(
+            tgt, memory, query_pos, pos, num_k_exclude_rope, kv_prefix
+        )
         # MLP
         tgt2 = self.norm3(tgt)
         tgt2 = self.linear2(self.dropout(self.activation(self.linear1(tgt2))))
@@ -123,6 +131,9 @@ class MemoryAttention(nn.Module):
         curr_pos: Optional[Tensor] = None,  # pos_enc for self-attention inputs
         memory_pos: Optional[Tensor] = None,  # pos_enc for cross-attention inputs
         num_obj_ptr_tokens: int = 0,  # number of object pointer *tokens*
+        # the projected keys and values of the cross-attention of each layer on leading
+        # spatial memories, which are then not in `memory` (see `project_memory`)
+        memory_kv: Optional[List[Tuple[Tensor, Tensor]]] = None,
     ):
         if isinstance(curr, list):
             assert isinstance(curr_pos, list)
@@ -147,10 +158,12 @@ class MemoryAttention(nn.Module):
             memory = memory.transpose(0, 1)
             memory_pos = memory_pos.transpose(0, 1)
 
-        for layer in self.layers:
+        for i, layer in enumerate(self.layers):
             kwds = {}
             if isinstance(layer.cross_attn_image, RoPEAttention):
                 kwds = {"num_k_exclude_rope": num_obj_ptr_tokens}
+            if memory_kv is not None:
+                kwds["kv_prefix"] = memory_kv[i]
 
             output = layer(
                 tgt=output,
@@ -167,3 +180,40 @@ class MemoryAttention(nn.Module):
             curr_pos = curr_pos.transpose(0, 1)
 
         return normed_output
+
+    def project_memory(self, memory: Tensor, memory_pos: Tensor):
+        """
+        The projected keys (with the rotary position encoding) and values of the
+        cross-attention of each layer on the (H*W)xBxC spatial memory of a frame, for
+        `memory_kv`. The keys of `memory_pos` + `tpos` are these keys plus the keys of
+        `project_memory_tpos(tpos)`, as the projections and the rotation are linear.
+        """
+        if self.batch_first:
+            memory, memory_pos = memory.transpose(0, 1), memory_pos.transpose(0, 1)
+        memory_kv = []
+        for layer in self.layers:
+            attn = layer.cross_attn_image
+            assert isinstance(attn, RoPEAttention)
+            k = memory + memory_pos if layer.pos_enc_at_cross_attn_keys else memory
+            k = attn.rotate(attn._separate_heads(attn.k_proj(k), attn.num_heads))
+            v = attn._separate_heads(attn.v_proj(memory), attn.num_heads)
+            memory_kv.append((k, v))
+        return memory_kv
+
+    def project_memory_tpos(self, tpos: Tensor, num_tokens: int):
+        """
+        The projected keys (with the rotary position encoding, and without the bias of
+        the projection) of the cross-attention of each layer on a temporal position
+        encoding `tpos` of dim C added to the `num_tokens` tokens of a spatial memory.
+        """
+        tpos_k = []
+        for layer in self.layers:
+            attn = layer.cross_attn_image
+            if not layer.pos_enc_at_cross_attn_keys:
+                tpos_k.append(None)
+                continue
+            tpos = tpos.reshape(1, 1, -1)
+            k = attn.k_proj(tpos) - attn.k_proj(torch.zeros_like(tpos))
+            k = k.expand(1, num_tokens, k.size(-1))
+            tpos_k.append(attn.rotate(attn._separate_heads(k, attn.num_heads)))
+        return tpos_k
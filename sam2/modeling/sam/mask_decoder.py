@@ -141,7 +141,22 @@ class MaskDecoder(nn.Module):
             repeat_image=repeat_image,
             high_res_features=high_res_features,
         )
+        return self.select_masks(
+            masks, iou_pred, mask_tokens_out, object_score_logits, multimask_output
+        )
 
+    def select_masks(
+        self,
+        masks: torch.Tensor,
+        iou_pred: torch.Tensor,
+        mask_tokens_out: torch.Tensor,
+        object_score_logits: torch.Tensor,
+        multimask_output: bool,
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+        """
+        Select the output masks and tokens from the outputs of 'predict_masks' (also
+        used on the outputs of an exported mask decoder, see sam2.utils.export).
+        """
         # Select the correct mask or masks for output
         if multimask_output:
             masks = masks[:, 1:, :, :]
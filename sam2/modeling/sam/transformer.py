@@ -308,8 +308,28 @@ class RoPEAttention(Attention):
         self.freqs_cis = freqs_cis
         self.rope_k_repeat = rope_k_repeat
 
+    def _update_freqs_cis(self, num_tokens, device):
+        w = h = math.sqrt(num_tokens)
+        self.freqs_cis = self.freqs_cis.to(device)
+        if self.freqs_cis.shape[0] != num_tokens:
+            self.freqs_cis = self.compute_cis(end_x=w, end_y=h).to(device)
+
+    def rotate(self, x: Tensor) -> Tensor:
+        """Apply the rotary position encoding to the (projected) B x N_heads x N_tokens x C_per_head `x`."""
+        self._update_freqs_cis(x.shape[-2], x.device)
+        x, _ = apply_rotary_enc(x, x[:, :, :0], freqs_cis=self.freqs_cis)
+        return x
+
     def forward(
-        self, q: Tensor, k: Tensor, v: Tensor, num_k_exclude_rope: int = 0
+        self,
+        q: Tensor,
+        k: Tensor,
+        v: Tensor,
+        num_k_exclude_rope: int = 0,
+        # The projected keys (with the rotary position encoding) and values of leading
+        # memory tokens, in B x N_heads x N_tokens x C_per_head (e.g. cached from
+        # previous frames), which are prepended to the keys and values of `k` and `v`.
+        kv_prefix: Tuple[Tensor, Tensor] = None,
     ) -> Tensor:
         # Input projections
         q = self.q_proj(q)
@@ -322,10 +342,7 @@ class RoPEAttention(Attention):
         v = self._separate_heads(v, self.num_heads)
 
         # Apply rotary position encoding
-        w = h = math.sqrt(q.shape[-2])
-        self.freqs_cis = self.freqs_cis.to(q.device)
-        if self.freqs_cis.shape[0] != q.shape[-2]:
-            self.freqs_cis = self.compute_cis(end_x=w, end_y=h).to(q.device)
+        self._update_freqs_cis(q.shape[-2], q.device)
         if q.shape[-2] != k.shape[-2]:
             assert self.rope_k_repeat
 
@@ -336,6 +353,9 @@ class RoPEAttention(Attention):
             freqs_cis=self.freqs_cis,
             repeat_freqs_k=self.rope_k_repeat,
         )
+        if kv_prefix is not None:
+            k = torch.cat([kv_prefix[0], k], dim=-2)
+            v = torch.cat([kv_prefix[1], v], dim=-2)
 
         dropout_p = self.dropout_p if self.training else 0.0
         # Attention
@@ -93,6 +93,11 @@ class SAM2Base(torch.nn.Module):
         # extra arguments used to construct the SAM mask decoder; if not None, it should be a dict of kwargs to be passed into `MaskDecoder` class.
         sam_mask_decoder_extra_args=None,
         compile_image_encoder: bool = False,
+        # At inference, cache the projected keys and values of the memory attention on the
+        # spatial memory of each frame in its output (as "memory_kv"), so that a memory
+        # frame is projected once instead of on every frame that attends to it. This takes
+        # 2 x num_layers x the memory attention dim per token and memory frame.
+        cache_memory_kv: bool = False,
     ):
         super().__init__()
 
@@ -180,6 +185,8 @@ class SAM2Base(torch.nn.Module):
 
         self._build_sam_heads()
         self.max_cond_frames_in_attn = max_cond_frames_in_attn
+        self.cache_memory_kv = cache_memory_kv
+        self._memory_tpos_k = {}
 
         # Model compilation
         if compile_image_encoder:
@@ -337,21 +344,15 @@ class SAM2Base(torch.nn.Module):
             # a learned `no_mask_embed` to indicate no mask input in this case).
             sam_mask_prompt = None
 
-        sparse_embeddings, dense_embeddings = self.sam_prompt_encoder(
-            points=(sam_point_coords, sam_point_labels),
-            boxes=None,
-            masks=sam_mask_prompt,
-        )
         (
             low_res_multimasks,
             ious,
             sam_output_tokens,
             object_score_logits,
-        ) = self.sam_mask_decoder(
+        ) = self.forward_prompt_and_mask_decoder(
             image_embeddings=backbone_features,
-            image_pe=self.sam_prompt_encoder.get_dense_pe(),
-            sparse_prompt_embeddings=sparse_embeddings,
-            dense_prompt_embeddings=dense_embeddings,
+            points=(sam_point_coords, sam_point_labels),
+            masks=sam_mask_prompt,
             multimask_output=multimask_output,
             repeat_image=False,  # the image is already batched
             high_res_features=high_res_features,
@@ -412,6 +413,39 @@ class SAM2Base(torch.nn.Module):
             object_score_logits,
         )
 
+    def forward_prompt_and_mask_decoder(
+        self,
+        image_embeddings,
+        points,
+        masks,
+        multimask_output,
+        repeat_image,
+        high_res_features=None,
+    ):
+        """
+        Embed the prompts (`points` as a tuple of [B, P, 2] coordinates and [B, P]
+        labels, where boxes are points with labels 2 and 3, and optional [B, 1, H*4, W*4]
+        `masks`) with the SAM prompt encoder and predict the masks with the SAM mask
+        decoder. Returns the outputs of `sam_mask_decoder`.
+
+        (The prompt encoder and the mask decoder run as a single graph in an exported
+        runtime, see `sam2.utils.export.enable_exported_runtime`.)
+        """
+        sparse_embeddings, dense_embeddings = self.sam_prompt_encoder(
+            points=points,
+            boxes=None,
+            masks=masks,
+        )
+        return self.sam_mask_decoder(
+            image_embeddings=image_embeddings,
+            image_pe=self.sam_prompt_encoder.get_dense_pe(),
+            sparse_prompt_embeddings=sparse_embeddings,
+            dense_prompt_embeddings=dense_embeddings,
+            multimask_output=multimask_output,
+            repeat_image=repeat_image,
+            high_res_features=high_res_features,
+        )
+
     def _use_mask_as_output(self, backbone_features, high_res_features, mask_inputs):
         """
         Directly turn binary `mask_inputs` into a output mask logits without using SAM.
@@ -494,6 +528,112 @@ class SAM2Base(torch.nn.Module):
 
         return backbone_out, vision_feats, vision_pos_embeds, feat_sizes
 
+    def _select_memory_frames(
+        self,
+        frame_idx,
+        output_dict,
+        num_frames,
+        track_in_reverse=False,  # tracking in reverse time order (for demo usage)
+    ):
+        """
+        Select the previous frames whose memories condition a (non initial conditioning)
+        frame. Returns the (t_pos, output) of the spatial memories (with t_pos=0 for the
+        conditioning frames and output=None for padding frames), the (pos, output) of
+        the object pointers (the conditioning frames first, then the non-conditioning
+        frames with pos=t_diff) and the number of conditioning frames among them.
+        """
+        tpos_sign_mul = -1 if track_in_reverse else 1
+        # Add conditioning frames's output first (all cond frames have t_pos=0 for
+        # when getting temporal positional embedding below)
+        assert len(output_dict["cond_frame_outputs"]) > 0
+        # Select a maximum number of temporally closest cond frames for cross attention
+        cond_outputs = output_dict["cond_frame_outputs"]
+        selected_cond_outputs, unselected_cond_outputs = select_closest_cond_frames(
+            frame_idx, cond_outputs, self.max_cond_frames_in_attn
+        )
+        t_pos_and_prevs = [(0, out) for out in selected_cond_outputs.values()]
+        # Add last (self.num_maskmem - 1) frames before current frame for non-conditioning memory
+        # the earliest one has t_pos=1 and the latest one has t_pos=self.num_maskmem-1
+        # We also allow taking the memory frame non-consecutively (with stride>1), in which case
+        # we take (self.num_maskmem - 2) frames among every stride-th frames plus the last frame.
+        stride = 1 if self.training else self.memory_temporal_stride_for_eval
+        for t_pos in range(1, self.num_maskmem):
+            t_rel = self.num_maskmem - t_pos  # how many frames before current frame
+            if t_rel == 1:
+                # for t_rel == 1, we take the last frame (regardless of r)
+                if not track_in_reverse:
+                    # the frame immediately before this frame (i.e. frame_idx - 1)
+                    prev_frame_idx = frame_idx - t_rel
+                else:
+                    # the frame immediately after this frame (i.e. frame_idx + 1)
+                    prev_frame_idx = frame_idx + t_rel
+            else:
+                # for t_rel >= 2, we take the memory frame from every r-th frames
+                if not track_in_reverse:
+                    # first find the nearest frame among every r-th frames before this frame
+                    # for r=1, this would be (frame_idx - 2)
+                    prev_frame_idx = ((frame_idx - 2) // stride) * stride
+                    # then seek further among every r-th frames
+                    prev_frame_idx = prev_frame_idx - (t_rel - 2) * stride
+                else:
+                    # first find the nearest frame among every r-th frames after this frame
+                    # for r=1, this would be (frame_idx + 2)
+                    prev_frame_idx = -(-(frame_idx + 2) // stride) * stride
+                    # then seek further among every r-th frames
+                    prev_frame_idx = prev_frame_idx + (t_rel - 2) * stride
+            out = output_dict["non_cond_frame_outputs"].get(prev_frame_idx, None)
+            if out is None:
+                # If an unselected conditioning frame is among the last (self.num_maskmem - 1)
+                # frames, we still attend to it as if it's a non-conditioning frame.
+                out = unselected_cond_outputs.get(prev_frame_idx, None)
+            t_pos_and_prevs.append((t_pos, out))
+
+        # Construct the list of past object pointers
+        pos_and_ptr_outs = []
+        num_cond_ptrs = 0
+        if self.use_obj_ptrs_in_encoder:
+            max_obj_ptrs_in_encoder = min(num_frames, self.max_obj_ptrs_in_encoder)
+            # First add those object pointers from selected conditioning frames
+            # (optionally, only include object pointers in the past during evaluation)
+            if not self.training and self.only_obj_ptrs_in_the_past_for_eval:
+                ptr_cond_outputs = {
+                    t: out
+                    for t, out in selected_cond_outputs.items()
+                    if (t >= frame_idx if track_in_reverse else t <= frame_idx)
+                }
+            else:
+                ptr_cond_outputs = selected_cond_outputs
+            pos_and_ptr_outs = [
+                # Temporal pos encoding contains how far away each pointer is from current frame
+                (
+                    (
+                        (frame_idx - t) * tpos_sign_mul
+                        if self.use_signed_tpos_enc_to_obj_ptrs
+                        else abs(frame_idx - t)
+                    ),
+                    out,
+                )
+                for t, out in ptr_cond_outputs.items()
+            ]
+            num_cond_ptrs = len(pos_and_ptr_outs)
+            # Add up to (max_obj_ptrs_in_encoder - 1) non-conditioning frames before current frame
+            for t_diff in range(1, max_obj_ptrs_in_encoder):
+                t = frame_idx + t_diff if track_in_reverse else frame_idx - t_diff
+                if t < 0 or (num_frames is not None and t >= num_frames):
+                    break
+                out = output_dict["non_cond_frame_outputs"].get(
+                    t, unselected_cond_outputs.get(t, None)
+                )
+                if out is not None:
+                    pos_and_ptr_outs.append((t_diff, out))
+        return t_pos_and_prevs, pos_and_ptr_outs, num_cond_ptrs
+
+    def _get_obj_ptr_tpos_enc(self, obj_pos, t_diff_max):
+        """The temporal positional encoding of object pointers at (signed) distances `obj_pos`."""
+        tpos_dim = self.hidden_dim if self.proj_tpos_enc_in_obj_ptrs else self.mem_dim
+        obj_pos = get_1d_sine_pe(obj_pos / t_diff_max, dim=tpos_dim)
+        return self.obj_ptr_tpos_proj(obj_pos)
+
     def _prepare_memory_conditioned_features(
         self,
         frame_idx,
@@ -517,56 +657,20 @@ class SAM2Base(torch.nn.Module):
             return pix_feat
 
         num_obj_ptr_tokens = 0
-        tpos_sign_mul = -1 if track_in_reverse else 1
+        memory_kv = None
         # Step 1: condition the visual features of the current frame on previous memories
         if not is_init_cond_frame:
             # Retrieve the memories encoded with the maskmem backbone
             to_cat_memory, to_cat_memory_pos_embed = [], []
-            # Add conditioning frames's output first (all cond frames have t_pos=0 for
-            # when getting temporal positional embedding below)
-            assert len(output_dict["cond_frame_outputs"]) > 0
-            # Select a maximum number of temporally closest cond frames for cross attention
-            cond_outputs = output_dict["cond_frame_outputs"]
-            selected_cond_outputs, unselected_cond_outputs = select_closest_cond_frames(
-                frame_idx, cond_outputs, self.max_cond_frames_in_attn
+            t_pos_and_prevs, pos_and_ptr_outs, _ = self._select_memory_frames(
+                frame_idx, output_dict, num_frames, track_in_reverse
             )
-            t_pos_and_prevs = [(0, out) for out in selected_cond_outputs.values()]
-            # Add last (self.num_maskmem - 1) frames before current frame for non-conditioning memory
-            # the earliest one has t_pos=1 and the latest one has t_pos=self.num_maskmem-1
-            # We also allow taking the memory frame non-consecutively (with stride>1), in which case
-            # we take (self.num_maskmem - 2) frames among every stride-th frames plus the last frame.
-            stride = 1 if self.training else self.memory_temporal_stride_for_eval
-            for t_pos in range(1, self.num_maskmem):
-                t_rel = self.num_maskmem - t_pos  # how many frames before current frame
-                if t_rel == 1:
-                    # for t_rel == 1, we take the last frame (regardless of r)
-                    if not track_in_reverse:
-                        # the frame immediately before this frame (i.e. frame_idx - 1)
-                        prev_frame_idx = frame_idx - t_rel
-                    else:
-                        # the frame immediately after this frame (i.e. frame_idx + 1)
-                        prev_frame_idx = frame_idx + t_rel
-                else:
-                    # for t_rel >= 2, we take the memory frame from every r-th frames
-                    if not track_in_reverse:
-                        # first find the nearest frame among every r-th frames before this frame
-                        # for r=1, this would be (frame_idx - 2)
-                        prev_frame_idx = ((frame_idx - 2) // stride) * stride
-                        # then seek further among every r-th frames
-                        prev_frame_idx = prev_frame_idx - (t_rel - 2) * stride
-                    else:
-                        # first find the nearest frame among every r-th frames after this frame
-                        # for r=1, this would be (frame_idx + 2)
-                        prev_frame_idx = -(-(frame_idx + 2) // stride) * stride
-                        # then seek further among every r-th frames
-                        prev_frame_idx = prev_frame_idx + (t_rel - 2) * stride
-                out = output_dict["non_cond_frame_outputs"].get(prev_frame_idx, None)
-                if out is None:
-                    # If an unselected conditioning frame is among the last (self.num_maskmem - 1)
-                    # frames, we still attend to it as if it's a non-conditioning frame.
-                    out = unselected_cond_outputs.get(prev_frame_idx, None)
-                t_pos_and_prevs.append((t_pos, out))
-
+            if self.cache_memory_kv and not torch.is_grad_enabled():
+                # the keys and values of the spatial memories from the cache of each frame
+                memory_kv = self._get_memory_kv(
+                    t_pos_and_prevs, output_dict, H * W, device
+                )
+                t_pos_and_prevs = []
             for t_pos, prev in t_pos_and_prevs:
                 if prev is None:
                     continue  # skip padding frames
@@ -583,69 +687,33 @@ class SAM2Base(torch.nn.Module):
                 )
                 to_cat_memory_pos_embed.append(maskmem_enc)
 
-            # Construct the list of past object pointers
-            if self.use_obj_ptrs_in_encoder:
-                max_obj_ptrs_in_encoder = min(num_frames, self.max_obj_ptrs_in_encoder)
-                # First add those object pointers from selected conditioning frames
-                # (optionally, only include object pointers in the past during evaluation)
-                if not self.training and self.only_obj_ptrs_in_the_past_for_eval:
-                    ptr_cond_outputs = {
-                        t: out
-                        for t, out in selected_cond_outputs.items()
-                        if (t >= frame_idx if track_in_reverse else t <= frame_idx)
-                    }
+            # If we have at least one object pointer, add them to the across attention
+            if len(pos_and_ptr_outs) > 0:
+                pos_list = [pos for pos, _ in pos_and_ptr_outs]
+                ptrs_list = [out["obj_ptr"] for _, out in pos_and_ptr_outs]
+                # stack object pointers along dim=0 into [ptr_seq_len, B, C] shape
+                obj_ptrs = torch.stack(ptrs_list, dim=0)
+                # a temporal positional embedding based on how far each object pointer is from
+                # the current frame (sine embedding normalized by the max pointer num).
+                if self.add_tpos_enc_to_obj_ptrs:
+                    t_diff_max = min(num_frames, self.max_obj_ptrs_in_encoder) - 1
+                    obj_pos = torch.tensor(pos_list, device=device)
+                    obj_pos = self._get_obj_ptr_tpos_enc(obj_pos, t_diff_max)
+                    obj_pos = obj_pos.unsqueeze(1).expand(-1, B, self.mem_dim)
                 else:
-                    ptr_cond_outputs = selected_cond_outputs
-                pos_and_ptrs = [
-                    # Temporal pos encoding contains how far away each pointer is from current frame
-                    (
-                        (
-                            (frame_idx - t) * tpos_sign_mul
-                            if self.use_signed_tpos_enc_to_obj_ptrs
-                            else abs(frame_idx - t)
-                        ),
-                        out["obj_ptr"],
-                    )
-                    for t, out in ptr_cond_outputs.items()
-                ]
-                # Add up to (max_obj_ptrs_in_encoder - 1) non-conditioning frames before current frame
-                for t_diff in range(1, max_obj_ptrs_in_encoder):
-                    t = frame_idx + t_diff if track_in_reverse else frame_idx - t_diff
-                    if t < 0 or (num_frames is not None and t >= num_frames):
-                        break
-                    out = output_dict["non_cond_frame_outputs"].get(
-                        t, unselected_cond_outputs.get(t, None)
+                    obj_pos = obj_ptrs.new_zeros(len(pos_list), B, self.mem_dim)
+                if self.mem_dim < C:
+                    # split a pointer into (C // self.mem_dim) tokens for self.mem_dim < C
+                    obj_ptrs = obj_ptrs.reshape(
+                        -1, B, C // self.mem_dim, self.mem_dim
                     )
-                    if out is not None:
-                        pos_and_ptrs.append((t_diff, out["obj_ptr"]))
-                # If we have at least one object pointer, add them to the across attention
-                if len(pos_and_ptrs) > 0:
-                    pos_list, ptrs_list = zip(*pos_and_ptrs)
-                    # stack object pointers along dim=0 into [ptr_seq_len, B, C] shape
-                    obj_ptrs = torch.stack(ptrs_list, dim=0)
-                    # a temporal positional embedding based on how far each object pointer is from
-                    # the current frame (sine embedding normalized by the max pointer num).
-                    if self.add_tpos_enc_to_obj_ptrs:
-                        t_diff_max = max_obj_ptrs_in_encoder - 1
-                        tpos_dim = C if self.proj_tpos_enc_in_obj_ptrs else self.mem_dim
-                        obj_pos = torch.tensor(pos_list, device=device)
-                        obj_pos = get_1d_sine_pe(obj_pos / t_diff_max, dim=tpos_dim)
-                        obj_pos = self.obj_ptr_tpos_proj(obj_pos)
-                        obj_pos = obj_pos.unsqueeze(1).expand(-1, B, self.mem_dim)
-                    else:
-                        obj_pos = obj_ptrs.new_zeros(len(pos_list), B, self.mem_dim)
-                    if self.mem_dim < C:
-                        # split a pointer into (C // self.mem_dim) tokens for self.mem_dim < C
-                        obj_ptrs = obj_ptrs.reshape(
-                            -1, B, C // self.mem_dim, self.mem_dim
-                        )
-                        obj_ptrs = obj_ptrs.permute(0, 2, 1, 3).flatten(0, 1)
-                        obj_pos = obj_pos.repeat_interleave(C // self.mem_dim, dim=0)
-                    to_cat_memory.append(obj_ptrs)
-                    to_cat_memory_pos_embed.append(obj_pos)
-                    num_obj_ptr_tokens = obj_ptrs.shape[0]
-                else:
-                    num_obj_ptr_tokens = 0
+                    obj_ptrs = obj_ptrs.permute(0, 2, 1, 3).flatten(0, 1)
+                    obj_pos = obj_pos.repeat_interleave(C // self.mem_dim, dim=0)
+                to_cat_memory.append(obj_ptrs)
+                to_cat_memory_pos_embed.append(obj_pos)
+                num_obj_ptr_tokens = obj_ptrs.shape[0]
+            else:
+                num_obj_ptr_tokens = 0
         else:
             # for initial conditioning frames, encode them without using any previous memory
             if self.directly_add_no_mem_embed:
@@ -659,6 +727,12 @@ class SAM2Base(torch.nn.Module):
             to_cat_memory_pos_embed = [self.no_mem_pos_enc.expand(1, B, self.mem_dim)]
 
         # Step 2: Concatenate the memories and forward through the transformer encoder
+        kwds = {}
+        if memory_kv is not None:
+            kwds = {"memory_kv": memory_kv}
+            if len(to_cat_memory) == 0:  # no object pointers
+                to_cat_memory = [current_vision_feats[-1].new_zeros(0, B, self.mem_dim)]
+                to_cat_memory_pos_embed = to_cat_memory
         memory = torch.cat(to_cat_memory, dim=0)
         memory_pos_embed = torch.cat(to_cat_memory_pos_embed, dim=0)
 
@@ -668,11 +742,89 @@ class SAM2Base(torch.nn.Module):
             memory=memory,
             memory_pos=memory_pos_embed,
             num_obj_ptr_tokens=num_obj_ptr_tokens,
+            **kwds,
         )
         # reshape the output (HW)BC => BCHW
         pix_feat_with_mem = pix_feat_with_mem.permute(1, 2, 0).view(B, C, H, W)
         return pix_feat_with_mem
 
+    def _get_memory_kv(self, t_pos_and_prevs, output_dict, num_tokens, device):
+        """
+        The keys and values of the memory attention layers on the spatial memories of
+        `t_pos_and_prevs` (see `MemoryAttention.forward`): the projections of each
+        memory frame are cached in its output, and the keys of the temporal positional
+        encoding of its slot (`MemoryAttention.project_memory_tpos`) are added to them.
+        """
+        # drop the cached projections of the frames that left the memory bank, among
+        # the outputs holding a cache (tracked in `output_dict` as {id(out): out}, so
+        # that all the outputs aren't scanned on every frame)
+        selected = {id(prev) for _, prev in t_pos_and_prevs if prev is not None}
+        cached_outputs = output_dict.setdefault("memory_kv_outputs", {})
+        for key in [key for key in cached_outputs if key not in selected]:
+            cached_outputs.pop(key).pop("memory_kv", None)
+
+        t_pos_and_prevs = [(t, prev) for t, prev in t_pos_and_prevs if prev is not None]
+        memory_kv = None
+        for j, (t_pos, prev) in enumerate(t_pos_and_prevs):
+            # the cache is keyed by the memory features (which might be re-encoded)
+            cached = prev.get("memory_kv")
+            if (
+                cached is None
+                or cached[0] is not prev["maskmem_features"]
+                or cached[1][0][0].device != device
+            ):
+                # "maskmem_features" might have been offloaded to CPU in demo use cases
+                feats = prev["maskmem_features"].to(device, non_blocking=True)
+                maskmem_enc = prev["maskmem_pos_enc"][-1].to(device)
+                memory = feats.flatten(2).permute(2, 0, 1).to(maskmem_enc.dtype)
+                maskmem_enc = maskmem_enc.flatten(2).permute(2, 0, 1)
+                cached = (
+                    prev["maskmem_features"],
+                    self.memory_attention.project_memory(memory, maskmem_enc),
+                )
+                prev["memory_kv"] = cached
+                cached_outputs[id(prev)] = prev
+            if memory_kv is None:
+                # the keys and values of all the frames, B x N_heads x N_tokens x C_per_head
+                num_memory_tokens = len(t_pos_and_prevs) * num_tokens
+                memory_kv = [
+                    (
+                        k.new_empty(*k.shape[:2], num_memory_tokens, k.size(-1)),
+                        v.new_empty(*v.shape[:2], num_memory_tokens, v.size(-1)),
+                    )
+                    for k, v in cached[1]
+                ]
+            tpos_k = self._get_memory_tpos_k(
+                self.num_maskmem - t_pos - 1, num_tokens, device
+            )
+            tokens = slice(j * num_tokens, (j + 1) * num_tokens)
+            for (k, v), (all_k, all_v), k_t in zip(cached[1], memory_kv, tpos_k):
+                if k_t is None:
+                    all_k[:, :, tokens] = k
+                else:
+                    torch.add(k, k_t, out=all_k[:, :, tokens])
+                all_v[:, :, tokens] = v
+        return memory_kv
+
+    def _clear_memory_kv(self, output_dict):
+        """Drop the cached memory projections of `output_dict` (see `_get_memory_kv`)."""
+        for out in output_dict.pop("memory_kv_outputs", {}).values():
+            out.pop("memory_kv", None)
+
+    def _get_memory_tpos_k(self, tpos_idx, num_tokens, device):
+        """The keys of `maskmem_tpos_enc[tpos_idx]` in the memory attention layers (cached)."""
+        # recompute them if the weights are updated
+        versions = tuple(p._version for p in self.memory_attention.parameters())
+        versions += (self.maskmem_tpos_enc._version,)
+        key = (tpos_idx, num_tokens, device)
+        if self._memory_tpos_k.get("versions") != versions:
+            self._memory_tpos_k = {"versions": versions}
+        if key not in self._memory_tpos_k:
+            self._memory_tpos_k[key] = self.memory_attention.project_memory_tpos(
+                self.maskmem_tpos_enc[tpos_idx], num_tokens
+            )
+        return self._memory_tpos_k[key]
+
     def _encode_new_memory(
         self,
         current_vision_feats,
@@ -403,12 +403,6 @@ class SAM2ImagePredictor:
             else:
                 concat_points = (box_coords, box_labels)
 
-        sparse_embeddings, dense_embeddings = self.model.sam_prompt_encoder(
-            points=concat_points,
-            boxes=None,
-            masks=mask_input,
-        )
-
         # Predict masks
         batched_mode = (
             concat_points is not None and concat_points[0].shape[0] > 1
@@ -417,15 +411,15 @@ class SAM2ImagePredictor:
             feat_level[img_idx].unsqueeze(0)
             for feat_level in self._features["high_res_feats"]
         ]
-        low_res_masks, iou_predictions, _, _ = self.model.sam_mask_decoder(
+        decoder_out = self.model.forward_prompt_and_mask_decoder(
             image_embeddings=self._features["image_embed"][img_idx].unsqueeze(0),
-            image_pe=self.model.sam_prompt_encoder.get_dense_pe(),
-            sparse_prompt_embeddings=sparse_embeddings,
-            dense_prompt_embeddings=dense_embeddings,
+            points=concat_points,
+            masks=mask_input,
             multimask_output=multimask_output,
             repeat_image=batched_mode,
             high_res_features=high_res_features,
         )
+        low_res_masks, iou_predictions, _, _ = decoder_out
 
         # Upscale the masks to the original image resolution
         masks = self._transforms.postprocess_masks(
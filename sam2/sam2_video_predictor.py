@@ -12,7 +12,14 @@ import torch
 from tqdm import tqdm
 
 from sam2.modeling.sam2_base import NO_OBJ_SCORE, SAM2Base
-from sam2.utils.misc import concat_points, fill_holes_in_mask_scores, load_video_frames ,process_stream_frame
+from sam2.utils.misc import (
+    concat_points,
+    fill_holes_in_mask_scores,
+    JPEGVideoFrames,
+    load_video_frames,
+    normalize_frames,
+    process_stream_frame,
+)
 
 
 class SAM2VideoPredictor(SAM2Base):
@@ -47,11 +54,34 @@ class SAM2VideoPredictor(SAM2Base):
         offload_video_to_cpu=False,
         offload_state_to_cpu=False,
         async_loading_frames=False,
+        preloaded_frames=None,
+        first_frame_backbone_out=None,
+        frame_storage="uint8",
     ):
-        """Initialize an inference state."""
+        """
+        Initialize an inference state.
+
+        The video frames are stored as uint8 by default and normalized to float right
+        before the image encoder (see `load_video_frames` for the other `frame_storage`
+        options, e.g. "jpeg" for JPEG-compressed frames on CPU, or "float" to store the
+        normalized frames as before).
+
+        Instead of `video_path`, the frames can be given in `preloaded_frames` as a tuple
+        (images, video_height, video_width), where `images` holds the frames already
+        resized as in `load_video_frames`, either as uint8 or already normalized (e.g.
+        read-only frames shared across sessions). They are kept where they are and
+        normalized on the compute device when a frame is used. The backbone features of the
+        first frame (the "backbone_fpn" and "vision_pos_enc" outputs of `forward_image`)
+        can also be given in `first_frame_backbone_out` to skip the warm-up of the
+        visual backbone.
+        """
         compute_device = self.device  # device of the model
         inference_state = {}
-        if video_path is not None:
+        if preloaded_frames is not None:
+            images, video_height, video_width = preloaded_frames
+            inference_state["images"] = images
+            inference_state["num_frames"] = len(images)
+        elif video_path is not None:
             # Preload video frames from file
             images, video_height, video_width = load_video_frames(
                 video_path=video_path,
@@ -59,6 +89,7 @@ class SAM2VideoPredictor(SAM2Base):
                 offload_video_to_cpu=offload_video_to_cpu,
                 async_loading_frames=async_loading_frames,
                 compute_device=compute_device,
+                frame_storage=frame_storage,
             )
             inference_state["images"] = images
             inference_state["num_frames"] = len(images)
@@ -73,6 +104,8 @@ class SAM2VideoPredictor(SAM2Base):
         # whether to offload the video frames to CPU memory
         # turning on this option saves the GPU memory with only a very small overhead
         inference_state["offload_video_to_cpu"] = offload_video_to_cpu
+        # how the video frames are stored (also for the frames added in streaming mode)
+        inference_state["frame_storage"] = frame_storage
         # whether to offload the inference state to CPU memory
         # turning on this option saves the GPU memory at the cost of a lower tracking fps
         # (e.g. in a test case of 768x768 model, fps dropped from 27 to 24 when tracking one object
@@ -117,7 +150,17 @@ class SAM2VideoPredictor(SAM2Base):
         inference_state["tracking_has_started"] = False
         inference_state["frames_already_tracked"] = {}
         # Warm up the visual backbone and cache the image feature on frame 0
-        if video_path is not None:
+        if first_frame_backbone_out is not None:
+            image = normalize_frames(images[0].to(compute_device)).unsqueeze(0)
+            backbone_out = {
+                key: [
+                    x.to(compute_device, non_blocking=True)
+                    for x in first_frame_backbone_out[key]
+                ]
+                for key in ["backbone_fpn", "vision_pos_enc"]
+            }
+            inference_state["cached_features"] = {0: (image, backbone_out)}
+        elif images is not None:
             self._get_image_feature(inference_state, frame_idx=0, batch_size=1)
 
         return inference_state
@@ -679,8 +722,20 @@ class SAM2VideoPredictor(SAM2Base):
         start_frame_idx=None,
         max_frame_num_to_track=None,
         reverse=False,
+        early_stop_iou_thresh=None,
+        early_stop_num_frames=None,
     ):
-        """Propagate the input points across frames to track in the entire video."""
+        """
+        Propagate the input points across frames to track in the entire video.
+
+        For a re-propagation after a correction (e.g. from the corrected frame), if
+        `early_stop_iou_thresh` is set, the tracking stops once the new masks of all
+        the objects match the ones of the previous propagation (with at least this
+        IoU) on `early_stop_num_frames` consecutive frames (by default the number of
+        memory frames, `num_maskmem`). The stored outputs of the previous propagation
+        are then reused (and still yielded) for the next frames, and the tracking
+        only resumes on a frame without a stored output.
+        """
         self.propagate_in_video_preflight(inference_state)
 
         output_dict = inference_state["output_dict"]
@@ -712,8 +767,24 @@ class SAM2VideoPredictor(SAM2Base):
                 start_frame_idx + max_frame_num_to_track, num_frames - 1
             )
             processing_order = range(start_frame_idx, end_frame_idx + 1)
+        if early_stop_num_frames is None:
+            early_stop_num_frames = self.num_maskmem
+        # number of consecutive tracked frames whose masks match the stored ones
+        num_converged_frames = 0
 
         for frame_idx in tqdm(processing_order, desc="propagate in video"):
+            stored_out = output_dict["non_cond_frame_outputs"].get(frame_idx)
+            if (
+                stored_out is not None
+                and stored_out["pred_masks"].size(0) != batch_size
+            ):
+                # stored before objects were added
+                stored_out = None
+            reuse_stored_out = (
+                early_stop_iou_thresh is not None
+                and num_converged_frames >= early_stop_num_frames
+                and stored_out is not None
+            )
             # We skip those frames already in consolidated outputs (these are frames
             # that received input clicks or mask). Note that we cannot directly run
             # batched forward on them via `_run_single_frame_inference` because the
@@ -729,6 +800,10 @@ class SAM2VideoPredictor(SAM2Base):
                 storage_key = "non_cond_frame_outputs"
                 current_out = output_dict[storage_key][frame_idx]
                 pred_masks = current_out["pred_masks"]
+            elif reuse_stored_out:
+                storage_key = "non_cond_frame_outputs"
+                current_out = stored_out
+                pred_masks = current_out["pred_masks"]
             else:
                 storage_key = "non_cond_frame_outputs"
                 current_out, pred_masks = self._run_single_frame_inference(
@@ -743,12 +818,23 @@ class SAM2VideoPredictor(SAM2Base):
                     run_mem_encoder=True,
                 )
                 output_dict[storage_key][frame_idx] = current_out
+                if early_stop_iou_thresh is not None:
+                    converged = stored_out is not None and self._masks_match(
+                        current_out["pred_masks"],
+                        stored_out["pred_masks"],
+                        early_stop_iou_thresh,
+                    )
+                    num_converged_frames = num_converged_frames + 1 if converged else 0
             # Create slices of per-object outputs for subsequent interaction with each
             # individual object after tracking.
             self._add_output_per_object(
                 inference_state, frame_idx, current_out, storage_key
             )
-            inference_state["frames_already_tracked"][frame_idx] = {"reverse": reverse}
+            if not reuse_stored_out:
+                # (a reused output keeps the direction it was tracked in)
+                inference_state["frames_already_tracked"][frame_idx] = {
+                    "reverse": reverse
+                }
 
             # Resize the output mask to the original video resolution (we directly use
             # the mask scores on GPU for output to avoid any CPU conversion in between)
@@ -756,6 +842,7 @@ class SAM2VideoPredictor(SAM2Base):
                 inference_state, pred_masks
             )
             yield frame_idx, obj_ids, video_res_masks
+
     @torch.inference_mode()
     def add_new_frame(self, inference_state, new_image):
         """
@@ -767,18 +854,25 @@ class SAM2VideoPredictor(SAM2Base):
             frame_idx (int): The index of the newly added frame within the inference state.
         """
         device = inference_state["device"]
+        frame_storage = inference_state.get("frame_storage", "float")
 
-        # Preprocess the input frame and convert it to a normalized tensor
+        # Preprocess the input frame and convert it to a tensor (normalized, or uint8
+        # to be normalized by `normalize_frames`)
         img_tensor, orig_h, orig_w = process_stream_frame(
             img_array=new_image,
             image_size=self.image_size,
             offload_to_cpu=False,
             compute_device=device,
+            frame_storage="float" if frame_storage == "float" else "uint8",
         )
 
         # Handle initialization of the image sequence if this is the first frame
         images = inference_state.get("images", None)
-        if images is None or (isinstance(images, list) and len(images) == 0):
+        if frame_storage == "jpeg":
+            if images is None or len(images) == 0:
+                inference_state["images"] = JPEGVideoFrames()
+            inference_state["images"].append(img_tensor)
+        elif images is None or len(images) == 0:
             # First frame: initialize image tensor batch
             inference_state["images"] = img_tensor.unsqueeze(0)  # Shape: [1, C, H, W]
         else:
@@ -794,11 +888,11 @@ class SAM2VideoPredictor(SAM2Base):
             )
 
         # Update frame count and compute new frame index
-        inference_state["num_frames"] = inference_state["images"].shape[0]
+        inference_state["num_frames"] = len(inference_state["images"])
         frame_idx = inference_state["num_frames"] - 1
 
         # Cache visual features for the newly added frame
-        image_batch = img_tensor.float().unsqueeze(0)  # Shape: [1, C, H, W]
+        image_batch = normalize_frames(img_tensor).unsqueeze(0)  # Shape: [1, C, H, W]
         backbone_out = self.forward_image(image_batch)
         inference_state["cached_features"][frame_idx] = (image_batch, backbone_out)
 
@@ -1004,11 +1098,13 @@ class SAM2VideoPredictor(SAM2Base):
         for v in inference_state["mask_inputs_per_obj"].values():
             v.clear()
         for v in inference_state["output_dict_per_obj"].values():
+            self._clear_memory_kv(v)
             v["cond_frame_outputs"].clear()
             v["non_cond_frame_outputs"].clear()
         for v in inference_state["temp_output_dict_per_obj"].values():
             v["cond_frame_outputs"].clear()
             v["non_cond_frame_outputs"].clear()
+        self._clear_memory_kv(inference_state["output_dict"])
         inference_state["output_dict"]["cond_frame_outputs"].clear()
         inference_state["output_dict"]["non_cond_frame_outputs"].clear()
         inference_state["consolidated_frame_inds"]["cond_frame_outputs"].clear()
@@ -1025,7 +1121,10 @@ class SAM2VideoPredictor(SAM2Base):
         if backbone_out is None:
             # Cache miss -- we will run inference on a single image
             device = inference_state["device"]
-            image = inference_state["images"][frame_idx].to(device).float().unsqueeze(0)
+            # the frames are stored as uint8 (by default) and normalized right before
+            # the image encoder
+            image = inference_state["images"][frame_idx].to(device)
+            image = normalize_frames(image).unsqueeze(0)
             backbone_out = self.forward_image(image)
             # Cache the most recent frame's feature (for repeated interactions with
             # a frame; we can use an LRU cache for more frames in the future).
@@ -1178,6 +1277,16 @@ class SAM2VideoPredictor(SAM2Base):
             expanded_maskmem_pos_enc = None
         return expanded_maskmem_pos_enc
 
+    def _masks_match(self, pred_masks, other_pred_masks, iou_thresh):
+        """Whether the masks of all the objects match with at least an IoU threshold."""
+        masks = pred_masks.flatten(1) > 0
+        other_masks = other_pred_masks.flatten(1) > 0
+        intersection = (masks & other_masks).sum(dim=1)
+        union = (masks | other_masks).sum(dim=1)
+        # two empty masks match
+        ious = torch.where(union > 0, intersection / union.clamp(min=1), 1.0)
+        return bool((ious >= iou_thresh).all())
+
     @torch.inference_mode()
     def remove_object(self, inference_state, obj_id, strict=False, need_output=True):
         """
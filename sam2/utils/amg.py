@@ -319,15 +319,18 @@ def batched_mask_to_box(masks: torch.Tensor) -> torch.Tensor:
     else:
         masks = masks.unsqueeze(0)
 
+    # The max over uint8 is vectorized on CPU, unlike the one over bool
+    masks_max = masks.view(torch.uint8) if masks.dtype == torch.bool else masks
+
     # Get top and bottom edges
-    in_height, _ = torch.max(masks, dim=-1)
+    in_height = masks_max.amax(dim=-1).to(masks.dtype)
     in_height_coords = in_height * torch.arange(h, device=in_height.device)[None, :]
     bottom_edges, _ = torch.max(in_height_coords, dim=-1)
     in_height_coords = in_height_coords + h * (~in_height)
     top_edges, _ = torch.min(in_height_coords, dim=-1)
 
     # Get left and right edges
-    in_width, _ = torch.max(masks, dim=-2)
+    in_width = masks_max.amax(dim=-2).to(masks.dtype)
     in_width_coords = in_width * torch.arange(w, device=in_width.device)[None, :]
     right_edges, _ = torch.max(in_width_coords, dim=-1)
     in_width_coords = in_width_coords + w * (~in_width)
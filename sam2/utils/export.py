@@ -0,0 +1,590 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Export of the SAM 2 components to ONNX or TorchScript graphs, and a runtime
+running them in place of the PyTorch modules of a SAM 2 model (e.g. on CPU with
+ONNX Runtime). The model is split into the graphs:
+  - "image_encoder": the image encoder (with the high-resolution feature projections
+    of the mask decoder, as in `SAM2Base.forward_image`)
+  - "prompt_mask_decoder": the prompt encoder and the mask decoder
+  - "memory_attention": the memory attention, with a dynamic number of memories
+    and object pointers
+  - "memory_encoder": the memory encoder
+
+Usage:
+    model = build_sam2(config, ckpt_path, device="cpu", runtime="onnx")
+or
+    export_sam2(model, export_dir, backend="onnx")
+    enable_exported_runtime(model, export_dir, backend="onnx")
+"""
+
+import logging
+import math
+import os
+import warnings
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch import nn
+
+from sam2.modeling.sam.transformer import RoPEAttention
+
+COMPONENTS = ["image_encoder", "prompt_mask_decoder", "memory_attention", "memory_encoder"]
+BACKENDS = {"onnx": ".onnx", "torchscript": ".pt"}
+
+
+class ImageEncoderGraph(nn.Module):
+    """`SAM2Base.forward_image`, returning the FPN features and their position encodings."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, image):
+        backbone_out = self.model.forward_image(image)
+        return (*backbone_out["backbone_fpn"], *backbone_out["vision_pos_enc"])
+
+
+class PromptMaskDecoderGraph(nn.Module):
+    """
+    The SAM prompt encoder and mask decoder, with the point prompts padded as in
+    `PromptEncoder.forward` and an optional mask prompt (used if `has_mask_input` > 0,
+    as in the ONNX export of SAM). Returns the outputs of `MaskDecoder.predict_masks`
+    (the output masks are selected with `MaskDecoder.select_masks`).
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        assert model.use_high_res_features_in_sam, "only models with high-res features are supported"
+        self.prompt_encoder = model.sam_prompt_encoder
+        self.mask_decoder = model.sam_mask_decoder
+
+    def _embed_points(self, point_coords, point_labels):
+        # same as `PromptEncoder._embed_points` (with padding), without in-place
+        # updates on boolean masks
+        prompt_encoder = self.prompt_encoder
+        point_coords = torch.cat([point_coords + 0.5, torch.zeros_like(point_coords[:, :1])], dim=1)
+        point_labels = torch.cat([point_labels, torch.full_like(point_labels[:, :1], -1)], dim=1)
+        h, w = prompt_encoder.input_image_size
+        coords = point_coords / torch.tensor([w, h], dtype=point_coords.dtype, device=point_coords.device)
+        point_embedding = prompt_encoder.pe_layer._pe_encoding(coords.float())
+        point_labels = point_labels.unsqueeze(-1)
+        point_embedding = torch.where(
+            point_labels == -1, prompt_encoder.not_a_point_embed.weight, point_embedding
+        )
+        for i in range(prompt_encoder.num_point_embeddings):
+            point_embedding = torch.where(
+                point_labels == i,
+                point_embedding + prompt_encoder.point_embeddings[i].weight,
+                point_embedding,
+            )
+        return point_embedding
+
+    def forward(
+        self,
+        image_embeddings,
+        feat_s0,
+        feat_s1,
+        point_coords,
+        point_labels,
+        mask_input,
+        has_mask_input,
+    ):
+        sparse_embeddings = self._embed_points(point_coords, point_labels)
+        dense_embeddings = torch.where(
+            has_mask_input.reshape(-1, 1, 1, 1) > 0,
+            self.prompt_encoder._embed_masks(mask_input),
+            self.prompt_encoder.no_mask_embed.weight.reshape(1, -1, 1, 1),
+        )
+        return self.mask_decoder.predict_masks(
+            image_embeddings=image_embeddings,
+            image_pe=self.prompt_encoder.get_dense_pe(),
+            sparse_prompt_embeddings=sparse_embeddings,
+            dense_prompt_embeddings=dense_embeddings,
+            repeat_image=False,
+            high_res_features=[feat_s0, feat_s1],
+        )
+
+
+def _apply_rope(x, cos, sin):
+    # rotate the (even, odd) channel pairs of x [..., N, C] by the [N, C/2] angles,
+    # as `apply_rotary_enc` with real numbers (complex tensors can't be exported)
+    x = x.float().reshape(*x.shape[:-1], -1, 2)
+    x0, x1 = x[..., 0], x[..., 1]
+    return torch.stack([x0 * cos - x1 * sin, x0 * sin + x1 * cos], dim=-1).flatten(-2)
+
+
+class MemoryAttentionGraph(nn.Module):
+    """
+    `MemoryAttention.forward` on the (H*W)xBxC features of a frame, with the memories
+    split into the spatial memories (whose keys get the rotary position encoding,
+    for any number of memory frames) and the object pointers (`num_obj_ptr_tokens`).
+    The optional boolean `memory_mask` and `obj_ptrs_mask` select the memory tokens
+    and object pointer tokens to attend to (e.g. the filled slots of a fixed-size
+    memory bank, see `sam2.utils.static_track_step`).
+    """
+
+    def __init__(self, memory_attention, feat_size):
+        super().__init__()
+        self.memory_attention = memory_attention
+        self.num_tokens = feat_size[0] * feat_size[1]
+        # the rotary encodings of `RoPEAttention` for the feature size (see `RoPEAttention.forward`)
+        w = h = math.sqrt(self.num_tokens)
+        for i, layer in enumerate(memory_attention.layers):
+            for name in ["self_attn", "cross_attn_image"]:
+                attn = getattr(layer, name)
+                if isinstance(attn, RoPEAttention):
+                    freqs_cis = attn.compute_cis(end_x=w, end_y=h)
+                    self.register_buffer(f"{name}_cos_{i}", freqs_cis.real.contiguous(), persistent=False)
+                    self.register_buffer(f"{name}_sin_{i}", freqs_cis.imag.contiguous(), persistent=False)
+
+    def _attention(self, attn, rope, q, k, v, k_no_rope=None, v_no_rope=None, attn_mask=None):
+        q = attn._separate_heads(attn.q_proj(q), attn.num_heads)
+        k = attn._separate_heads(attn.k_proj(k), attn.num_heads)
+        v = attn.v_proj(v)
+        if rope is not None:
+            cos, sin = rope
+            q = _apply_rope(q, cos, sin).type_as(q)
+            # repeat the rotary encoding over the memory frames
+            b, n_heads, _, c_per_head = k.shape
+            k = k.reshape(b, n_heads, -1, self.num_tokens, c_per_head)
+            k = _apply_rope(k, cos, sin).type_as(k).flatten(2, 3)
+        if k_no_rope is not None:
+            k = torch.cat([k, attn._separate_heads(attn.k_proj(k_no_rope), attn.num_heads)], dim=2)
+            v = torch.cat([v, attn.v_proj(v_no_rope)], dim=1)
+        v = attn._separate_heads(v, attn.num_heads)
+        out = F.scaled_dot_product_attention(q, k, v, attn_mask=attn_mask)
+        return attn.out_proj(attn._recombine_heads(out))
+
+    def _rope(self, name, i):
+        if not hasattr(self, f"{name}_cos_{i}"):
+            return None
+        return getattr(self, f"{name}_cos_{i}"), getattr(self, f"{name}_sin_{i}")
+
+    def forward(
+        self,
+        curr,
+        curr_pos,
+        memory,
+        memory_pos,
+        obj_ptrs,
+        obj_ptrs_pos,
+        memory_mask=None,
+        obj_ptrs_mask=None,
+    ):
+        memory_attention = self.memory_attention
+        attn_mask = None
+        if memory_mask is not None:
+            # mask the keys of the cross-attention, broadcast over the batch, heads and queries
+            attn_mask = torch.cat([memory_mask, obj_ptrs_mask]).view(1, 1, 1, -1)
+        output = curr
+        if memory_attention.pos_enc_at_input:
+            output = output + 0.1 * curr_pos
+        if memory_attention.batch_first:
+            output, curr_pos = output.transpose(0, 1), curr_pos.transpose(0, 1)
+            memory, memory_pos = memory.transpose(0, 1), memory_pos.transpose(0, 1)
+            obj_ptrs, obj_ptrs_pos = obj_ptrs.transpose(0, 1), obj_ptrs_pos.transpose(0, 1)
+
+        for i, layer in enumerate(memory_attention.layers):
+            # self-attention
+            tgt2 = layer.norm1(output)
+            q = tgt2 + curr_pos if layer.pos_enc_at_attn else tgt2
+            output = output + self._attention(layer.self_attn, self._rope("self_attn", i), q, q, tgt2)
+            # cross-attention to the memories (the object pointers don't get the rotary encoding)
+            tgt2 = layer.norm2(output)
+            cross_attn = layer.cross_attn_image
+            rope = self._rope("cross_attn_image", i)
+            q = tgt2 + curr_pos if layer.pos_enc_at_cross_attn_queries else tgt2
+            k = memory + memory_pos if layer.pos_enc_at_cross_attn_keys else memory
+            k_ptrs = obj_ptrs + obj_ptrs_pos if layer.pos_enc_at_cross_attn_keys else obj_ptrs
+            if rope is None:
+                k, memory_v = torch.cat([k, k_ptrs]), torch.cat([memory, obj_ptrs])
+                output = output + self._attention(
+                    cross_attn, None, q, k, memory_v, attn_mask=attn_mask
+                )
+            else:
+                output = output + self._attention(
+                    cross_attn, rope, q, k, memory, k_ptrs, obj_ptrs, attn_mask
+                )
+            # MLP
+            tgt2 = layer.norm3(output)
+            output = output + layer.linear2(layer.activation(layer.linear1(tgt2)))
+        normed_output = memory_attention.norm(output)
+
+        if memory_attention.batch_first:
+            normed_output = normed_output.transpose(0, 1)
+        return normed_output
+
+
+class MemoryEncoderGraph(nn.Module):
+    """`MemoryEncoder.forward` on masks with the sigmoid already applied."""
+
+    def __init__(self, memory_encoder):
+        super().__init__()
+        self.memory_encoder = memory_encoder
+
+    def forward(self, pix_feat, masks):
+        maskmem_out = self.memory_encoder(pix_feat, masks, skip_mask_sigmoid=True)
+        return maskmem_out["vision_features"], maskmem_out["vision_pos_enc"][0]
+
+
+def get_component_graphs(model, batch_size=2, num_points=2, num_memory_frames=2, num_obj_ptrs=4):
+    """
+    The graph modules of the components of a SAM 2 model, with sample inputs (of
+    `batch_size` objects, with `num_points` point prompts, and `num_memory_frames`
+    spatial memories and `num_obj_ptrs` object pointers in the memory attention)
+    and the names and dynamic axes of their inputs and outputs.
+    """
+    device = model.device
+    image_size = model.image_size
+    # the backbone stride of the 3 feature levels is 4, 8 and 16
+    feat_sizes = [(image_size // s, image_size // s) for s in [4, 8, 16]]
+    num_levels = len(feat_sizes)
+    hidden_dim, mem_dim = model.hidden_dim, model.mem_dim
+    num_tokens = feat_sizes[-1][0] * feat_sizes[-1][1]
+    num_obj_ptr_tokens = num_obj_ptrs * (hidden_dim // mem_dim)
+    mask_input_size = model.sam_prompt_encoder.mask_input_size
+
+    def randn(*shape):
+        return torch.randn(*shape, device=device)
+
+    graphs = {
+        "image_encoder": (
+            ImageEncoderGraph(model).eval(),
+            (randn(1, 3, image_size, image_size),),
+            ["image"],
+            [f"backbone_fpn_{i}" for i in range(num_levels)]
+            + [f"vision_pos_enc_{i}" for i in range(num_levels)],
+            {"image": {0: "batch"}},
+        ),
+        "prompt_mask_decoder": (
+            PromptMaskDecoderGraph(model).eval(),
+            (
+                randn(batch_size, hidden_dim, *feat_sizes[2]),
+                randn(batch_size, hidden_dim // 8, *feat_sizes[0]),
+                randn(batch_size, hidden_dim // 4, *feat_sizes[1]),
+                torch.rand(batch_size, num_points, 2, device=device) * image_size,
+                torch.randint(-1, 4, (batch_size, num_points), dtype=torch.int32, device=device),
+                randn(1, 1, *mask_input_size),
+                torch.ones(1, device=device),
+            ),
+            [
+                "image_embeddings",
+                "feat_s0",
+                "feat_s1",
+                "point_coords",
+                "point_labels",
+                "mask_input",
+                "has_mask_input",
+            ],
+            ["masks", "iou_pred", "mask_tokens_out", "object_score_logits"],
+            {
+                "image_embeddings": {0: "batch"},
+                "feat_s0": {0: "batch"},
+                "feat_s1": {0: "batch"},
+                "point_coords": {0: "batch", 1: "num_points"},
+                "point_labels": {0: "batch", 1: "num_points"},
+                "mask_input": {0: "mask_batch"},
+            },
+        ),
+        "memory_attention": (
+            MemoryAttentionGraph(model.memory_attention, feat_sizes[-1]).eval(),
+            (
+                randn(num_tokens, batch_size, hidden_dim),
+                randn(num_tokens, batch_size, hidden_dim),
+                randn(num_memory_frames * num_tokens, batch_size, mem_dim),
+                randn(num_memory_frames * num_tokens, batch_size, mem_dim),
+                randn(num_obj_ptr_tokens, batch_size, mem_dim),
+                randn(num_obj_ptr_tokens, batch_size, mem_dim),
+            ),
+            ["curr", "curr_pos", "memory", "memory_pos", "obj_ptrs", "obj_ptrs_pos"],
+            ["pix_feat_with_mem"],
+            {
+                "curr": {1: "batch"},
+                "curr_pos": {1: "batch"},
+                "memory": {0: "num_memory_tokens", 1: "batch"},
+                "memory_pos": {0: "num_memory_tokens", 1: "batch"},
+                "obj_ptrs": {0: "num_obj_ptr_tokens", 1: "batch"},
+                "obj_ptrs_pos": {0: "num_obj_ptr_tokens", 1: "batch"},
+            },
+        ),
+        "memory_encoder": (
+            MemoryEncoderGraph(model.memory_encoder).eval(),
+            (
+                randn(batch_size, hidden_dim, *feat_sizes[-1]),
+                torch.rand(batch_size, 1, image_size, image_size, device=device),
+            ),
+            ["pix_feat", "masks"],
+            ["maskmem_features", "maskmem_pos_enc"],
+            {"pix_feat": {0: "batch"}, "masks": {0: "batch"}},
+        ),
+    }
+    return graphs
+
+
+@torch.no_grad()
+def export_sam2(model, export_dir, backend="onnx", components=None, opset_version=17):
+    """
+    Export the components of a SAM 2 model (see `COMPONENTS`) to `export_dir`, as
+    ONNX graphs ("<component>.onnx") or TorchScript modules ("<component>.pt"). The
+    model is put in eval mode. Returns the paths of the exported graphs.
+    """
+    assert backend in BACKENDS, f"unknown backend {backend}, expected one of {list(BACKENDS)}"
+    components = components or COMPONENTS
+    os.makedirs(export_dir, exist_ok=True)
+    model.eval()
+    graphs = get_component_graphs(model)
+    paths = {}
+    for component in components:
+        graph, inputs, input_names, output_names, dynamic_axes = graphs[component]
+        # run the graph once so that the cached position encodings are computed
+        # outside of the trace
+        graph(*inputs)
+        path = os.path.join(export_dir, component + BACKENDS[backend])
+        with warnings.catch_warnings():
+            # the shape assertions of the modules are checked on the sample inputs only
+            warnings.simplefilter("ignore", torch.jit.TracerWarning)
+            if backend == "onnx":
+                torch.onnx.export(
+                    graph,
+                    inputs,
+                    path,
+                    input_names=input_names,
+                    output_names=output_names,
+                    dynamic_axes=dynamic_axes,
+                    opset_version=opset_version,
+                    dynamo=False,
+                )
+            else:
+                torch.jit.trace(graph, inputs, check_trace=False).save(path)
+        logging.info(f"Exported the SAM 2 {component} to {path}")
+        paths[component] = path
+    return paths
+
+
+class OnnxGraph:
+    """Run an exported ONNX graph with ONNX Runtime, on torch tensors."""
+
+    def __init__(self, path, providers=("CPUExecutionProvider",)):
+        import onnxruntime
+
+        self.session = onnxruntime.InferenceSession(path, providers=list(providers))
+        self.input_names = [x.name for x in self.session.get_inputs()]
+        self.input_types = [
+            np.int32 if x.type == "tensor(int32)" else np.float32
+            for x in self.session.get_inputs()
+        ]
+
+    def __call__(self, *inputs):
+        feed = {
+            name: np.ascontiguousarray(x.detach().cpu().numpy(), dtype=dtype)
+            for name, x, dtype in zip(self.input_names, inputs, self.input_types)
+        }
+        device = inputs[0].device
+        return [torch.from_numpy(x).to(device) for x in self.session.run(None, feed)]
+
+
+class TorchScriptGraph:
+    """Run an exported TorchScript module."""
+
+    def __init__(self, path, device="cpu"):
+        self.module = torch.jit.load(path, map_location=device)
+
+    def __call__(self, *inputs):
+        outputs = self.module(*[x.float() if x.is_floating_point() else x for x in inputs])
+        return list(outputs) if isinstance(outputs, (tuple, list)) else [outputs]
+
+
+def load_graph(path, backend, device="cpu"):
+    if backend == "onnx":
+        return OnnxGraph(path)
+    return TorchScriptGraph(path, device)
+
+
+class ExportedImageEncoder:
+    """Replaces `SAM2Base.forward_image` with the "image_encoder" graph."""
+
+    def __init__(self, model, graph):
+        self.model = model
+        self.graph = graph
+        self.forward = model.forward_image
+
+    def __call__(self, img_batch):
+        if torch.is_grad_enabled():
+            return self.forward(img_batch)
+        outputs = self.graph(img_batch)
+        num_levels = len(outputs) // 2
+        backbone_fpn, vision_pos_enc = outputs[:num_levels], outputs[num_levels:]
+        return {
+            "vision_features": backbone_fpn[-1],
+            "vision_pos_enc": vision_pos_enc,
+            "backbone_fpn": backbone_fpn,
+        }
+
+
+class ExportedPromptMaskDecoder:
+    """Replaces `SAM2Base.forward_prompt_and_mask_decoder` with the "prompt_mask_decoder" graph."""
+
+    def __init__(self, model, graph):
+        self.model = model
+        self.graph = graph
+        self.forward = model.forward_prompt_and_mask_decoder
+
+    def __call__(
+        self,
+        image_embeddings,
+        points,
+        masks,
+        multimask_output,
+        repeat_image,
+        high_res_features=None,
+    ):
+        if torch.is_grad_enabled() or points is None or high_res_features is None:
+            return self.forward(
+                image_embeddings,
+                points,
+                masks,
+                multimask_output,
+                repeat_image,
+                high_res_features,
+            )
+        point_coords, point_labels = points
+        feat_s0, feat_s1 = high_res_features
+        if repeat_image:
+            batch_size = point_coords.size(0)
+            image_embeddings = image_embeddings.expand(batch_size, -1, -1, -1)
+            feat_s0 = feat_s0.expand(batch_size, -1, -1, -1)
+            feat_s1 = feat_s1.expand(batch_size, -1, -1, -1)
+        if masks is None:
+            mask_input_size = self.model.sam_prompt_encoder.mask_input_size
+            masks = image_embeddings.new_zeros(1, 1, *mask_input_size)
+            has_mask_input = image_embeddings.new_zeros(1)
+        else:
+            has_mask_input = image_embeddings.new_ones(1)
+        outputs = self.graph(
+            image_embeddings,
+            feat_s0,
+            feat_s1,
+            point_coords,
+            point_labels.int(),
+            masks,
+            has_mask_input,
+        )
+        return self.model.sam_mask_decoder.select_masks(*outputs, multimask_output)
+
+
+class ExportedMemoryAttention:
+    """Replaces `MemoryAttention.forward` with the "memory_attention" graph."""
+
+    def __init__(self, memory_attention, graph, num_tokens):
+        self.graph = graph
+        self.num_tokens = num_tokens
+        self.forward = memory_attention.forward
+
+    def __call__(
+        self, curr, memory, curr_pos=None, memory_pos=None, num_obj_ptr_tokens=0, memory_kv=None
+    ):
+        curr_ = curr[0] if isinstance(curr, list) else curr
+        curr_pos_ = curr_pos[0] if isinstance(curr_pos, list) else curr_pos
+        num_memory_tokens = memory.size(0) - num_obj_ptr_tokens
+        if memory_kv is not None:
+            # the cached projections of the memories (`SAM2Base.cache_memory_kv`)
+            return self.forward(
+                curr, memory, curr_pos, memory_pos, num_obj_ptr_tokens, memory_kv
+            )
+        if (
+            torch.is_grad_enabled()
+            or curr_pos_ is None
+            or curr_.size(0) != self.num_tokens
+            or num_memory_tokens % self.num_tokens != 0
+            or num_obj_ptr_tokens == 0
+        ):
+            # e.g. the `no_mem_embed` dummy memory of the first frame, or models
+            # without object pointers (the graph can't reshape empty inputs)
+            return self.forward(curr, memory, curr_pos, memory_pos, num_obj_ptr_tokens)
+        (output,) = self.graph(
+            curr_,
+            curr_pos_,
+            memory[:num_memory_tokens],
+            memory_pos[:num_memory_tokens],
+            memory[num_memory_tokens:],
+            memory_pos[num_memory_tokens:],
+        )
+        return output.to(curr_.dtype)
+
+
+class ExportedMemoryEncoder:
+    """Replaces `MemoryEncoder.forward` with the "memory_encoder" graph."""
+
+    def __init__(self, memory_encoder, graph):
+        self.graph = graph
+        self.forward = memory_encoder.forward
+
+    def __call__(self, pix_feat, masks, skip_mask_sigmoid=False):
+        if torch.is_grad_enabled():
+            return self.forward(pix_feat, masks, skip_mask_sigmoid)
+        if not skip_mask_sigmoid:
+            masks = F.sigmoid(masks)
+        maskmem_features, maskmem_pos_enc = self.graph(pix_feat, masks)
+        return {"vision_features": maskmem_features, "vision_pos_enc": [maskmem_pos_enc]}
+
+
+def disable_exported_runtime(model):
+    """Restore the PyTorch modules of a model after `enable_exported_runtime`. Returns the model."""
+    if isinstance(model.forward_image, ExportedImageEncoder):
+        model.forward_image = model.forward_image.forward
+    if isinstance(model.forward_prompt_and_mask_decoder, ExportedPromptMaskDecoder):
+        model.forward_prompt_and_mask_decoder = model.forward_prompt_and_mask_decoder.forward
+    for module in [model.memory_attention, model.memory_encoder]:
+        if isinstance(module.forward, (ExportedMemoryAttention, ExportedMemoryEncoder)):
+            module.forward = module.forward.forward
+    return model
+
+
+def enable_exported_runtime(model, export_dir, backend="onnx", components=None):
+    """
+    Run the components of a SAM 2 model (`SAM2Base`, or a `SAM2VideoPredictor`) with
+    their graphs exported to `export_dir` (exporting the missing ones with
+    `export_sam2`, so `export_dir` must be specific to the model checkpoint). The
+    graphs are only used at inference (without gradients), and the PyTorch modules
+    handle the inputs they don't support. Returns the model.
+    """
+    assert backend in BACKENDS, f"unknown backend {backend}, expected one of {list(BACKENDS)}"
+    components = components or COMPONENTS
+    disable_exported_runtime(model)
+    paths = {
+        component: os.path.join(export_dir, component + BACKENDS[backend])
+        for component in components
+    }
+    missing = [component for component, path in paths.items() if not os.path.exists(path)]
+    if missing:
+        export_sam2(model, export_dir, backend, missing)
+    graphs = {
+        component: load_graph(path, backend, model.device)
+        for component, path in paths.items()
+    }
+
+    # replace the forward of the model and module instances only (the weights and
+    # the state dict of the model are unchanged)
+    if "image_encoder" in graphs:
+        model.forward_image = ExportedImageEncoder(model, graphs["image_encoder"])
+    if "prompt_mask_decoder" in graphs:
+        model.forward_prompt_and_mask_decoder = ExportedPromptMaskDecoder(
+            model, graphs["prompt_mask_decoder"]
+        )
+    if "memory_attention" in graphs:
+        # the memory attention runs on the stride 16 features
+        num_tokens = (model.image_size // 16) ** 2
+        model.memory_attention.forward = ExportedMemoryAttention(
+            model.memory_attention, graphs["memory_attention"], num_tokens
+        )
+    if "memory_encoder" in graphs:
+        model.memory_encoder.forward = ExportedMemoryEncoder(
+            model.memory_encoder, graphs["memory_encoder"]
+        )
+    return model
@@ -4,9 +4,12 @@
 # This source code is licensed under the license found in the
 # LICENSE file in the root directory of this source tree.
 
+import bisect
+import io
 import os
 import warnings
-from threading import Thread
+from collections import OrderedDict
+from threading import Lock, Thread
 
 from typing import Tuple
 import numpy as np
@@ -78,30 +81,90 @@ def mask_to_box(masks: torch.Tensor):
     device = masks.device
     xs = torch.arange(w, device=device, dtype=torch.int32)
     ys = torch.arange(h, device=device, dtype=torch.int32)
-    grid_xs, grid_ys = torch.meshgrid(xs, ys, indexing="xy")
-    grid_xs = grid_xs[None, None, ...].expand(B, 1, h, w)
-    grid_ys = grid_ys[None, None, ...].expand(B, 1, h, w)
-    min_xs, _ = torch.min(torch.where(masks, grid_xs, w).flatten(-2), dim=-1)
-    max_xs, _ = torch.max(torch.where(masks, grid_xs, -1).flatten(-2), dim=-1)
-    min_ys, _ = torch.min(torch.where(masks, grid_ys, h).flatten(-2), dim=-1)
-    max_ys, _ = torch.max(torch.where(masks, grid_ys, -1).flatten(-2), dim=-1)
+    # reduce the masks to their row and column projections first, instead of
+    # taking the min/max over a full coordinate grid for each mask
+    masks_max = masks.view(torch.uint8) if masks.dtype == torch.bool else masks
+    in_xs = masks_max.amax(dim=-2) > 0
+    in_ys = masks_max.amax(dim=-1) > 0
+    min_xs, _ = torch.min(torch.where(in_xs, xs, w), dim=-1)
+    max_xs, _ = torch.max(torch.where(in_xs, xs, -1), dim=-1)
+    min_ys, _ = torch.min(torch.where(in_ys, ys, h), dim=-1)
+    max_ys, _ = torch.max(torch.where(in_ys, ys, -1), dim=-1)
     bbox_coords = torch.stack((min_xs, min_ys, max_xs, max_ys), dim=-1)
 
     return bbox_coords
 
 
-def _load_img_as_tensor(img_path, image_size):
+def _load_img_as_tensor(img_path, image_size, as_uint8=False):
     img_pil = Image.open(img_path)
     img_np = np.array(img_pil.convert("RGB").resize((image_size, image_size)))
-    if img_np.dtype == np.uint8:  # np.uint8 is expected for JPEG images
-        img_np = img_np / 255.0
-    else:
+    if img_np.dtype != np.uint8:  # np.uint8 is expected for JPEG images
         raise RuntimeError(f"Unknown image dtype: {img_np.dtype} on {img_path}")
+    if not as_uint8:
+        img_np = img_np / 255.0
     img = torch.from_numpy(img_np).permute(2, 0, 1)
     video_width, video_height = img_pil.size  # the original video size
     return img, video_height, video_width
 
 
+def normalize_frames(
+    images,
+    img_mean=(0.485, 0.456, 0.406),
+    img_std=(0.229, 0.224, 0.225),
+):
+    """
+    Convert video frames ([..., 3, H, W]) to the float input of the model. uint8 frames
+    (as stored with `frame_storage="uint8"` or `"jpeg"`) are scaled to [0, 1] and
+    normalized by mean and std on their device, while other frames are already
+    normalized and are only cast to float.
+    """
+    if images.dtype != torch.uint8:
+        return images.float()
+    img_mean = torch.tensor(img_mean, dtype=torch.float32, device=images.device)
+    img_std = torch.tensor(img_std, dtype=torch.float32, device=images.device)
+    images = images.float() / 255.0
+    images -= img_mean[:, None, None]
+    images /= img_std[:, None, None]
+    return images
+
+
+class JPEGVideoFrames:
+    """
+    A list of video frames stored as JPEG-compressed bytes (typically ~10x smaller
+    than uint8 frames), which are decoded to uint8 tensors [3, H, W] when they're
+    accessed. The compression is lossy, so the model outputs differ slightly from
+    those on uint8 frames.
+    """
+
+    def __init__(self, quality=95):
+        self.quality = quality
+        self.frames = []
+
+    def append(self, img):
+        img_pil = Image.fromarray(img.permute(1, 2, 0).cpu().numpy())
+        buffer = io.BytesIO()
+        img_pil.save(buffer, format="JPEG", quality=self.quality)
+        self.frames.append(buffer.getvalue())
+
+    def __getitem__(self, index):
+        img_np = np.array(Image.open(io.BytesIO(self.frames[index])).convert("RGB"))
+        return torch.from_numpy(img_np).permute(2, 0, 1)
+
+    def __len__(self):
+        return len(self.frames)
+
+    @property
+    def nbytes(self):
+        return sum(len(frame) for frame in self.frames)
+
+
+def _check_frame_storage(frame_storage, async_loading_frames=False):
+    if frame_storage not in ["float", "uint8", "jpeg"]:
+        raise ValueError(f"unknown frame storage {frame_storage}")
+    if async_loading_frames and frame_storage == "jpeg":
+        raise ValueError("JPEG frame storage isn't supported with async loading")
+
+
 class AsyncVideoFrameLoader:
     """
     A list of video frames to be load asynchronously without blocking session start.
@@ -115,12 +178,14 @@ class AsyncVideoFrameLoader:
         img_mean,
         img_std,
         compute_device,
+        frame_storage="float",
     ):
         self.img_paths = img_paths
         self.image_size = image_size
         self.offload_video_to_cpu = offload_video_to_cpu
         self.img_mean = img_mean
         self.img_std = img_std
+        self.frame_storage = frame_storage
         # items in `self.images` will be loaded asynchronously
         self.images = [None] * len(img_paths)
         # catch and raise any exceptions in the async loading thread
@@ -154,13 +219,16 @@ class AsyncVideoFrameLoader:
             return img
 
         img, video_height, video_width = _load_img_as_tensor(
-            self.img_paths[index], self.image_size
+            self.img_paths[index],
+            self.image_size,
+            as_uint8=self.frame_storage == "uint8",
         )
         self.video_height = video_height
         self.video_width = video_width
-        # normalize by mean and std
-        img -= self.img_mean
-        img /= self.img_std
+        if self.frame_storage == "float":
+            # normalize by mean and std
+            img -= self.img_mean
+            img /= self.img_std
         if not self.offload_video_to_cpu:
             img = img.to(self.compute_device, non_blocking=True)
         self.images[index] = img
@@ -170,6 +238,135 @@ class AsyncVideoFrameLoader:
         return len(self.images)
 
 
+class AsyncVideoFileFrameLoader:
+    """
+    A list of the frames of a video file, decoded lazily without blocking session start.
+
+    The frames are decoded in chunks, delimited by the key frames of the video (and at
+    most `max_chunk_size` frames long), so any frame can be accessed by seeking to the
+    start of its chunk. The decoded chunks are kept in a bounded LRU cache of
+    `num_cached_chunks` chunks (as uint8), and the frames are normalized when they're
+    accessed (or returned as uint8 with `frame_storage="uint8"`). The
+    `num_prefetch_chunks` chunks after the last accessed one are decoded ahead in a
+    background thread.
+    """
+
+    def __init__(
+        self,
+        video_path,
+        image_size,
+        offload_video_to_cpu,
+        img_mean,
+        img_std,
+        compute_device,
+        frame_storage="float",
+        max_chunk_size=16,
+        num_cached_chunks=4,
+        num_prefetch_chunks=2,
+    ):
+        import decord
+
+        assert num_cached_chunks > num_prefetch_chunks, "prefetching would evict chunks"
+        self.offload_video_to_cpu = offload_video_to_cpu
+        self.compute_device = compute_device
+        self.frame_storage = frame_storage
+        if not offload_video_to_cpu:
+            img_mean = img_mean.to(compute_device)
+            img_std = img_std.to(compute_device)
+        self.img_mean = img_mean
+        self.img_std = img_std
+        self.num_cached_chunks = num_cached_chunks
+        self.num_prefetch_chunks = num_prefetch_chunks
+        # catch and raise any exceptions in the async loading thread
+        self.exception = None
+        self.thread = None
+
+        decord.bridge.set_bridge("torch")
+        # Get the original video height and width
+        self.video_height, self.video_width, _ = (
+            decord.VideoReader(video_path).next().shape
+        )
+        self.reader = decord.VideoReader(
+            video_path, width=image_size, height=image_size
+        )
+        self.num_frames = len(self.reader)
+        # start frame of each chunk: the key frames, and every `max_chunk_size` frames
+        # within long groups of pictures
+        key_indices = sorted({0, *map(int, self.reader.get_key_indices())})
+        key_indices.append(self.num_frames)
+        self.chunk_starts = []
+        for start, end in zip(key_indices[:-1], key_indices[1:]):
+            self.chunk_starts.extend(range(start, end, max_chunk_size))
+        self.chunk_ends = self.chunk_starts[1:] + [self.num_frames]
+        # decoded chunks (uint8 frames) by chunk index, least recently used first
+        self.chunks = OrderedDict()
+        # the video reader isn't thread-safe, and it's only accessed under this lock
+        self.lock = Lock()
+
+        # decode the first frame (and its chunk) to cache it, since it's most likely
+        # where the user will click
+        self.__getitem__(0)
+
+    def _get_chunk(self, chunk_idx):
+        with self.lock:
+            chunk = self.chunks.get(chunk_idx)
+            if chunk is not None:
+                self.chunks.move_to_end(chunk_idx)
+                return chunk
+            start, end = self.chunk_starts[chunk_idx], self.chunk_ends[chunk_idx]
+            chunk = self.reader.get_batch(list(range(start, end)))
+            self.chunks[chunk_idx] = chunk
+            while len(self.chunks) > self.num_cached_chunks:
+                self.chunks.popitem(last=False)
+            return chunk
+
+    def _prefetch_chunks(self, chunk_idx):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        end_chunk_idx = min(
+            chunk_idx + 1 + self.num_prefetch_chunks, len(self.chunk_starts)
+        )
+        chunk_inds = [
+            n for n in range(chunk_idx + 1, end_chunk_idx) if n not in self.chunks
+        ]
+        if len(chunk_inds) == 0:
+            return
+
+        # decode the next chunks asynchronously without blocking the current frame
+        def _load_chunks():
+            try:
+                for n in chunk_inds:
+                    self._get_chunk(n)
+            except Exception as e:
+                self.exception = e
+
+        self.thread = Thread(target=_load_chunks, daemon=True)
+        self.thread.start()
+
+    def __getitem__(self, index):
+        if self.exception is not None:
+            raise RuntimeError("Failure in frame loading thread") from self.exception
+        if not 0 <= index < self.num_frames:
+            raise IndexError(f"frame index {index} out of range")
+
+        chunk_idx = bisect.bisect_right(self.chunk_starts, index) - 1
+        chunk = self._get_chunk(chunk_idx)
+        self._prefetch_chunks(chunk_idx)
+        img = chunk[index - self.chunk_starts[chunk_idx]].permute(2, 0, 1)
+        if not self.offload_video_to_cpu:
+            img = img.to(self.compute_device, non_blocking=True)
+        if self.frame_storage == "uint8":
+            return img
+        # normalize by mean and std
+        img = img.float() / 255.0
+        img -= self.img_mean
+        img /= self.img_std
+        return img
+
+    def __len__(self):
+        return self.num_frames
+
+
 def load_video_frames(
     video_path,
     image_size,
@@ -178,11 +375,19 @@ def load_video_frames(
     img_std=(0.229, 0.224, 0.225),
     async_loading_frames=False,
     compute_device=torch.device("cuda"),
+    frame_storage="float",
 ):
     """
     Load the video frames from video_path. The frames are resized to image_size as in
     the model and are loaded to GPU if offload_video_to_cpu=False. This is used by the demo.
+
+    The frames are stored according to `frame_storage`:
+    - "float": normalized float32 frames (as the input of the model);
+    - "uint8": uint8 frames (4x smaller), to be normalized with `normalize_frames`;
+    - "jpeg": JPEG-compressed frames in a `JPEGVideoFrames` (on CPU, lossy), also to be
+      normalized with `normalize_frames` (not supported with `async_loading_frames`).
     """
+    _check_frame_storage(frame_storage, async_loading_frames)
     is_bytes = isinstance(video_path, bytes)
     is_str = isinstance(video_path, str)
     is_mp4_path = is_str and os.path.splitext(video_path)[-1] in [".mp4", ".MP4"]
@@ -193,7 +398,9 @@ def load_video_frames(
             offload_video_to_cpu=offload_video_to_cpu,
             img_mean=img_mean,
             img_std=img_std,
+            async_loading_frames=async_loading_frames,
             compute_device=compute_device,
+            frame_storage=frame_storage,
         )
     elif is_str and os.path.isdir(video_path):
         return load_video_frames_from_jpg_images(
@@ -204,6 +411,7 @@ def load_video_frames(
             img_std=img_std,
             async_loading_frames=async_loading_frames,
             compute_device=compute_device,
+            frame_storage=frame_storage,
         )
     else:
         raise NotImplementedError(
@@ -217,6 +425,7 @@ def process_stream_frame(
     img_std:  Tuple[float, float, float] = (0.229, 0.224, 0.225),
     offload_to_cpu: bool = False,
     compute_device: torch.device = torch.device("cuda"),
+    frame_storage: str = "float",
 ):
     """
     Convert a raw image array (H,W,3 or 3,H,W) into a model‑ready tensor.
@@ -232,8 +441,19 @@ def process_stream_frame(
     img_tensor : torch.FloatTensor  # shape [3, image_size, image_size]
     orig_h     : int
     orig_w     : int
+
+    With `frame_storage="uint8"`, steps 2 and 3 are skipped and the resized frame is
+    returned as a uint8 tensor, to be normalized with `normalize_frames`.
     """
 
+    if frame_storage == "uint8":
+        img_tensor, orig_h, orig_w = _resize_and_convert_to_tensor(
+            img_array, image_size, as_uint8=True
+        )
+        if not offload_to_cpu:
+            img_tensor = img_tensor.to(compute_device)
+        return img_tensor, orig_h, orig_w
+
     # ↪ uses your existing helper so behaviour matches the batch loader
     img_tensor, orig_h, orig_w = _resize_and_convert_to_tensor(img_array, image_size)
 
@@ -251,9 +471,10 @@ def process_stream_frame(
     return img_tensor, orig_h, orig_w
 
 
-def _resize_and_convert_to_tensor(img_array, image_size):
+def _resize_and_convert_to_tensor(img_array, image_size, as_uint8=False):
     """
-    Resize the input image array and convert it into a tensor.
+    Resize the input image array and convert it into a tensor (scaled to [0, 1], or
+    kept as uint8 if `as_uint8` is True).
     Also return original image height and width.
     """
     # Convert numpy array to PIL image and ensure RGB
@@ -268,10 +489,10 @@ def _resize_and_convert_to_tensor(img_array, image_size):
     # Convert resized image back to numpy and then to float tensor
     img_resized_array = np.array(img_resized)
 
-    if img_resized_array.dtype == np.uint8:
-        img_resized_array = img_resized_array / 255.0
-    else:
+    if img_resized_array.dtype != np.uint8:
         raise RuntimeError(f"Unexpected dtype: {img_resized_array.dtype}")
+    if not as_uint8:
+        img_resized_array = img_resized_array / 255.0
 
     # Convert to PyTorch tensor and permute to [C, H, W]
     img_tensor = torch.from_numpy(img_resized_array).permute(2, 0, 1)
@@ -287,15 +508,18 @@ def load_video_frames_from_jpg_images(
     img_std=(0.229, 0.224, 0.225),
     async_loading_frames=False,
     compute_device=torch.device("cuda"),
+    frame_storage="float",
 ):
     """
     Load the video frames from a directory of JPEG files ("<frame_index>.jpg" format).
 
     The frames are resized to image_size x image_size and are loaded to GPU if
     `offload_video_to_cpu` is `False` and to CPU if `offload_video_to_cpu` is `True`.
+    They are stored according to `frame_storage` (see `load_video_frames`).
 
     You can load a frame asynchronously by setting `async_loading_frames` to `True`.
     """
+    _check_frame_storage(frame_storage, async_loading_frames)
     if isinstance(video_path, str) and os.path.isdir(video_path):
         jpg_folder = video_path
     else:
@@ -330,9 +554,29 @@ def load_video_frames_from_jpg_images(
             img_mean,
             img_std,
             compute_device,
+            frame_storage,
         )
         return lazy_images, lazy_images.video_height, lazy_images.video_width
 
+    if frame_storage != "float":
+        if frame_storage == "jpeg":
+            images = JPEGVideoFrames()
+        else:
+            images = torch.zeros(
+                num_frames, 3, image_size, image_size, dtype=torch.uint8
+            )
+        for n, img_path in enumerate(tqdm(img_paths, desc="frame loading (JPEG)")):
+            img, video_height, video_width = _load_img_as_tensor(
+                img_path, image_size, as_uint8=True
+            )
+            if frame_storage == "jpeg":
+                images.append(img)
+            else:
+                images[n] = img
+        if frame_storage == "uint8" and not offload_video_to_cpu:
+            images = images.to(compute_device)
+        return images, video_height, video_width
+
     images = torch.zeros(num_frames, 3, image_size, image_size, dtype=torch.float32)
     for n, img_path in enumerate(tqdm(img_paths, desc="frame loading (JPEG)")):
         images[n], video_height, video_width = _load_img_as_tensor(img_path, image_size)
@@ -352,22 +596,51 @@ def load_video_frames_from_video_file(
     offload_video_to_cpu,
     img_mean=(0.485, 0.456, 0.406),
     img_std=(0.229, 0.224, 0.225),
+    async_loading_frames=False,
     compute_device=torch.device("cuda"),
+    frame_storage="float",
 ):
-    """Load the video frames from a video file."""
+    """
+    Load the video frames from a video file, stored according to `frame_storage` (see
+    `load_video_frames`).
+
+    You can load the frames lazily by setting `async_loading_frames` to `True`, in
+    which case they are decoded in chunks when they're accessed (see
+    `AsyncVideoFileFrameLoader`) instead of all at once.
+    """
     import decord
 
+    _check_frame_storage(frame_storage, async_loading_frames)
     img_mean = torch.tensor(img_mean, dtype=torch.float32)[:, None, None]
     img_std = torch.tensor(img_std, dtype=torch.float32)[:, None, None]
+    if async_loading_frames:
+        lazy_images = AsyncVideoFileFrameLoader(
+            video_path,
+            image_size,
+            offload_video_to_cpu,
+            img_mean,
+            img_std,
+            compute_device,
+            frame_storage,
+        )
+        return lazy_images, lazy_images.video_height, lazy_images.video_width
+
     # Get the original video height and width
     decord.bridge.set_bridge("torch")
     video_height, video_width, _ = decord.VideoReader(video_path).next().shape
     # Iterate over all frames in the video
-    images = []
+    images = JPEGVideoFrames() if frame_storage == "jpeg" else []
     for frame in decord.VideoReader(video_path, width=image_size, height=image_size):
         images.append(frame.permute(2, 0, 1))
 
-    images = torch.stack(images, dim=0).float() / 255.0
+    if frame_storage == "jpeg":
+        return images, video_height, video_width
+    images = torch.stack(images, dim=0)
+    if frame_storage == "uint8":
+        if not offload_video_to_cpu:
+            images = images.to(compute_device)
+        return images, video_height, video_width
+    images = images.float() / 255.0
     if not offload_video_to_cpu:
         images = images.to(compute_device)
         img_mean = img_mean.to(compute_device)
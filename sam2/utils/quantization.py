@@ -0,0 +1,64 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Dynamic int8 quantization of SAM 2 for CPU inference: the weights of the Linear
+layers of the transformer blocks are stored in int8, and their activations are
+quantized on the fly (`torch.ao.quantization.quantize_dynamic`).
+"""
+
+import logging
+import warnings
+
+import torch
+from torch.ao.quantization import default_dynamic_qconfig, quantize_dynamic
+
+# the transformer blocks whose Linear layers are quantized: the Hiera blocks of the
+# image encoder, the memory attention layers and the two-way transformer of the
+# mask decoder. The other modules stay in fp32, in particular the output heads of
+# the mask decoder (mask hypernetworks, IoU and object score heads), the object
+# pointer projections, the position encodings and the convolutions.
+QUANTIZED_MODULES = [
+    "image_encoder.trunk.blocks",
+    "memory_attention.layers",
+    "sam_mask_decoder.transformer",
+]
+
+
+def quantize_sam2(model, modules=None):
+    """
+    Quantize the Linear layers of the `modules` of a SAM 2 model (by default
+    `QUANTIZED_MODULES`) to dynamic int8, in place. The quantized kernels only run
+    on CPU. Returns the model.
+    """
+    assert model.device.type == "cpu", "dynamic int8 quantization is only supported on CPU"
+    modules = modules or QUANTIZED_MODULES
+    qconfig_spec = {name: default_dynamic_qconfig for name in modules}
+    with warnings.catch_warnings():
+        # the quantized tensor creation functions are deprecated in recent PyTorch versions
+        warnings.simplefilter("ignore", UserWarning)
+        quantize_dynamic(model, qconfig_spec, dtype=torch.qint8, inplace=True)
+    num_quantized = sum(
+        isinstance(m, torch.ao.nn.quantized.dynamic.Linear) for m in model.modules()
+    )
+    logging.info(f"Quantized {num_quantized} Linear layers of SAM 2 to dynamic int8")
+    return model
+
+
+def get_model_size(model):
+    """The size in bytes of the parameters and buffers of a model, including the packed int8 weights."""
+    size = 0
+    for module in model.modules():
+        if isinstance(module, torch.ao.nn.quantized.dynamic.Linear):
+            weight, bias = module._weight_bias()
+            size += weight.numel() * weight.element_size()
+            size += 0 if bias is None else bias.numel() * bias.element_size()
+        else:
+            for tensor in list(module.parameters(recurse=False)) + list(
+                module.buffers(recurse=False)
+            ):
+                size += tensor.numel() * tensor.element_size()
+    return size
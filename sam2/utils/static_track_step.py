@@ -0,0 +1,322 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+A static-shape SAM 2 tracking step for `torch.compile`. `SAM2Base.track_step`
+builds lists of memories of a varying length on every frame (as the memory bank
+fills up) and concatenates them, so a compiled step would recompile on every new
+memory size. `StaticTrackStep` instead copies the memories into fixed-size slots
+  - `num_cond_slots` conditioning frames and the `num_maskmem - 1` previous frames
+    of spatial memories,
+  - `num_cond_slots` conditioning frames and the `max_obj_ptrs_in_encoder - 1`
+    previous frames of object pointers,
+with a validity mask on the keys of the memory attention (the empty slots are not
+attended to), and looks up the temporal position encodings of the slots in tables
+computed once. The step on the tracked frames (without prompts) then has the same
+shapes on all the frames of a video.
+
+Usage:
+    predictor = build_sam2_video_predictor(config, ckpt_path, device="cpu")
+    enable_static_track_step(predictor, compile=True)
+"""
+
+import logging
+
+import torch
+
+from sam2.utils.export import MemoryAttentionGraph
+
+
+class StaticTrackStep:
+    """
+    Replaces `SAM2Base.track_step` with the static-shape step on the tracked frames
+    (the frames with prompts, or with more conditioning frames than `num_cond_slots`
+    to attend to, run the original `track_step`).
+    """
+
+    def __init__(self, model, num_cond_slots=1, compile=False, **compile_kwargs):
+        assert model.num_maskmem > 0, "the static track step needs a memory bank"
+        self.model = model
+        self.forward = model.track_step
+        self.num_cond_slots = num_cond_slots
+        feat_size = (model.image_size // 16, model.image_size // 16)
+        self.memory_attention = MemoryAttentionGraph(model.memory_attention, feat_size)
+        self.memory_attention.eval()
+        # the spatial memory slots (the conditioning frames, then t_pos = 1, ..., num_maskmem - 1)
+        # and the index of their temporal position encoding in `maskmem_tpos_enc`
+        self.num_maskmem_slots = num_cond_slots + model.num_maskmem - 1
+        maskmem_tpos_idx = [model.num_maskmem - 1] * num_cond_slots + [
+            model.num_maskmem - t_pos - 1 for t_pos in range(1, model.num_maskmem)
+        ]
+        self.maskmem_tpos_idx = torch.tensor(maskmem_tpos_idx, device=model.device)
+        # the object pointer slots (the conditioning frames, then t_diff = 1, ..., max_obj_ptrs - 1)
+        self.num_obj_ptr_slots = 0
+        if model.use_obj_ptrs_in_encoder:
+            self.num_obj_ptr_slots = num_cond_slots + model.max_obj_ptrs_in_encoder - 1
+        self._obj_ptr_tpos_tables = {}
+        self._slots = {}
+        self.step = self._step
+        if compile:
+            self.step = torch.compile(self._step, dynamic=False, **compile_kwargs)
+
+    @torch.no_grad()
+    def _get_obj_ptr_tpos_table(self, num_frames, device):
+        """
+        The temporal position encodings of the object pointers at the distances
+        -(num_frames - 1), ..., num_frames - 1 (`SAM2Base._get_obj_ptr_tpos_enc`).
+        """
+        if (num_frames, device) not in self._obj_ptr_tpos_tables:
+            model = self.model
+            obj_pos = torch.arange(-(num_frames - 1), num_frames, device=device)
+            if model.add_tpos_enc_to_obj_ptrs:
+                t_diff_max = min(num_frames, model.max_obj_ptrs_in_encoder) - 1
+                table = model._get_obj_ptr_tpos_enc(obj_pos, max(t_diff_max, 1))
+            else:
+                table = torch.zeros(len(obj_pos), model.mem_dim, device=device)
+            self._obj_ptr_tpos_tables[(num_frames, device)] = table
+        return self._obj_ptr_tpos_tables[(num_frames, device)]
+
+    def _get_slots(self, vision_feats):
+        """The memory slots for a batch size, allocated once (and zeroed so that empty slots stay finite)."""
+        num_tokens, batch_size, _ = vision_feats[-1].shape
+        key = (batch_size, vision_feats[-1].device, vision_feats[-1].dtype)
+        if key not in self._slots:
+            self._slots[key] = self._alloc_slots(num_tokens, *key)
+        return self._slots[key]
+
+    # normal tensors (rather than inference tensors) so that the slots can be filled
+    # both in and outside of `torch.inference_mode`
+    @torch.inference_mode(False)
+    def _alloc_slots(self, num_tokens, batch_size, device, dtype):
+        model = self.model
+        mem_shape = (self.num_maskmem_slots, num_tokens, batch_size, model.mem_dim)
+        return {
+            "maskmem": torch.zeros(mem_shape, device=device, dtype=dtype),
+            "maskmem_pos": torch.zeros(mem_shape, device=device, dtype=dtype),
+            "maskmem_valid": torch.zeros(self.num_maskmem_slots, device=device, dtype=torch.bool),
+            "obj_ptrs": torch.zeros(
+                self.num_obj_ptr_slots, batch_size, model.hidden_dim, device=device, dtype=dtype
+            ),
+            "obj_ptr_pos_idx": torch.zeros(self.num_obj_ptr_slots, device=device, dtype=torch.long),
+            "obj_ptrs_valid": torch.zeros(self.num_obj_ptr_slots, device=device, dtype=torch.bool),
+        }
+
+    def _fill_slots(self, frame_idx, vision_feats, output_dict, num_frames, track_in_reverse):
+        """Copy the memories of a frame into the slots, or returns None if they don't fit."""
+        model = self.model
+        t_pos_and_prevs, pos_and_ptr_outs, num_cond_ptrs = model._select_memory_frames(
+            frame_idx, output_dict, num_frames, track_in_reverse
+        )
+        if sum(t_pos == 0 for t_pos, _ in t_pos_and_prevs) > self.num_cond_slots:
+            return None
+        slots = self._get_slots(vision_feats)
+        slots["maskmem_valid"].fill_(False)
+        slots["obj_ptrs_valid"].fill_(False)
+        cond_slot = 0
+        for t_pos, prev in t_pos_and_prevs:
+            if prev is None:
+                continue  # an empty slot
+            if t_pos == 0:
+                slot, cond_slot = cond_slot, cond_slot + 1
+            else:
+                slot = self.num_cond_slots + t_pos - 1
+            # (HW)BC memories, as in `SAM2Base._prepare_memory_conditioned_features`
+            feats = prev["maskmem_features"].flatten(2).permute(2, 0, 1)
+            slots["maskmem"][slot].copy_(feats, non_blocking=True)
+            maskmem_enc = prev["maskmem_pos_enc"][-1].flatten(2).permute(2, 0, 1)
+            slots["maskmem_pos"][slot].copy_(maskmem_enc, non_blocking=True)
+            slots["maskmem_valid"][slot] = True
+        for i, (pos, out) in enumerate(pos_and_ptr_outs):
+            # the non-conditioning frames are at pos = t_diff
+            slot = i if i < num_cond_ptrs else self.num_cond_slots + pos - 1
+            slots["obj_ptrs"][slot].copy_(out["obj_ptr"])
+            slots["obj_ptr_pos_idx"][slot] = pos + num_frames - 1
+            slots["obj_ptrs_valid"][slot] = True
+        table = self._get_obj_ptr_tpos_table(num_frames, slots["obj_ptrs"].device)
+        obj_ptrs_pos = table[slots["obj_ptr_pos_idx"]].to(slots["obj_ptrs"].dtype)
+        return (
+            slots["maskmem"],
+            slots["maskmem_pos"],
+            slots["maskmem_valid"],
+            slots["obj_ptrs"],
+            obj_ptrs_pos,
+            slots["obj_ptrs_valid"],
+        )
+
+    def _step(
+        self,
+        vision_feats,
+        vision_pos_embeds,
+        feat_sizes,
+        maskmem,
+        maskmem_pos,
+        maskmem_valid,
+        obj_ptrs,
+        obj_ptrs_pos,
+        obj_ptrs_valid,
+        multimask_output,
+        run_mem_encoder,
+    ):
+        """
+        `SAM2Base.track_step` on a tracked frame with the memories in slots (all the
+        input shapes are fixed for a video).
+        """
+        model = self.model
+        B = vision_feats[-1].size(1)  # batch size on this frame
+        C = model.hidden_dim
+        H, W = feat_sizes[-1]  # top-level (lowest-resolution) feature size
+        high_res_features = None
+        if len(vision_feats) > 1:
+            high_res_features = [
+                x.permute(1, 2, 0).view(x.size(1), x.size(2), *s)
+                for x, s in zip(vision_feats[:-1], feat_sizes[:-1])
+            ]
+
+        # the spatial memories of all the slots, with their temporal positional encoding
+        memory = maskmem.flatten(0, 1)
+        memory_pos = maskmem_pos + model.maskmem_tpos_enc[self.maskmem_tpos_idx]
+        memory_pos = memory_pos.flatten(0, 1)
+        memory_mask = maskmem_valid.repeat_interleave(H * W)
+        # the object pointers of all the slots
+        obj_ptrs_pos = obj_ptrs_pos.unsqueeze(1).expand(-1, B, model.mem_dim)
+        if model.mem_dim < C:
+            # split a pointer into (C // mem_dim) tokens for mem_dim < C
+            obj_ptrs = obj_ptrs.reshape(-1, B, C // model.mem_dim, model.mem_dim)
+            obj_ptrs = obj_ptrs.permute(0, 2, 1, 3).flatten(0, 1)
+            obj_ptrs_pos = obj_ptrs_pos.repeat_interleave(C // model.mem_dim, dim=0)
+            obj_ptrs_valid = obj_ptrs_valid.repeat_interleave(C // model.mem_dim)
+        pix_feat = self.memory_attention(
+            vision_feats[-1],
+            vision_pos_embeds[-1],
+            memory,
+            memory_pos,
+            obj_ptrs,
+            obj_ptrs_pos,
+            memory_mask,
+            obj_ptrs_valid,
+        )
+        # reshape the output (HW)BC => BCHW
+        pix_feat = pix_feat.permute(1, 2, 0).view(B, C, H, W)
+
+        sam_outputs = model._forward_sam_heads(
+            backbone_features=pix_feat,
+            point_inputs=None,
+            mask_inputs=None,
+            high_res_features=high_res_features,
+            multimask_output=multimask_output,
+        )
+        _, _, _, low_res_masks, high_res_masks, obj_ptr, object_score_logits = sam_outputs
+        maskmem_features, maskmem_pos_enc = None, None
+        if run_mem_encoder:
+            maskmem_features, maskmem_pos_enc = model._encode_new_memory(
+                current_vision_feats=vision_feats,
+                feat_sizes=feat_sizes,
+                pred_masks_high_res=high_res_masks,
+                object_score_logits=object_score_logits,
+                is_mask_from_pts=False,
+            )
+        return (
+            low_res_masks,
+            high_res_masks,
+            obj_ptr,
+            object_score_logits,
+            maskmem_features,
+            maskmem_pos_enc,
+        )
+
+    def __call__(
+        self,
+        frame_idx,
+        is_init_cond_frame,
+        current_vision_feats,
+        current_vision_pos_embeds,
+        feat_sizes,
+        point_inputs,
+        mask_inputs,
+        output_dict,
+        num_frames,
+        track_in_reverse=False,
+        run_mem_encoder=True,
+        prev_sam_mask_logits=None,
+    ):
+        memories = None
+        if not (
+            torch.is_grad_enabled()
+            or self.model.training
+            or is_init_cond_frame
+            or point_inputs is not None
+            or mask_inputs is not None
+            or prev_sam_mask_logits is not None
+        ):
+            memories = self._fill_slots(
+                frame_idx, current_vision_feats, output_dict, num_frames, track_in_reverse
+            )
+        if memories is None:
+            return self.forward(
+                frame_idx,
+                is_init_cond_frame,
+                current_vision_feats,
+                current_vision_pos_embeds,
+                feat_sizes,
+                point_inputs,
+                mask_inputs,
+                output_dict,
+                num_frames,
+                track_in_reverse,
+                run_mem_encoder,
+                prev_sam_mask_logits,
+            )
+
+        (
+            low_res_masks,
+            high_res_masks,
+            obj_ptr,
+            object_score_logits,
+            maskmem_features,
+            maskmem_pos_enc,
+        ) = self.step(
+            current_vision_feats,
+            current_vision_pos_embeds,
+            feat_sizes,
+            *memories,
+            multimask_output=self.model._use_multimask(False, None),
+            run_mem_encoder=run_mem_encoder,
+        )
+        return {
+            "point_inputs": None,
+            "mask_inputs": None,
+            "pred_masks": low_res_masks,
+            "pred_masks_high_res": high_res_masks,
+            "obj_ptr": obj_ptr,
+            "object_score_logits": object_score_logits,
+            "maskmem_features": maskmem_features,
+            "maskmem_pos_enc": maskmem_pos_enc,
+        }
+
+
+def disable_static_track_step(model):
+    """Restore `SAM2Base.track_step` after `enable_static_track_step`. Returns the model."""
+    if isinstance(model.track_step, StaticTrackStep):
+        model.track_step = model.track_step.forward
+    return model
+
+
+def enable_static_track_step(model, num_cond_slots=1, compile=False, **compile_kwargs):
+    """
+    Run the tracked frames of a SAM 2 model (`SAM2Base`, or a `SAM2VideoPredictor`)
+    with the static-shape `StaticTrackStep`, optionally compiled with `torch.compile`
+    (with `compile_kwargs`, e.g. `mode="max-autotune"`). The model must be on its
+    device with its weights loaded (the temporal position tables are computed once).
+    Returns the model.
+    """
+    disable_static_track_step(model)
+    # replace the track step of the model instance only (the weights are unchanged)
+    model.track_step = StaticTrackStep(model, num_cond_slots, compile, **compile_kwargs)
+    logging.info(
+        f"Static track step with {model.track_step.num_maskmem_slots} memory slots and "
+        f"{model.track_step.num_obj_ptr_slots} object pointer slots (compile={compile})"
+    )
+    return model
@@ -0,0 +1,121 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Compare the transports of the video frames from the HTTP front end of the masking API
+to a model server process (`api/model_server.py`) over a local Unix socket: pickling
+the frames through the socket, or writing them into the shared-memory `FrameRing` of
+`api/frame_ring.py` and only sending their slot indices (as `api/model_client.py`).
+Reports the frame throughput and the CPU time of the front end per frame, for frames of
+a few resolutions. Run from the repository root with
+`python -m tools.benchmark_api_frame_transport`.
+"""
+
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+from collections import deque
+from multiprocessing import shared_memory
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+from api.frame_ring import FrameRing
+
+AUTHKEY = b"benchmark"
+
+
+def consume(socket_path, transport):
+    """The model server side: receive the frames and copy them (as if saving them)."""
+    with Client(socket_path, family="AF_UNIX", authkey=AUTHKEY) as conn:
+        job = conn.recv()
+        ring = None
+        if transport == "ring":
+            # (not `FrameRing.attach`, as this process shares the resource tracker of
+            # the front end, unlike a model server)
+            shm = shared_memory.SharedMemory(name=job["shm_name"])
+            ring = FrameRing(shm, job["num_slots"], job["frame_shape"])
+        checksum = 0
+        while (message := conn.recv())["type"] == "frame":
+            if ring is not None:
+                frame = np.array(ring[message["slot"]])
+                conn.send({"type": "release", "slot": message["slot"]})
+            else:
+                frame = message["frame"]
+            checksum += int(frame[0, 0, 0])
+        if ring is not None:
+            ring.close()
+        conn.send({"type": "result", "checksum": checksum})
+
+
+def produce(conn, frames, transport, num_slots):
+    """The front end side: send the frames, return the checksum of the consumer."""
+    ring = None
+    if transport == "ring":
+        ring = FrameRing.create(num_slots, frames[0].shape)
+        conn.send({"shm_name": ring.name, "num_slots": num_slots, "frame_shape": frames[0].shape})
+    else:
+        conn.send({})
+    try:
+        free_slots = deque(range(num_slots))
+        for frame in frames:
+            if ring is not None:
+                if not free_slots:
+                    free_slots.append(conn.recv()["slot"])
+                slot = free_slots.popleft()
+                ring[slot][...] = frame
+                conn.send({"type": "frame", "slot": slot})
+            else:
+                conn.send({"type": "frame", "frame": frame})
+        conn.send({"type": "end"})
+        while (message := conn.recv())["type"] == "release":
+            pass
+        return message["checksum"]
+    finally:
+        if ring is not None:
+            ring.close()
+            ring.unlink()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-frames", type=int, default=200)
+    parser.add_argument("--num-slots", type=int, default=8)
+    parser.add_argument("--resolutions", type=str, nargs="+", default=["640x360", "1280x720", "1920x1080"])
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        socket_path = os.path.join(tmp_dir, "benchmark.sock")
+        with Listener(socket_path, family="AF_UNIX", authkey=AUTHKEY) as listener:
+            for resolution in args.resolutions:
+                width, height = map(int, resolution.split("x"))
+                rng = np.random.default_rng(0)
+                frames = [rng.integers(0, 256, (height, width, 3), dtype=np.uint8) for _ in range(args.num_frames)]
+                expected_checksum = sum(int(frame[0, 0, 0]) for frame in frames)
+                results = {}
+                for transport in ["pickle", "ring"]:
+                    process = context.Process(target=consume, args=(socket_path, transport))
+                    process.start()
+                    with listener.accept() as conn:
+                        start, start_cpu = time.perf_counter(), time.process_time()
+                        checksum = produce(conn, frames, transport, args.num_slots)
+                        elapsed, cpu_time = time.perf_counter() - start, time.process_time() - start_cpu
+                    process.join()
+                    assert checksum == expected_checksum
+                    results[transport] = (args.num_frames / elapsed, cpu_time / args.num_frames * 1000)
+                (pickle_fps, pickle_cpu), (ring_fps, ring_cpu) = results["pickle"], results["ring"]
+                print(
+                    f"{resolution}: pickle {pickle_fps:.0f} frames/s {pickle_cpu:.2f} ms CPU/frame, "
+                    f"ring {ring_fps:.0f} frames/s {ring_cpu:.2f} ms CPU/frame "
+                    f"({ring_fps / pickle_fps:.1f}x faster, {pickle_cpu / ring_cpu:.1f}x less CPU)"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Compare the JSON and binary mask formats of the /propagate_in_video stream of the demo
+backend (`demo/backend/server/inference/mask_stream.py`): the bytes per frame (including
+the multipart headers) and the server CPU time to encode a frame, for 1 to 20 objects.
+The masks are random blobs with irregular boundaries, moving from frame to frame.
+
+It then simulates a re-propagation after a refinement click, which changes the mask of
+one object on a fraction of the frames (`--changed-frames`), and compares re-sending all
+the masks with an incremental propagation (`"incremental": true`), checking that the
+client-side merge of the incremental frames recovers the new masks. Run from the
+repository root with `python -m tools.benchmark_demo_mask_stream` (with the
+dependencies of the demo backend installed).
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "demo", "backend", "server"))
+
+from inference.mask_stream import (  # noqa: E402
+    decode_binary_frame,
+    decode_incremental_binary_frame,
+    decode_rle_counts,
+    encode_binary_frame,
+    encode_incremental_binary_frame,
+    encode_incremental_json_frame,
+    encode_json_frame,
+    get_rle_counts,
+    MASK_KIND_XOR,
+    SentMasks,
+    xor_rle_counts,
+)
+from inference.multipart import MultipartResponseBuilder  # noqa: E402
+
+
+def make_masks(num_objects, height, width, num_frames, seed=0):
+    """Random blobs (noisy ellipses) moving across the frames."""
+    rng = np.random.default_rng(seed)
+    ys, xs = np.mgrid[:height, :width].astype(np.float32)
+    # low-frequency noise to make irregular boundaries
+    noise = rng.standard_normal((num_objects, height // 16 + 1, width // 16 + 1))
+    noise = np.repeat(np.repeat(noise, 16, axis=1), 16, axis=2)[:, :height, :width]
+    centers = rng.uniform([0.2 * height, 0.2 * width], [0.8 * height, 0.8 * width], (num_objects, 2))
+    radii = rng.uniform(0.05, 0.2, (num_objects, 2)) * [height, width]
+    velocities = rng.uniform(-3, 3, (num_objects, 2))
+    frames = []
+    for t in range(num_frames):
+        masks = np.empty((num_objects, height, width), dtype=bool)
+        for i in range(num_objects):
+            cy, cx = centers[i] + t * velocities[i]
+            dist = ((ys - cy) / radii[i, 0]) ** 2 + ((xs - cx) / radii[i, 1]) ** 2
+            masks[i] = dist + 0.15 * noise[i] < 1
+        frames.append(masks)
+    return frames
+
+
+def refine_masks(frames, changed_frames, seed=0):
+    """
+    The masks after a refinement click on the first object of the middle frame, which
+    adds a bump to its mask on the `changed_frames` fraction of the frames
+    around the clicked frame.
+    """
+    rng = np.random.default_rng(seed)
+    num_frames = len(frames)
+    num_changed = max(1, round(changed_frames * num_frames))
+    start = max(0, num_frames // 2 - num_changed // 2)
+    _, height, width = frames[0].shape
+    ys, xs = np.mgrid[:height, :width]
+    refined = [masks.copy() for masks in frames]
+    for t in range(start, start + num_changed):
+        # a bump on the top boundary of the mask
+        rows, cols = np.nonzero(refined[t][0])
+        cy, cx = rows.min(), cols[rows == rows.min()].mean() + rng.uniform(-5, 5)
+        refined[t][0] |= (ys - cy) ** 2 + (xs - cx) ** 2 < (0.05 * height) ** 2
+    return refined
+
+
+def stream_size(body, mask_type):
+    """Bytes of a frame of the stream, including the multipart headers."""
+    return len(
+        MultipartResponseBuilder.build(
+            boundary="frame",
+            headers={
+                "Content-Type": "application/octet-stream",
+                "Frame-Current": "1",
+                "Frame-Total": "1",
+                "Mask-Type": mask_type,
+            },
+            body=body,
+        ).get_message()
+    )
+
+
+def benchmark_incremental(frames, refined, object_ids):
+    """Bytes and CPU time of re-sending the refined masks, in full or incrementally."""
+    results = {}
+    for name, encode_frame in [("json", encode_json_frame), ("binary", encode_binary_frame)]:
+        start = time.process_time()
+        num_bytes = sum(stream_size(encode_frame(t, object_ids, masks), "RLE[]") for t, masks in enumerate(refined))
+        results[name] = (num_bytes, time.process_time() - start)
+
+    incremental_encoders = {
+        "incremental json": encode_incremental_json_frame,
+        "incremental binary": encode_incremental_binary_frame,
+    }
+    for name, encode_frame in incremental_encoders.items():
+        # the first propagation sends (and tracks) all the masks
+        sent_masks = SentMasks()
+        sent_masks.set_enabled(True)
+        client_counts = {}
+        for t, masks in enumerate(frames):
+            encode_frame(sent_masks, t, object_ids, masks)
+            client_counts[t] = dict(zip(object_ids, get_rle_counts(masks)))
+
+        start = time.process_time()
+        bodies = {t: encode_frame(sent_masks, t, object_ids, masks) for t, masks in enumerate(refined)}
+        cpu_time = time.process_time() - start
+        num_bytes = sum(stream_size(body, "RLE-varint-delta") for body in bodies.values() if body is not None)
+        results[name] = (num_bytes, cpu_time)
+
+        # the client-side merge of the binary frames recovers the refined masks
+        if name == "incremental binary":
+            for body in bodies.values():
+                if body is None:
+                    continue
+                t, _, changes = decode_incremental_binary_frame(body)
+                for object_id, kind, counts in changes:
+                    if kind == MASK_KIND_XOR:
+                        counts = xor_rle_counts(client_counts[t][object_id], counts)
+                    client_counts[t][object_id] = counts
+            size = refined[0].shape[-2:]
+            for t, masks in enumerate(refined):
+                for object_id, mask in zip(object_ids, masks):
+                    assert (decode_rle_counts(client_counts[t][object_id], size) == mask).all()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--num-frames", type=int, default=20)
+    parser.add_argument("--num-objects", type=int, nargs="+", default=[1, 2, 5, 10, 20])
+    parser.add_argument("--changed-frames", type=float, default=0.1)
+    args = parser.parse_args()
+
+    encoders = {"json": encode_json_frame, "binary": encode_binary_frame}
+    print(f"{args.height}x{args.width} masks, {args.num_frames} frames")
+    frames_by_num_objects = {}
+    for num_objects in args.num_objects:
+        frames = make_masks(num_objects, args.height, args.width, args.num_frames)
+        object_ids = list(range(num_objects))
+        results = {}
+        for name, encode_frame in encoders.items():
+            num_bytes = 0
+            start = time.process_time()
+            for frame_idx, masks in enumerate(frames):
+                body = encode_frame(frame_idx, object_ids, masks)
+                message = MultipartResponseBuilder.build(
+                    boundary="frame",
+                    headers={
+                        "Content-Type": "application/octet-stream",
+                        "Frame-Current": str(frame_idx + 1),
+                        "Frame-Total": str(args.num_frames),
+                        "Mask-Type": "RLE-varint",
+                    },
+                    body=body,
+                ).get_message()
+                num_bytes += len(message)
+            cpu_time = (time.process_time() - start) / len(frames) * 1000
+            results[name] = (num_bytes / len(frames), cpu_time)
+
+        # the binary frames decode to the same masks
+        frame_idx, size, decoded = decode_binary_frame(encode_binary_frame(0, object_ids, frames[0]))
+        assert all((decode_rle_counts(counts, size) == mask).all() for (_, counts), mask in zip(decoded, frames[0]))
+
+        (json_bytes, json_cpu), (binary_bytes, binary_cpu) = results["json"], results["binary"]
+        print(
+            f"{num_objects:>2} objects: json {json_bytes:.0f} B/frame {json_cpu:.2f} ms/frame, "
+            f"binary {binary_bytes:.0f} B/frame {binary_cpu:.2f} ms/frame "
+            f"({json_bytes / binary_bytes:.2f}x smaller, {json_cpu / binary_cpu:.2f}x less CPU)"
+        )
+        frames_by_num_objects[num_objects] = frames
+
+    print(f"re-propagation after a click changing {args.changed_frames:.0%} of the frames of one object")
+    for num_objects, frames in frames_by_num_objects.items():
+        refined = refine_masks(frames, args.changed_frames)
+        results = benchmark_incremental(frames, refined, list(range(num_objects)))
+        full_bytes, full_cpu = results["json"]
+        print(
+            f"{num_objects:>2} objects: "
+            + ", ".join(
+                f"{name} {num_bytes / 1024:.0f} KiB {cpu_time * 1000:.0f} ms "
+                f"({full_bytes / num_bytes:.1f}x smaller, {full_cpu / cpu_time:.1f}x less CPU)"
+                for name, (num_bytes, cpu_time) in results.items()
+            )
+            + " (vs json)"
+        )
+
+
+if __name__ == "__main__":
+    main()
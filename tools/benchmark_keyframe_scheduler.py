@@ -0,0 +1,89 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Count the detector calls of continuous-id tracking with the adaptive keyframe
+scheduler (`utils.keyframe_scheduler.KeyframeScheduler`) against a detection every
+`--step` frames, on the sample videos of the notebooks. Run from the repository root
+with `python -m tools.benchmark_keyframe_scheduler`.
+
+Without SAM 2 checkpoints, only the frame difference signal is used. The mask area
+signal can be replayed from the label store written by a previous run of
+`grounded_sam2_tracking_demo_with_continuous_id.py` on the same video
+(`--label-store-dirs`, one per video).
+"""
+
+import argparse
+import os
+import time
+
+import cv2
+
+from utils.keyframe_scheduler import KeyframeScheduler
+from utils.label_map_store import LabelMapStore
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--video-dirs",
+        type=str,
+        nargs="+",
+        default=["notebooks/videos/bedroom", "notebooks/videos/car"],
+    )
+    parser.add_argument("--label-store-dirs", type=str, nargs="+", default=None)
+    parser.add_argument("--step", type=int, default=20)
+    parser.add_argument("--min-interval", type=int, default=5)
+    parser.add_argument("--max-interval", type=int, default=60)
+    parser.add_argument("--frame-diff-threshold", type=float, default=0.1)
+    parser.add_argument("--area-change-threshold", type=float, default=0.5)
+    args = parser.parse_args()
+    label_store_dirs = args.label_store_dirs or [None] * len(args.video_dirs)
+    assert len(label_store_dirs) == len(args.video_dirs)
+
+    total_calls, total_fixed_calls = 0, 0
+    for video_dir, label_store_dir in zip(args.video_dirs, label_store_dirs):
+        frame_names = [
+            p for p in os.listdir(video_dir)
+            if os.path.splitext(p)[-1] in [".jpg", ".jpeg", ".JPG", ".JPEG", ".png", ".PNG"]
+        ]
+        frame_names.sort(key=lambda p: int(os.path.splitext(p)[0]))
+        store = None if label_store_dir is None else LabelMapStore(label_store_dir)
+        scheduler = KeyframeScheduler(
+            min_interval=args.min_interval,
+            max_interval=args.max_interval,
+            frame_diff_threshold=args.frame_diff_threshold,
+            area_change_threshold=args.area_change_threshold,
+        )
+
+        keyframes = []
+        signal_time = 0.0
+        for frame_idx, frame_name in enumerate(frame_names):
+            start = time.perf_counter()
+            # JPEG frames are decoded at 1/8 of their resolution, in grayscale
+            frame = cv2.imread(os.path.join(video_dir, frame_name), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+            if scheduler.should_detect(frame_idx, frame):
+                scheduler.add_keyframe(frame_idx, frame)
+                keyframes.append(frame_idx)
+            signal_time += time.perf_counter() - start
+            image_base_name = os.path.splitext(frame_name)[0]
+            if store is not None and image_base_name in store:
+                scheduler.update(frame_idx, store.get_mask_dict(image_base_name))
+
+        fixed_calls = -(-len(frame_names) // args.step)
+        total_calls += scheduler.num_keyframes
+        total_fixed_calls += fixed_calls
+        print(f"{video_dir}: {scheduler.summary(fixed_interval=args.step)}")
+        print(f"  keyframes {keyframes}")
+        print(f"  scheduler overhead {signal_time / len(frame_names) * 1000:.2f} ms per frame")
+    print(
+        f"total: {total_calls} detector calls vs {total_fixed_calls} every {args.step} frames "
+        f"({total_fixed_calls - total_calls} saved)"
+    )
+
+
+if __name__ == "__main__":
+    main()
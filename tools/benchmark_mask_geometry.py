@@ -0,0 +1,121 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Benchmark the per-frame cost of the box extraction (`ObjectInfo.update_box`) and
+point sampling (`sample_points_from_masks`) of the tracking demos, against the
+previous `torch.nonzero` / `np.argwhere` implementations, for growing foreground
+sizes. Run from the repository root with `python -m tools.benchmark_mask_geometry`.
+"""
+
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from utils.mask_dictionary_model import ObjectInfo
+from utils.track_utils import get_masks_geometry, sample_points_from_masks
+
+
+def nonzero_update_box(mask):
+    """The previous `ObjectInfo.update_box` (box of all the non-zero indices)."""
+    nonzero_indices = torch.nonzero(mask)
+    if nonzero_indices.size(0) == 0:
+        return []
+    y_min, x_min = torch.min(nonzero_indices, dim=0)[0]
+    y_max, x_max = torch.max(nonzero_indices, dim=0)[0]
+    return [x_min.item(), y_min.item(), x_max.item(), y_max.item()]
+
+
+def argwhere_sample_points(masks, num_points):
+    """The previous `sample_points_from_masks` (sampling from all the non-zero indices)."""
+    points = []
+    for i in range(masks.shape[0]):
+        indices = np.argwhere(masks[i] == 1)[:, ::-1]
+        replace = len(indices) < num_points
+        sampled_indices = np.random.choice(len(indices), num_points, replace=replace)
+        points.append(indices[sampled_indices])
+    return np.array(points, dtype=np.float32)
+
+
+def make_masks(num_objects, height, width, fg_fraction):
+    """Elliptic masks covering about `fg_fraction` of the frame each."""
+    ys, xs = torch.meshgrid(torch.arange(height), torch.arange(width), indexing="ij")
+    masks = torch.zeros(num_objects, height, width, dtype=torch.bool)
+    radius_y = height * (fg_fraction / np.pi) ** 0.5
+    radius_x = width * (fg_fraction / np.pi) ** 0.5
+    for i in range(num_objects):
+        cy = height * (0.25 + 0.5 * i / max(num_objects - 1, 1))
+        cx = width * (0.75 - 0.5 * i / max(num_objects - 1, 1))
+        masks[i] = ((ys - cy) / radius_y) ** 2 + ((xs - cx) / radius_x) ** 2 <= 1
+    return masks
+
+
+def timeit(fn, num_iters):
+    fn()
+    start = time.perf_counter()
+    for _ in range(num_iters):
+        fn()
+    return (time.perf_counter() - start) / num_iters * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--num-objects", type=int, default=10)
+    parser.add_argument("--num-points", type=int, default=10)
+    parser.add_argument("--num-iters", type=int, default=5)
+    parser.add_argument(
+        "--fg-fractions", type=float, nargs="+", default=[0.001, 0.01, 0.1, 0.5]
+    )
+    parser.add_argument("--num-threads", type=int, default=1)
+    args = parser.parse_args()
+    torch.set_num_threads(args.num_threads)
+
+    print(
+        f"{args.num_objects} objects at {args.width}x{args.height}, ms per frame "
+        "(update_box: previous -> new | sample_points: previous -> new)"
+    )
+    for fg_fraction in args.fg_fractions:
+        masks = make_masks(args.num_objects, args.height, args.width, fg_fraction)
+        masks_np = masks.numpy()
+
+        # check that the boxes and the sampled points are consistent
+        boxes, areas, _ = get_masks_geometry(masks)
+        points = sample_points_from_masks(masks_np, args.num_points).astype(np.int64)
+        for i, mask in enumerate(masks):
+            object_info = ObjectInfo(mask=mask)
+            object_info.update_box()
+            box = [object_info.x1, object_info.y1, object_info.x2, object_info.y2]
+            assert box == nonzero_update_box(mask) == boxes[i].tolist()
+            assert areas[i] == mask.sum()
+            assert masks_np[i, points[i, :, 1], points[i, :, 0]].all()
+            if areas[i] >= args.num_points:
+                assert len({tuple(p) for p in points[i].tolist()}) == args.num_points
+
+        def new_update_box():
+            for mask in masks:
+                ObjectInfo(mask=mask).update_box()
+
+        box_prev = timeit(lambda: [nonzero_update_box(m) for m in masks], args.num_iters)
+        box_new = timeit(new_update_box, args.num_iters)
+        sample_prev = timeit(
+            lambda: argwhere_sample_points(masks_np, args.num_points), args.num_iters
+        )
+        sample_new = timeit(
+            lambda: sample_points_from_masks(masks_np, args.num_points), args.num_iters
+        )
+        print(
+            f"foreground {fg_fraction * 100:5.1f}%: "
+            f"update_box {box_prev:7.1f} -> {box_new:6.1f} | "
+            f"sample_points {sample_prev:7.1f} -> {sample_new:6.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Check and benchmark the CPU multi-scale deformable attention of Grounding DINO
+(`multi_scale_deformable_attn_cpu`) against the `F.grid_sample` reference
+(`multi_scale_deformable_attn_pytorch`), with the feature maps of an 800x1333
+image (strides 8 to 64). Run from the repository root with
+`python -m tools.benchmark_ms_deform_attn`.
+"""
+
+import argparse
+import math
+import time
+
+import torch
+
+from grounding_dino.groundingdino.models.GroundingDINO.ms_deform_attn import (
+    multi_scale_deformable_attn_cpu,
+    multi_scale_deformable_attn_pytorch,
+)
+
+
+def make_inputs(args):
+    shapes = [
+        (math.ceil(args.height / stride), math.ceil(args.width / stride))
+        for stride in [8, 16, 32, 64]
+    ]
+    spatial_shapes = torch.tensor(shapes, dtype=torch.long)
+    areas = spatial_shapes[:, 0] * spatial_shapes[:, 1]
+    level_start_index = torch.cat((areas.new_zeros(1), areas.cumsum(0)[:-1]))
+    num_value = int(areas.sum())
+    # the encoder layers use all the feature map locations as queries
+    num_queries = num_value if args.num_queries is None else args.num_queries
+    num_levels = len(shapes)
+
+    value = torch.randn(1, num_value, args.num_heads, args.embed_dim // args.num_heads)
+    # sampling locations around the reference points, some of them out of the maps
+    reference_points = torch.rand(1, num_queries, 1, 1, 1, 2)
+    offsets = 0.05 * torch.randn(
+        1, num_queries, args.num_heads, num_levels, args.num_points, 2
+    )
+    sampling_locations = reference_points + offsets
+    attention_weights = torch.randn(
+        1, num_queries, args.num_heads, num_levels * args.num_points
+    ).softmax(-1)
+    attention_weights = attention_weights.view(
+        1, num_queries, args.num_heads, num_levels, args.num_points
+    )
+    return value, spatial_shapes, level_start_index, sampling_locations, attention_weights
+
+
+def timeit(fn, num_iters):
+    fn()
+    start = time.perf_counter()
+    for _ in range(num_iters):
+        fn()
+    return (time.perf_counter() - start) / num_iters * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--height", type=int, default=800)
+    parser.add_argument("--width", type=int, default=1333)
+    parser.add_argument("--embed-dim", type=int, default=256)
+    parser.add_argument("--num-heads", type=int, default=8)
+    parser.add_argument("--num-points", type=int, default=4)
+    parser.add_argument(
+        "--num-queries",
+        type=int,
+        default=None,
+        help="number of queries (default: all the feature map locations, as in the encoder; "
+        "the decoder uses 900)",
+    )
+    parser.add_argument("--num-iters", type=int, default=3)
+    parser.add_argument("--num-threads", type=int, default=None)
+    args = parser.parse_args()
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+
+    value, spatial_shapes, level_start_index, sampling_locations, attention_weights = (
+        make_inputs(args)
+    )
+    with torch.no_grad():
+        reference = multi_scale_deformable_attn_pytorch(
+            value, spatial_shapes, sampling_locations, attention_weights
+        )
+        output = multi_scale_deformable_attn_cpu(
+            value, spatial_shapes, level_start_index, sampling_locations, attention_weights
+        )
+    max_diff = (output - reference).abs().max().item()
+    print(
+        f"{value.shape[1]} values, {sampling_locations.shape[1]} queries -- "
+        f"max abs diff vs grid_sample: {max_diff:.2e}"
+    )
+    assert torch.allclose(output, reference, atol=1e-4, rtol=1e-4)
+
+    # gradients (w.r.t. the values, sampling locations and attention weights), against
+    # the float64 reference since the bilinear interpolation has kinks at the pixel
+    # boundaries, where the float32 implementations can both be off
+    inputs = [value, sampling_locations, attention_weights]
+    grads = []
+    for fn, dtype in [
+        (lambda v, s, a: multi_scale_deformable_attn_pytorch(v, spatial_shapes, s, a), torch.float64),
+        (lambda v, s, a: multi_scale_deformable_attn_pytorch(v, spatial_shapes, s, a), torch.float32),
+        (
+            lambda v, s, a: multi_scale_deformable_attn_cpu(
+                v, spatial_shapes, level_start_index, s, a
+            ),
+            torch.float32,
+        ),
+    ]:
+        leaves = [x.detach().to(dtype).clone().requires_grad_(True) for x in inputs]
+        fn(*leaves).square().sum().backward()
+        grads.append([x.grad.double() for x in leaves])
+    names = ["value", "sampling_locations", "attention_weights"]
+    for name, g_64, g_ref, g in zip(names, *grads):
+        rel_diff_ref = ((g_ref - g_64).norm() / g_64.norm()).item()
+        rel_diff = ((g - g_64).norm() / g_64.norm()).item()
+        print(
+            f"relative grad error w.r.t. {name}: grid_sample {rel_diff_ref:.2e}, "
+            f"fused {rel_diff:.2e}"
+        )
+        assert rel_diff < max(2 * rel_diff_ref, 1e-4)
+
+    with torch.no_grad():
+        latency_ref = timeit(
+            lambda: multi_scale_deformable_attn_pytorch(
+                value, spatial_shapes, sampling_locations, attention_weights
+            ),
+            args.num_iters,
+        )
+        latency = timeit(
+            lambda: multi_scale_deformable_attn_cpu(
+                value, spatial_shapes, level_start_index, sampling_locations, attention_weights
+            ),
+            args.num_iters,
+        )
+    print(
+        f"latency at {args.height}x{args.width} ({torch.get_num_threads()} threads): "
+        f"grid_sample {latency_ref:.1f} ms, fused {latency:.1f} ms "
+        f"({latency_ref / latency:.2f}x)"
+    )
+
+
+if __name__ == "__main__":
+    main()
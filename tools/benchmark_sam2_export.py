@@ -0,0 +1,160 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Export the SAM 2 components to ONNX and TorchScript (see `sam2.utils.export`),
+check the exported runtime against the PyTorch modules, and compare their CPU
+latency per component. Run from the repository root with
+`python -m tools.benchmark_sam2_export`.
+
+Without `--checkpoint`, the model is randomly initialized (the latency doesn't
+depend on the weights).
+"""
+
+import argparse
+import tempfile
+import time
+
+import torch
+
+from sam2.build_sam import build_sam2
+from sam2.utils.export import (
+    BACKENDS,
+    COMPONENTS,
+    ExportedImageEncoder,
+    ExportedMemoryAttention,
+    ExportedMemoryEncoder,
+    ExportedPromptMaskDecoder,
+    export_sam2,
+    load_graph,
+)
+
+
+def make_inputs(model, args):
+    """The PyTorch callables of the components, and their inputs on a frame."""
+    image_size = model.image_size
+    hidden_dim, mem_dim = model.hidden_dim, model.mem_dim
+    num_tokens = (image_size // 16) ** 2
+    image = torch.randn(1, 3, image_size, image_size)
+    with torch.no_grad():
+        backbone_out = model.forward_image(image)
+    backbone_fpn = backbone_out["backbone_fpn"]
+    point_coords = torch.rand(1, args.num_points, 2) * image_size
+    point_labels = torch.ones(1, args.num_points, dtype=torch.int32)
+    # the spatial memories of `num_maskmem` frames and the object pointers (split
+    # into `hidden_dim // mem_dim` tokens) of `max_obj_ptrs_in_encoder` frames
+    num_obj_ptr_tokens = model.max_obj_ptrs_in_encoder * (hidden_dim // mem_dim)
+    num_memory_tokens = model.num_maskmem * num_tokens + num_obj_ptr_tokens
+    return {
+        "image_encoder": (model.forward_image, (image,), {}),
+        "prompt_mask_decoder": (
+            model.forward_prompt_and_mask_decoder,
+            (backbone_fpn[2], (point_coords, point_labels), None, True, False, backbone_fpn[:2]),
+            {},
+        ),
+        "memory_attention": (
+            model.memory_attention.forward,
+            (
+                [torch.randn(num_tokens, 1, hidden_dim)],
+                torch.randn(num_memory_tokens, 1, mem_dim),
+                [torch.randn(num_tokens, 1, hidden_dim)],
+                torch.randn(num_memory_tokens, 1, mem_dim),
+                num_obj_ptr_tokens,
+            ),
+            {},
+        ),
+        "memory_encoder": (
+            model.memory_encoder.forward,
+            (
+                backbone_fpn[2],
+                torch.rand(1, 1, image_size, image_size),
+            ),
+            {"skip_mask_sigmoid": True},
+        ),
+    }
+
+
+def exported_callable(model, component, graph):
+    if component == "image_encoder":
+        return ExportedImageEncoder(model, graph)
+    if component == "prompt_mask_decoder":
+        return ExportedPromptMaskDecoder(model, graph)
+    if component == "memory_attention":
+        return ExportedMemoryAttention(model.memory_attention, graph, (model.image_size // 16) ** 2)
+    return ExportedMemoryEncoder(model.memory_encoder, graph)
+
+
+def flatten(outputs):
+    if isinstance(outputs, dict):
+        return [x for key in sorted(outputs) for x in flatten(outputs[key])]
+    if isinstance(outputs, (list, tuple)):
+        return [x for output in outputs for x in flatten(output)]
+    return [outputs]
+
+
+def timeit(fn, num_iters):
+    with torch.no_grad():
+        fn()
+        start = time.perf_counter()
+        for _ in range(num_iters):
+            fn()
+    return (time.perf_counter() - start) / num_iters * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", type=str, default="configs/sam2.1/sam2.1_hiera_t.yaml")
+    parser.add_argument("--checkpoint", type=str, default=None)
+    parser.add_argument("--export-dir", type=str, default=None)
+    parser.add_argument("--backends", type=str, nargs="+", default=list(BACKENDS))
+    parser.add_argument("--num-points", type=int, default=1)
+    parser.add_argument("--num-iters", type=int, default=3)
+    parser.add_argument("--num-threads", type=int, default=None)
+    parser.add_argument("--atol", type=float, default=1e-3)
+    args = parser.parse_args()
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+
+    torch.manual_seed(0)
+    model = build_sam2(args.config, args.checkpoint, device="cpu")
+    inputs = make_inputs(model, args)
+    export_dir = args.export_dir or tempfile.mkdtemp(prefix="sam2_export_")
+
+    latencies = {
+        component: {"torch": timeit(lambda: fn(*fn_args, **kwargs), args.num_iters)}
+        for component, (fn, fn_args, kwargs) in inputs.items()
+    }
+    for backend in args.backends:
+        start = time.perf_counter()
+        paths = export_sam2(model, export_dir, backend)
+        print(f"exported to {backend} in {time.perf_counter() - start:.1f} s ({export_dir})")
+        for component in COMPONENTS:
+            fn, fn_args, kwargs = inputs[component]
+            exported_fn = exported_callable(model, component, load_graph(paths[component], backend))
+            with torch.no_grad():
+                reference = flatten(fn(*fn_args, **kwargs))
+                outputs = flatten(exported_fn(*fn_args, **kwargs))
+            assert len(outputs) == len(reference)
+            max_diff = max((x.float() - y.float()).abs().max().item() for x, y in zip(outputs, reference))
+            print(f"  {component}: max abs diff vs torch {max_diff:.2e}")
+            assert max_diff < args.atol, f"{backend} {component} doesn't match torch"
+            latencies[component][backend] = timeit(
+                lambda: exported_fn(*fn_args, **kwargs), args.num_iters
+            )
+
+    print(f"CPU latency ({torch.get_num_threads()} threads, ms):")
+    header = ["torch"] + args.backends
+    print(f"  {'component':<20}" + "".join(f"{name:>18}" for name in header))
+    for component in COMPONENTS:
+        row = latencies[component]
+        cells = [f"{row['torch']:.1f}"] + [
+            f"{row[backend]:.1f} ({row['torch'] / row[backend]:.2f}x)" for backend in args.backends
+        ]
+        print(f"  {component:<20}" + "".join(f"{cell:>18}" for cell in cells))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Compare the storages of the video frames in the inference state of
+`SAM2VideoPredictor` (`init_state(frame_storage=...)`) on CPU: normalized float32
+frames, uint8 frames and JPEG-compressed frames (both normalized right before the
+image encoder). Reports the memory held by the frames, the time to start a session
+and to track, and the difference of the mask logits with the float32 frames, on the
+first frames of a sample video of the notebooks (with a click at the center of the
+first frame). Run from the repository root with
+`python -m tools.benchmark_sam2_frame_storage`.
+
+Without `--checkpoint`, the model is randomly initialized (the differences of the
+masks are then only indicative).
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+from sam2.build_sam import build_sam2_video_predictor
+
+FRAME_STORAGES = ["float", "uint8", "jpeg"]
+
+
+def get_frames_size(images):
+    """Size in bytes of the frames held by an inference state."""
+    if isinstance(images, torch.Tensor):
+        return images.numel() * images.element_size()
+    return images.nbytes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", type=str, default="configs/sam2.1/sam2.1_hiera_t.yaml")
+    parser.add_argument("--checkpoint", type=str, default=None)
+    parser.add_argument("--video-dir", type=str, default="notebooks/videos/bedroom")
+    parser.add_argument("--num-frames", type=int, default=8)
+    parser.add_argument("--num-threads", type=int, default=None)
+    args = parser.parse_args()
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+
+    torch.manual_seed(0)
+    predictor = build_sam2_video_predictor(args.config, args.checkpoint, device="cpu")
+
+    frame_names = sorted(
+        p for p in os.listdir(args.video_dir) if os.path.splitext(p)[-1].lower() in [".jpg", ".jpeg"]
+    )[: args.num_frames]
+    masks = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # the predictor loads all the frames of a directory
+        for i, frame_name in enumerate(frame_names):
+            shutil.copy(os.path.join(args.video_dir, frame_name), os.path.join(tmp_dir, f"{i:05d}.jpg"))
+
+        for frame_storage in FRAME_STORAGES:
+            start = time.perf_counter()
+            state = predictor.init_state(tmp_dir, offload_video_to_cpu=True, frame_storage=frame_storage)
+            init_time = time.perf_counter() - start
+            point = (state["video_width"] / 2, state["video_height"] / 2)
+            start = time.perf_counter()
+            predictor.add_new_points_or_box(
+                state, frame_idx=0, obj_id=1, points=np.array([point], np.float32), labels=np.array([1], np.int32)
+            )
+            masks[frame_storage] = {}
+            for frame_idx, _, mask_logits in predictor.propagate_in_video(state):
+                masks[frame_storage][frame_idx] = mask_logits[0]
+            latency = (time.perf_counter() - start) / len(masks[frame_storage]) * 1000
+            frames_size = get_frames_size(state["images"])
+            print(
+                f"{frame_storage}: frames held {frames_size / 2**20:.1f} MiB "
+                f"({frames_size / len(frame_names) / 2**20:.2f} MiB/frame), session start "
+                f"{init_time * 1000:.0f} ms, tracking {latency:.0f} ms/frame"
+            )
+
+    for frame_storage in FRAME_STORAGES[1:]:
+        max_diff = max(
+            (masks[frame_storage][t] - masks["float"][t]).abs().max().item() for t in masks["float"]
+        )
+        ious = []
+        for t, mask_logits in masks["float"].items():
+            mask, other_mask = mask_logits > 0, masks[frame_storage][t] > 0
+            union = (mask | other_mask).sum().item()
+            ious.append((mask & other_mask).sum().item() / union if union > 0 else 1.0)
+        print(
+            f"{frame_storage} vs float: max abs diff of the mask logits {max_diff:.2e}, "
+            f"mask IoU mean {np.mean(ious):.4f} min {np.min(ious):.4f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Compare SAM 2 tracking with and without the cache of the memory attention keys and
+values of each memory frame (`SAM2Base.cache_memory_kv`) on CPU: the difference of
+their outputs and their steady-state latency per frame (once the memory bank is
+full). The frames are simulated from the features of a random image, with a point
+prompt on frame 0 and the memory bank growing as in
+`SAM2VideoPredictor.propagate_in_video`. Run from the repository root with
+`python -m tools.benchmark_sam2_memory_kv_cache`.
+
+Without `--checkpoint`, the model is randomly initialized (the latency doesn't
+depend on the weights).
+"""
+
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from sam2.build_sam import build_sam2
+
+
+def track(model, frame_features, point_inputs, num_frames):
+    """Track frames 0, ..., num_frames - 1, returns the outputs and the latency of each frame (ms)."""
+    output_dict = {"cond_frame_outputs": {}, "non_cond_frame_outputs": {}}
+    latencies = {}
+    for frame_idx in range(num_frames):
+        start = time.perf_counter()
+        out = model.track_step(
+            frame_idx=frame_idx,
+            is_init_cond_frame=frame_idx == 0,
+            **frame_features,
+            point_inputs=point_inputs if frame_idx == 0 else None,
+            mask_inputs=None,
+            output_dict=output_dict,
+            num_frames=num_frames,
+        )
+        latencies[frame_idx] = (time.perf_counter() - start) * 1000
+        storage_key = "cond_frame_outputs" if frame_idx == 0 else "non_cond_frame_outputs"
+        output_dict[storage_key][frame_idx] = out
+    return output_dict, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", type=str, default="configs/sam2.1/sam2.1_hiera_t.yaml")
+    parser.add_argument("--checkpoint", type=str, default=None)
+    parser.add_argument("--num-frames", type=int, default=12)
+    parser.add_argument("--num-objects", type=int, default=1)
+    parser.add_argument("--num-threads", type=int, default=None)
+    args = parser.parse_args()
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+
+    torch.manual_seed(0)
+    model = build_sam2(args.config, args.checkpoint, device="cpu")
+    image_size = model.image_size
+    assert args.num_frames > model.num_maskmem, "the memory bank must fill up"
+
+    with torch.inference_mode():
+        image = torch.randn(1, 3, image_size, image_size)
+        backbone_out = model.forward_image(image)
+        _, vision_feats, vision_pos_embeds, feat_sizes = model._prepare_backbone_features(
+            backbone_out
+        )
+    frame_features = {
+        "current_vision_feats": [x.expand(-1, args.num_objects, -1) for x in vision_feats],
+        "current_vision_pos_embeds": [x.expand(-1, args.num_objects, -1) for x in vision_pos_embeds],
+        "feat_sizes": feat_sizes,
+    }
+    point_inputs = {
+        "point_coords": torch.rand(args.num_objects, 1, 2) * image_size,
+        "point_labels": torch.ones(args.num_objects, 1, dtype=torch.int32),
+    }
+
+    results = {}
+    for cache_memory_kv in [False, True]:
+        model.cache_memory_kv = cache_memory_kv
+        with torch.inference_mode():
+            results[cache_memory_kv] = track(model, frame_features, point_inputs, args.num_frames)
+        name = "cached" if cache_memory_kv else "uncached"
+        print(f"{name}: {', '.join(f'{t:.0f}' for t in results[cache_memory_kv][1].values())} ms/frame")
+
+    # the outputs on the frames tracked with the same memories (up to the differences
+    # of the previous frames)
+    output_dict, cached_output_dict = results[False][0], results[True][0]
+    max_diffs = {}
+    for frame_idx, out in output_dict["non_cond_frame_outputs"].items():
+        cached_out = cached_output_dict["non_cond_frame_outputs"][frame_idx]
+        for key in ["pred_masks", "obj_ptr", "maskmem_features"]:
+            diff = (out[key].float() - cached_out[key].float()).abs().max().item()
+            max_diffs[key] = max(max_diffs.get(key, 0.0), diff)
+    print("cached vs uncached max abs diff: " + ", ".join(f"{k} {v:.2e}" for k, v in max_diffs.items()))
+    num_cached = sum(
+        "memory_kv" in out
+        for storage_key in ["cond_frame_outputs", "non_cond_frame_outputs"]
+        for out in cached_output_dict[storage_key].values()
+    )
+    print(f"frame outputs holding cached projections at the end: {num_cached}")
+
+    print(f"steady-state latency ({torch.get_num_threads()} threads, {args.num_objects} objects):")
+    uncached, cached = [
+        np.mean([t for frame_idx, t in results[c][1].items() if frame_idx > model.num_maskmem])
+        for c in [False, True]
+    ]
+    print(f"  uncached {uncached:.0f} ms/frame, cached {cached:.0f} ms/frame ({uncached / cached:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
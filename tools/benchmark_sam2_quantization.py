@@ -0,0 +1,155 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Compare the dynamic int8 quantization of SAM 2 (`sam2.utils.quantization`) with
+fp32 on CPU: the error of each quantized module on the same inputs, the agreement
+of the tracked masks, the tracking latency and the model size, on the first frames
+of the sample videos of the notebooks (with a click at the center of the first
+frame). Run from the repository root with `python -m tools.benchmark_sam2_quantization`.
+
+Without `--checkpoint`, the model is randomly initialized (the module errors and
+the masks are then only indicative).
+"""
+
+import argparse
+import copy
+import os
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+
+import numpy as np
+import torch
+from PIL import Image
+
+from sam2.build_sam import build_sam2_video_predictor
+from sam2.utils.quantization import get_model_size, quantize_sam2
+
+REPORTED_MODULES = [
+    "image_encoder",
+    "memory_attention",
+    "sam_mask_decoder.transformer",
+    "sam_mask_decoder",
+    "memory_encoder",
+]
+
+
+def flatten(outputs):
+    if isinstance(outputs, dict):
+        return [x for key in sorted(outputs) for x in flatten(outputs[key])]
+    if isinstance(outputs, (list, tuple)):
+        return [x for output in outputs for x in flatten(output)]
+    return [outputs] if isinstance(outputs, torch.Tensor) else []
+
+
+def add_error_hooks(model, quantized_model, errors):
+    """
+    Run each module of `quantized_model` in `REPORTED_MODULES` on the inputs of the
+    fp32 module at every call, and record the relative error of its outputs.
+    """
+    handles = []
+    for name in REPORTED_MODULES:
+        quantized_module = quantized_model.get_submodule(name)
+
+        def hook(module, args, kwargs, output, name=name, quantized_module=quantized_module):
+            quantized_output = quantized_module(*args, **kwargs)
+            for x, y in zip(flatten(output), flatten(quantized_output)):
+                if x.is_floating_point():
+                    error = ((y.float() - x.float()).norm() / x.float().norm().clamp(min=1e-12)).item()
+                    errors[name].append(error)
+
+        handles.append(model.get_submodule(name).register_forward_hook(hook, with_kwargs=True))
+    return handles
+
+
+def track(predictor, video_dir, point):
+    """Track the object clicked on the first frame, returns the masks and the latency per frame."""
+    state = predictor.init_state(video_dir, offload_video_to_cpu=True)
+    start = time.perf_counter()
+    predictor.add_new_points_or_box(
+        state, frame_idx=0, obj_id=1, points=np.array([point], np.float32), labels=np.array([1], np.int32)
+    )
+    masks = {}
+    for frame_idx, _, mask_logits in predictor.propagate_in_video(state):
+        masks[frame_idx] = (mask_logits[0] > 0).cpu()
+    return masks, (time.perf_counter() - start) / len(masks) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", type=str, default="configs/sam2.1/sam2.1_hiera_t.yaml")
+    parser.add_argument("--checkpoint", type=str, default=None)
+    parser.add_argument(
+        "--video-dirs",
+        type=str,
+        nargs="+",
+        default=["notebooks/videos/bedroom", "notebooks/videos/car"],
+    )
+    parser.add_argument("--num-frames", type=int, default=8)
+    parser.add_argument("--num-threads", type=int, default=None)
+    args = parser.parse_args()
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+
+    torch.manual_seed(0)
+    predictor = build_sam2_video_predictor(args.config, args.checkpoint, device="cpu")
+    quantized_predictor = quantize_sam2(copy.deepcopy(predictor))
+    fp32_size, int8_size = get_model_size(predictor), get_model_size(quantized_predictor)
+
+    latencies = defaultdict(list)
+    ious = []
+    errors = defaultdict(list)
+    for video_dir in args.video_dirs:
+        frame_names = sorted(
+            p for p in os.listdir(video_dir) if os.path.splitext(p)[-1].lower() in [".jpg", ".jpeg"]
+        )[: args.num_frames]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # the predictors load all the frames of a directory
+            for i, frame_name in enumerate(frame_names):
+                shutil.copy(os.path.join(video_dir, frame_name), os.path.join(tmp_dir, f"{i:05d}.jpg"))
+            width, height = Image.open(os.path.join(tmp_dir, "00000.jpg")).size
+            point = (width / 2, height / 2)
+
+            handles = add_error_hooks(predictor, quantized_predictor, errors)
+            track(predictor, tmp_dir, point)  # module errors on the fp32 inputs
+            for handle in handles:
+                handle.remove()
+            masks, latency = track(predictor, tmp_dir, point)
+            latencies["fp32"].append(latency)
+            quantized_masks, latency = track(quantized_predictor, tmp_dir, point)
+            latencies["int8"].append(latency)
+
+        video_ious = []
+        for frame_idx, mask in masks.items():
+            union = (mask | quantized_masks[frame_idx]).sum().item()
+            intersection = (mask & quantized_masks[frame_idx]).sum().item()
+            video_ious.append(intersection / union if union > 0 else 1.0)
+        ious += video_ious
+        print(
+            f"{video_dir} ({len(frame_names)} frames): fp32 {latencies['fp32'][-1]:.0f} ms/frame, "
+            f"int8 {latencies['int8'][-1]:.0f} ms/frame, mask IoU int8 vs fp32 "
+            f"mean {np.mean(video_ious):.4f} min {np.min(video_ious):.4f}"
+        )
+
+    print("relative error of the int8 modules vs fp32 (on the fp32 inputs):")
+    for name in REPORTED_MODULES:
+        print(f"  {name:<30} mean {np.mean(errors[name]):.2e} max {np.max(errors[name]):.2e}")
+    fp32_latency, int8_latency = np.mean(latencies["fp32"]), np.mean(latencies["int8"])
+    print(
+        f"tracking latency ({torch.get_num_threads()} threads): fp32 {fp32_latency:.0f} ms/frame, "
+        f"int8 {int8_latency:.0f} ms/frame ({fp32_latency / int8_latency:.2f}x)"
+    )
+    print(
+        f"model size: fp32 {fp32_size / 2**20:.1f} MiB, int8 {int8_size / 2**20:.1f} MiB "
+        f"({1 - int8_size / fp32_size:.0%} smaller)"
+    )
+    print(f"mask IoU int8 vs fp32 over all frames: mean {np.mean(ious):.4f} min {np.min(ious):.4f}")
+
+
+if __name__ == "__main__":
+    main()
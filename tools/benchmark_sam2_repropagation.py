@@ -0,0 +1,121 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Compare a full re-propagation after a correction with the early-stopped one of
+`SAM2VideoPredictor.propagate_in_video(early_stop_iou_thresh=...)` on CPU. A click at
+the center of the first frame is propagated through the video, then a correction click
+is added on a later frame and the video is re-propagated from it in both directions
+(as in the demo backend). Reports the number of frames recomputed by the
+re-propagation, its time, and the IoU of the early-stopped masks with the fully
+re-propagated ones. Run from the repository root with
+`python -m tools.benchmark_sam2_repropagation`.
+
+Without `--checkpoint`, the model is randomly initialized (the number of recomputed
+frames and the differences of the masks are then only indicative).
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+from sam2.build_sam import build_sam2_video_predictor
+
+
+def repropagate(predictor, video_dir, correction_frame_idx, early_stop_iou_thresh, early_stop_num_frames):
+    """
+    Track a click on the first frame, add a correction click and re-propagate from its
+    frame. Return the masks, the number of recomputed frames and the time of the
+    re-propagation.
+    """
+    state = predictor.init_state(video_dir, offload_video_to_cpu=True)
+    point = np.array([[state["video_width"] / 2, state["video_height"] / 2]], np.float32)
+    predictor.add_new_points_or_box(state, frame_idx=0, obj_id=1, points=point, labels=np.array([1], np.int32))
+    for _ in predictor.propagate_in_video(state):
+        pass
+
+    # a negative click next to the center of the corrected frame
+    point = np.array([[state["video_width"] * 0.6, state["video_height"] * 0.6]], np.float32)
+    predictor.add_new_points_or_box(
+        state, frame_idx=correction_frame_idx, obj_id=1, points=point, labels=np.array([0], np.int32)
+    )
+    num_tracked_frames = 0
+    run_single_frame_inference = predictor._run_single_frame_inference
+
+    def _count_tracked_frames(*args, **kwargs):
+        nonlocal num_tracked_frames
+        num_tracked_frames += 1
+        return run_single_frame_inference(*args, **kwargs)
+
+    predictor._run_single_frame_inference = _count_tracked_frames
+    masks = {}
+    start = time.perf_counter()
+    try:
+        for reverse in [False, True]:
+            for frame_idx, _, mask_logits in predictor.propagate_in_video(
+                state,
+                start_frame_idx=correction_frame_idx,
+                reverse=reverse,
+                early_stop_iou_thresh=early_stop_iou_thresh,
+                early_stop_num_frames=early_stop_num_frames,
+            ):
+                masks[frame_idx] = mask_logits[0] > 0
+    finally:
+        del predictor._run_single_frame_inference
+    return masks, num_tracked_frames, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", type=str, default="configs/sam2.1/sam2.1_hiera_t.yaml")
+    parser.add_argument("--checkpoint", type=str, default=None)
+    parser.add_argument("--video-dir", type=str, default="notebooks/videos/bedroom")
+    parser.add_argument("--num-frames", type=int, default=24)
+    parser.add_argument("--correction-frame", type=int, default=8)
+    parser.add_argument("--early-stop-iou-thresh", type=float, default=0.99)
+    parser.add_argument("--early-stop-num-frames", type=int, default=None)
+    parser.add_argument("--num-threads", type=int, default=None)
+    args = parser.parse_args()
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+
+    torch.manual_seed(0)
+    predictor = build_sam2_video_predictor(args.config, args.checkpoint, device="cpu")
+
+    frame_names = sorted(
+        p for p in os.listdir(args.video_dir) if os.path.splitext(p)[-1].lower() in [".jpg", ".jpeg"]
+    )[: args.num_frames]
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # the predictor loads all the frames of a directory
+        for i, frame_name in enumerate(frame_names):
+            shutil.copy(os.path.join(args.video_dir, frame_name), os.path.join(tmp_dir, f"{i:05d}.jpg"))
+
+        for name, early_stop_iou_thresh in [("full", None), ("early stop", args.early_stop_iou_thresh)]:
+            results[name] = repropagate(
+                predictor, tmp_dir, args.correction_frame, early_stop_iou_thresh, args.early_stop_num_frames
+            )
+            _, num_tracked_frames, repropagation_time = results[name]
+            print(
+                f"{name}: re-propagation from frame {args.correction_frame} of {len(frame_names)} recomputed "
+                f"{num_tracked_frames} frames in {repropagation_time:.1f} s"
+            )
+
+    full_masks, early_stop_masks = results["full"][0], results["early stop"][0]
+    ious = []
+    for t, mask in full_masks.items():
+        union = (mask | early_stop_masks[t]).sum().item()
+        ious.append((mask & early_stop_masks[t]).sum().item() / union if union > 0 else 1.0)
+    print(f"early stop vs full: mask IoU mean {np.mean(ious):.4f} min {np.min(ious):.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Compare the static-shape SAM 2 tracking step (`sam2.utils.static_track_step`),
+eager and compiled with `torch.compile`, with `SAM2Base.track_step` on CPU: the
+difference of their outputs on the same memories, and the steady-state latency per
+frame (once the memory bank is full). The frames are simulated from the features of
+a random image, with a point prompt on frame 0 and the memory bank growing as in
+`SAM2VideoPredictor.propagate_in_video`. Run from the repository root with
+`python -m tools.benchmark_sam2_static_track_step`.
+
+Without `--checkpoint`, the model is randomly initialized (the latency doesn't
+depend on the weights).
+"""
+
+import argparse
+import time
+
+import numpy as np
+import torch
+import torch._dynamo
+
+from sam2.build_sam import build_sam2
+from sam2.utils.static_track_step import StaticTrackStep
+
+
+def track(track_step, frame_features, num_frames, output_dict):
+    """
+    Run `track_step` on frames 1, ..., num_frames - 1 (after the prompted frame 0 of
+    `output_dict`), returns the outputs and the latency of each frame (ms).
+    """
+    outputs, latencies = {}, {}
+    for frame_idx in range(1, num_frames):
+        start = time.perf_counter()
+        outputs[frame_idx] = track_step(
+            frame_idx=frame_idx,
+            is_init_cond_frame=False,
+            **frame_features,
+            point_inputs=None,
+            mask_inputs=None,
+            output_dict=output_dict,
+            num_frames=num_frames,
+        )
+        latencies[frame_idx] = (time.perf_counter() - start) * 1000
+        output_dict["non_cond_frame_outputs"][frame_idx] = outputs[frame_idx]
+    return outputs, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", type=str, default="configs/sam2.1/sam2.1_hiera_t.yaml")
+    parser.add_argument("--checkpoint", type=str, default=None)
+    parser.add_argument("--num-frames", type=int, default=12)
+    parser.add_argument("--num-objects", type=int, default=1)
+    parser.add_argument("--compile-mode", type=str, default=None)
+    parser.add_argument("--no-compile", action="store_true")
+    parser.add_argument("--num-threads", type=int, default=None)
+    args = parser.parse_args()
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+
+    torch.manual_seed(0)
+    model = build_sam2(args.config, args.checkpoint, device="cpu")
+    image_size = model.image_size
+    assert args.num_frames > model.num_maskmem, "the memory bank must fill up"
+
+    with torch.inference_mode():
+        image = torch.randn(1, 3, image_size, image_size)
+        backbone_out = model.forward_image(image)
+        _, vision_feats, vision_pos_embeds, feat_sizes = model._prepare_backbone_features(
+            backbone_out
+        )
+        frame_features = {
+            "current_vision_feats": [x.expand(-1, args.num_objects, -1) for x in vision_feats],
+            "current_vision_pos_embeds": [
+                x.expand(-1, args.num_objects, -1) for x in vision_pos_embeds
+            ],
+            "feat_sizes": feat_sizes,
+        }
+        point_inputs = {
+            "point_coords": torch.rand(args.num_objects, 1, 2) * image_size,
+            "point_labels": torch.ones(args.num_objects, 1, dtype=torch.int32),
+        }
+        cond_out = model.track_step(
+            frame_idx=0,
+            is_init_cond_frame=True,
+            **frame_features,
+            point_inputs=point_inputs,
+            mask_inputs=None,
+            output_dict=None,
+            num_frames=args.num_frames,
+        )
+
+    steps = {"eager": model.track_step, "static": StaticTrackStep(model)}
+    if not args.no_compile:
+        steps["static compiled"] = StaticTrackStep(model, compile=True, mode=args.compile_mode)
+    results = {}
+    for name, track_step in steps.items():
+        output_dict = {"cond_frame_outputs": {0: cond_out}, "non_cond_frame_outputs": {}}
+        torch._dynamo.reset()
+        with torch.inference_mode():
+            results[name] = track(track_step, frame_features, args.num_frames, output_dict)
+        print(f"{name}: {', '.join(f'{t:.0f}' for t in results[name][1].values())} ms/frame")
+
+    # the outputs of the static steps on the memories of the eager step
+    eager_outputs, _ = results["eager"]
+    for name, track_step in steps.items():
+        if name == "eager":
+            continue
+        max_diffs = {}
+        with torch.inference_mode():
+            for frame_idx in range(1, args.num_frames):
+                output_dict = {
+                    "cond_frame_outputs": {0: cond_out},
+                    "non_cond_frame_outputs": {
+                        t: out for t, out in eager_outputs.items() if t < frame_idx
+                    },
+                }
+                out = track_step(
+                    frame_idx=frame_idx,
+                    is_init_cond_frame=False,
+                    **frame_features,
+                    point_inputs=None,
+                    mask_inputs=None,
+                    output_dict=output_dict,
+                    num_frames=args.num_frames,
+                )
+                for key in ["pred_masks", "obj_ptr", "maskmem_features"]:
+                    diff = (out[key] - eager_outputs[frame_idx][key]).abs().max().item()
+                    max_diffs[key] = max(max_diffs.get(key, 0.0), diff)
+        print(f"{name} vs eager max abs diff: " + ", ".join(f"{k} {v:.2e}" for k, v in max_diffs.items()))
+
+    # steady state: the frames with a full memory bank
+    print(f"steady-state latency ({torch.get_num_threads()} threads, {args.num_objects} objects):")
+    eager_latency = None
+    for name, (_, latencies) in results.items():
+        steady = [t for frame_idx, t in latencies.items() if frame_idx >= model.num_maskmem]
+        latency = np.mean(steady)
+        eager_latency = eager_latency or latency
+        print(
+            f"  {name:<16} {latency:.0f} ms/frame ({eager_latency / latency:.2f}x), "
+            f"first frame {latencies[1]:.0f} ms, max after the first {max(list(latencies.values())[1:]):.0f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Compare the eager loading of the frames of an MP4 video (decoding and normalizing
+all the frames in `init_state`) with the lazy chunked loading of
+`AsyncVideoFileFrameLoader` (`async_loading_frames=True`) on CPU: the time to start
+a session, the time to the first mask (a click at the center of the first frame),
+the tracking latency over the first frames, and the memory held by the frames.
+Run from the repository root with `python -m tools.benchmark_sam2_video_loading`.
+
+Without `--checkpoint`, the model is randomly initialized (the timings don't depend
+on the weights).
+"""
+
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from sam2.build_sam import build_sam2_video_predictor
+
+
+def get_frames_size(images):
+    """Size in bytes of the frames held by an inference state."""
+    if isinstance(images, torch.Tensor):
+        return images.numel() * images.element_size()
+    return sum(chunk.numel() * chunk.element_size() for chunk in images.chunks.values())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", type=str, default="configs/sam2.1/sam2.1_hiera_t.yaml")
+    parser.add_argument("--checkpoint", type=str, default=None)
+    parser.add_argument("--video", type=str, default="notebooks/videos/bedroom.mp4")
+    parser.add_argument("--num-frames", type=int, default=8)
+    parser.add_argument("--num-threads", type=int, default=None)
+    args = parser.parse_args()
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+
+    torch.manual_seed(0)
+    predictor = build_sam2_video_predictor(args.config, args.checkpoint, device="cpu")
+
+    masks = {}
+    for name, async_loading_frames in [("eager", False), ("lazy", True)]:
+        start = time.perf_counter()
+        state = predictor.init_state(
+            args.video, offload_video_to_cpu=True, async_loading_frames=async_loading_frames
+        )
+        init_time = time.perf_counter() - start
+        point = (state["video_width"] / 2, state["video_height"] / 2)
+        predictor.add_new_points_or_box(
+            state, frame_idx=0, obj_id=1, points=np.array([point], np.float32), labels=np.array([1], np.int32)
+        )
+        first_mask_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        masks[name] = {}
+        for frame_idx, _, mask_logits in predictor.propagate_in_video(
+            state, max_frame_num_to_track=args.num_frames - 1
+        ):
+            masks[name][frame_idx] = mask_logits[0]
+        latency = (time.perf_counter() - start) / len(masks[name]) * 1000
+        print(
+            f"{name}: session start {init_time * 1000:.0f} ms, first mask {first_mask_time * 1000:.0f} ms, "
+            f"tracking {latency:.0f} ms/frame, frames held {get_frames_size(state['images']) / 2**20:.0f} MiB "
+            f"({state['num_frames']} frames)"
+        )
+
+    max_diff = max((masks["eager"][t] - masks["lazy"][t]).abs().max().item() for t in masks["eager"])
+    print(f"lazy vs eager max abs diff of the mask logits: {max_diff:.2e}")
+
+
+if __name__ == "__main__":
+    main()
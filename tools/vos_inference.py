@@ -364,7 +364,7 @@ def vos_separate_inference_per_object(
         )
 
 
-def main():
+def get_args_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "--sam2_cfg",
@@ -434,8 +434,27 @@ def main():
         help="whether to track objects that appear later in the video (i.e. not on the first frame; "
         "some VOS datasets like LVOS or YouTube-VOS don't have all objects appearing in the first frame)",
     )
-    args = parser.parse_args()
+    return parser
+
+
+def get_video_names(args):
+    """Get the list of video names to run VOS prediction on."""
+    # if a video list file is provided, read the video names from the file
+    # (otherwise, we use all subdirectories in base_video_dir)
+    if args.video_list_file is not None:
+        with open(args.video_list_file, "r") as f:
+            video_names = [v.strip() for v in f.readlines()]
+    else:
+        video_names = [
+            p
+            for p in os.listdir(args.base_video_dir)
+            if os.path.isdir(os.path.join(args.base_video_dir, p))
+        ]
+    return video_names
+
 
+def build_predictor(args, device="cuda"):
+    """Build the SAM 2 video predictor from the command line arguments."""
     # if we use per-object PNG files, they could possibly overlap in inputs and outputs
     hydra_overrides_extra = [
         "++model.non_overlap_masks=" + ("false" if args.per_obj_png_file else "true")
@@ -443,9 +462,35 @@ def main():
     predictor = build_sam2_video_predictor(
         config_file=args.sam2_cfg,
         ckpt_path=args.sam2_checkpoint,
+        device=device,
         apply_postprocessing=args.apply_postprocessing,
         hydra_overrides_extra=hydra_overrides_extra,
     )
+    return predictor
+
+
+def run_video(predictor, args, video_name):
+    """Run VOS prediction on a single video according to the command line arguments."""
+    if not args.track_object_appearing_later_in_video:
+        inference_fn = vos_inference
+    else:
+        inference_fn = vos_separate_inference_per_object
+    inference_fn(
+        predictor=predictor,
+        base_video_dir=args.base_video_dir,
+        input_mask_dir=args.input_mask_dir,
+        output_mask_dir=args.output_mask_dir,
+        video_name=video_name,
+        score_thresh=args.score_thresh,
+        use_all_masks=args.use_all_masks,
+        per_obj_png_file=args.per_obj_png_file,
+    )
+
+
+def main():
+    args = get_args_parser().parse_args()
+
+    predictor = build_predictor(args)
 
     if args.use_all_masks:
         print("using all available masks in input_mask_dir as input to the SAM 2 model")
@@ -453,43 +498,12 @@ def main():
         print(
             "using only the first frame's mask in input_mask_dir as input to the SAM 2 model"
         )
-    # if a video list file is provided, read the video names from the file
-    # (otherwise, we use all subdirectories in base_video_dir)
-    if args.video_list_file is not None:
-        with open(args.video_list_file, "r") as f:
-            video_names = [v.strip() for v in f.readlines()]
-    else:
-        video_names = [
-            p
-            for p in os.listdir(args.base_video_dir)
-            if os.path.isdir(os.path.join(args.base_video_dir, p))
-        ]
+    video_names = get_video_names(args)
     print(f"running VOS prediction on {len(video_names)} videos:\n{video_names}")
 
     for n_video, video_name in enumerate(video_names):
         print(f"\n{n_video + 1}/{len(video_names)} - running on {video_name}")
-        if not args.track_object_appearing_later_in_video:
-            vos_inference(
-                predictor=predictor,
-                base_video_dir=args.base_video_dir,
-                input_mask_dir=args.input_mask_dir,
-                output_mask_dir=args.output_mask_dir,
-                video_name=video_name,
-                score_thresh=args.score_thresh,
-                use_all_masks=args.use_all_masks,
-                per_obj_png_file=args.per_obj_png_file,
-            )
-        else:
-            vos_separate_inference_per_object(
-                predictor=predictor,
-                base_video_dir=args.base_video_dir,
-                input_mask_dir=args.input_mask_dir,
-                output_mask_dir=args.output_mask_dir,
-                video_name=video_name,
-                score_thresh=args.score_thresh,
-                use_all_masks=args.use_all_masks,
-                per_obj_png_file=args.per_obj_png_file,
-            )
+        run_video(predictor, args, video_name)
 
     print(
         f"completed VOS prediction on {len(video_names)} videos -- "
@@ -0,0 +1,165 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Data-parallel driver for `vos_inference.py` on multi-core CPU machines.
+
+Per-frame batch-one inference doesn't saturate the intra-op threads of a single
+predictor, so this script runs a pool of predictor replicas (each pinned to a
+slice of the CPU cores) and lets them pull videos from a shared queue.
+"""
+
+import json
+import multiprocessing as mp
+import os
+import time
+
+import torch
+
+from vos_inference import build_predictor, get_args_parser, get_video_names, run_video
+
+
+PROGRESS_FILE_NAME = ".vos_inference_progress.jsonl"
+
+# the predictor replica in each worker process (set up in `_init_worker`)
+_worker_predictor = None
+_worker_args = None
+
+
+def count_frames(base_video_dir, video_name):
+    """Count the JPEG frames of a video (used to balance the work across workers)."""
+    video_dir = os.path.join(base_video_dir, video_name)
+    return sum(
+        os.path.splitext(p)[-1] in [".jpg", ".jpeg", ".JPG", ".JPEG"]
+        for p in os.listdir(video_dir)
+    )
+
+
+def load_finished_videos(progress_path):
+    """Load the names of the videos already finished in a previous run."""
+    finished = {}
+    if not os.path.exists(progress_path):
+        return finished
+    with open(progress_path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # a partially-written last line from an interrupted run
+                continue
+            finished[record["video_name"]] = record
+    return finished
+
+
+def _init_worker(args, num_threads):
+    global _worker_predictor, _worker_args
+    torch.set_num_threads(num_threads)
+    # the workers already run in parallel, so avoid oversubscribing the cores
+    torch.set_num_interop_threads(1)
+    _worker_args = args
+    _worker_predictor = build_predictor(args, device="cpu")
+
+
+def _run_video_in_worker(task):
+    video_name, num_frames = task
+    start_time = time.perf_counter()
+    run_video(_worker_predictor, _worker_args, video_name)
+    latency = time.perf_counter() - start_time
+    return {
+        "video_name": video_name,
+        "num_frames": num_frames,
+        "latency": latency,
+        "pid": os.getpid(),
+    }
+
+
+def main():
+    parser = get_args_parser()
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=4,
+        help="number of predictor replicas (processes) to run in parallel",
+    )
+    parser.add_argument(
+        "--num_threads_per_worker",
+        type=int,
+        default=None,
+        help="number of intra-op threads per worker "
+        "(default: the number of CPU cores divided by `--num_workers`)",
+    )
+    parser.add_argument(
+        "--no_resume",
+        action="store_true",
+        help="re-run all videos instead of skipping those already finished "
+        f"(as recorded in `{PROGRESS_FILE_NAME}` under `--output_mask_dir`)",
+    )
+    args = parser.parse_args()
+
+    num_workers = max(args.num_workers, 1)
+    num_threads = args.num_threads_per_worker
+    if num_threads is None:
+        num_threads = max(os.cpu_count() // num_workers, 1)
+
+    os.makedirs(args.output_mask_dir, exist_ok=True)
+    progress_path = os.path.join(args.output_mask_dir, PROGRESS_FILE_NAME)
+    if args.no_resume and os.path.exists(progress_path):
+        os.remove(progress_path)
+    finished = load_finished_videos(progress_path)
+
+    video_names = get_video_names(args)
+    todo_names = [v for v in video_names if v not in finished]
+    print(
+        f"running VOS prediction on {len(todo_names)} videos "
+        f"({len(video_names) - len(todo_names)} already finished) "
+        f"with {num_workers} workers x {num_threads} threads"
+    )
+    # dispatch the longest videos first, so that the short ones fill in the gaps
+    # at the end instead of a single long video finishing last on one worker
+    tasks = [(v, count_frames(args.base_video_dir, v)) for v in todo_names]
+    tasks.sort(key=lambda t: t[1], reverse=True)
+
+    total_frames = 0
+    total_latency = 0.0
+    start_time = time.perf_counter()
+    ctx = mp.get_context("spawn")
+    with ctx.Pool(
+        processes=num_workers,
+        initializer=_init_worker,
+        initargs=(args, num_threads),
+    ) as pool, open(progress_path, "a") as progress_file:
+        # `chunksize=1` makes each idle worker pull the next video from the queue
+        for n_done, record in enumerate(
+            pool.imap_unordered(_run_video_in_worker, tasks, chunksize=1)
+        ):
+            progress_file.write(json.dumps(record) + "\n")
+            progress_file.flush()
+            total_frames += record["num_frames"]
+            total_latency += record["latency"]
+            print(
+                f"{n_done + 1}/{len(tasks)} - finished {record['video_name']} "
+                f"({record['num_frames']} frames) in {record['latency']:.1f}s "
+                f"({record['num_frames'] / max(record['latency'], 1e-6):.2f} frames/s) "
+                f"on worker {record['pid']}"
+            )
+    wall_time = time.perf_counter() - start_time
+
+    if len(tasks) > 0:
+        print(
+            f"completed VOS prediction on {len(tasks)} videos in {wall_time:.1f}s -- "
+            f"throughput: {total_frames / max(wall_time, 1e-6):.2f} frames/s, "
+            f"mean per-video latency: {total_latency / len(tasks):.1f}s; "
+            f"output masks saved to {args.output_mask_dir}"
+        )
+    else:
+        print(f"all videos already finished -- output masks in {args.output_mask_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Packed per-video frame shards.
+
+Opening millions of small JPEG files on network storage makes the metadata ops
+(`glob`, `open`, `stat`) and the per-file reads starve the training GPUs. A frame
+shard packs all the encoded frames of a video into a single file, with a per-frame
+offset index, so that a video needs a single open (and memory map) per worker.
+
+File layout: an 8-byte magic, the byte length of a json header (uint64), the json
+header (with the frame ids and their byte offsets and lengths), then the encoded
+frame bytes (as stored in the original JPEG/PNG files).
+"""
+
+import functools
+import io
+import json
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image as PILImage
+
+MAGIC = b"FRMSHD01"
+SHARD_SUFFIX = ".frames"
+FRAME_EXTENSIONS = [".jpg", ".jpeg", ".JPG", ".JPEG", ".png", ".PNG"]
+# number of opened shard files to keep per process (i.e. per dataloader worker)
+SHARD_CACHE_SIZE = 256
+
+
+def build_frame_shard(video_frame_root, shard_path):
+    """Pack the JPEG/PNG frames in a video folder (named by frame id) into a shard."""
+    frame_names = [
+        p
+        for p in os.listdir(video_frame_root)
+        if os.path.splitext(p)[-1] in FRAME_EXTENSIONS
+    ]
+    frame_names.sort(key=lambda p: int(os.path.splitext(p)[0]))
+
+    frames = []
+    offset = 0
+    payloads = []
+    for frame_name in frame_names:
+        with open(os.path.join(video_frame_root, frame_name), "rb") as f:
+            payload = f.read()
+        frame_id = int(os.path.splitext(frame_name)[0])
+        frames.append([frame_id, offset, len(payload)])
+        payloads.append(payload)
+        offset += len(payload)
+    header_bytes = json.dumps({"frames": frames}).encode("utf-8")
+
+    tmp_path = shard_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(np.uint64(len(header_bytes)).tobytes())
+        f.write(header_bytes)
+        for payload in payloads:
+            f.write(payload)
+    # rename atomically so that readers never see a partially-written shard
+    os.replace(tmp_path, shard_path)
+    return shard_path
+
+
+class FrameShard:
+    """Read-only, memory-mapped view of a frame shard file."""
+
+    def __init__(self, shard_path):
+        self.shard_path = shard_path
+        self._buffer = np.memmap(shard_path, dtype=np.uint8, mode="r")
+        if self._buffer[: len(MAGIC)].tobytes() != MAGIC:
+            raise ValueError(f"{shard_path} is not a frame shard file")
+        header_start = len(MAGIC) + 8
+        header_len = int(self._buffer[len(MAGIC) : header_start].view(np.uint64)[0])
+        header = json.loads(
+            self._buffer[header_start : header_start + header_len].tobytes()
+        )
+        data_start = header_start + header_len
+        # frame id -> (start, end) byte offsets in the shard
+        self.frame_offsets = OrderedDict(
+            (frame_id, (data_start + offset, data_start + offset + length))
+            for frame_id, offset, length in header["frames"]
+        )
+
+    @property
+    def frame_ids(self):
+        return list(self.frame_offsets.keys())
+
+    def read_bytes(self, frame_id):
+        """Read the encoded bytes of a frame."""
+        start, end = self.frame_offsets[frame_id]
+        return self._buffer[start:end].tobytes()
+
+    def decode(self, frame_id, draft_size=None):
+        """
+        Decode a frame as an RGB PIL image. If `draft_size` (w, h) is given, JPEG
+        frames are decoded directly at a reduced scale no smaller than this size.
+        """
+        image = PILImage.open(io.BytesIO(self.read_bytes(frame_id)))
+        if draft_size is not None:
+            image.draft("RGB", draft_size)
+        return image.convert("RGB")
+
+
+@functools.lru_cache(maxsize=SHARD_CACHE_SIZE)
+def open_frame_shard(shard_path):
+    """Open a frame shard, reusing the memory maps already opened in this process."""
+    return FrameShard(shard_path)
+
+
+def get_shard_path(shard_folder, video_name):
+    return os.path.join(shard_folder, video_name + SHARD_SUFFIX)
+
+
+class FrameShardReader:
+    """
+    Decodes frames from shards with a pool of decoder threads (PIL releases the GIL
+    while decoding), optionally keeping an LRU cache of the decoded frames.
+
+    Args:
+        num_decode_threads: number of decoder threads used in `load`
+        cache_size: number of decoded frames to keep in memory (0 to disable)
+        draft_size: optional (w, h) to decode JPEG frames at a reduced resolution
+            (e.g. the training resolution), which is both faster to decode and
+            smaller to cache
+    """
+
+    def __init__(self, num_decode_threads=4, cache_size=0, draft_size=None):
+        self.num_decode_threads = num_decode_threads
+        self.cache_size = cache_size
+        self.draft_size = tuple(draft_size) if draft_size is not None else None
+        self._cache = OrderedDict()
+        self._pool = None
+
+    def _decode(self, key):
+        shard_path, frame_id = key
+        return open_frame_shard(shard_path).decode(frame_id, self.draft_size)
+
+    def load(self, keys):
+        """Decode a list of (shard_path, frame_id) keys as RGB PIL images."""
+        # the cache is only accessed from this thread (not from the decoder threads)
+        decoded = {}
+        for key in keys:
+            if self.cache_size > 0 and key in self._cache:
+                self._cache.move_to_end(key)
+                decoded[key] = self._cache[key]
+        to_decode = [k for k in OrderedDict.fromkeys(keys) if k not in decoded]
+        if self.num_decode_threads > 1 and len(to_decode) > 1:
+            if self._pool is None:
+                # created lazily, so that each dataloader worker gets its own pool
+                self._pool = ThreadPoolExecutor(self.num_decode_threads)
+            decoded.update(zip(to_decode, self._pool.map(self._decode, to_decode)))
+        else:
+            decoded.update((key, self._decode(key)) for key in to_decode)
+        if self.cache_size > 0:
+            for key in to_decode:
+                self._cache[key] = decoded[key]
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        # the transforms may modify the images in place, so we never hand out the
+        # same (e.g. cached or repeated) image object twice
+        if self.cache_size > 0:
+            return [decoded[key].copy() for key in keys]
+        seen = set()
+        images = []
+        for key in keys:
+            images.append(decoded[key].copy() if key in seen else decoded[key])
+            seen.add(key)
+        return images
+
+    def __getstate__(self):
+        # the thread pool can't be pickled to the dataloader workers
+        state = self.__dict__.copy()
+        state["_pool"] = None
+        state["_cache"] = OrderedDict()
+        return state
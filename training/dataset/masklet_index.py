@@ -0,0 +1,201 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Compact, memory-mappable index of the masklets in a SA-V json annotation file.
+
+Parsing a whole `*_manual.json` file to sample a few objects on a few frames
+dominates the dataloader time on SA-V-sized annotations. `build_masklet_index`
+converts the json file once into a binary file holding the concatenated RLE
+counts with their per-frame, per-object offsets, and the precomputed lists of
+valid frames for each object. `MaskletIndex` memory-maps this file so that only
+the RLEs of the sampled objects are read (and decoded) at training time.
+
+File layout: an 8-byte magic, the byte length of a json header (uint64), the json
+header (with the array offsets, dtypes and shapes), then the raw arrays (each
+aligned to `_ALIGNMENT` bytes).
+"""
+
+import functools
+import json
+import os
+
+import numpy as np
+
+MAGIC = b"MSKIDX01"
+INDEX_SUFFIX = ".mskidx"
+_ALIGNMENT = 64
+# number of opened index files to keep per process (i.e. per dataloader worker)
+INDEX_CACHE_SIZE = 256
+
+
+def _align(offset):
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def _load_masklet_json(video_json_path):
+    """Load the per-frame RLE annotations and the annotation fps from a json file."""
+    with open(video_json_path, "r") as f:
+        data = json.load(f)
+    annotations_fps = None
+    if isinstance(data, list):
+        frame_annots = data
+    elif isinstance(data, dict):
+        masklet_field_name = "masklet" if "masklet" in data else "masks"
+        frame_annots = data[masklet_field_name]
+        if "fps" in data:
+            if isinstance(data["fps"], list):
+                annotations_fps = int(data["fps"][0])
+            else:
+                annotations_fps = int(data["fps"])
+    else:
+        raise NotImplementedError
+    return frame_annots, annotations_fps
+
+
+def build_masklet_index(video_json_path, index_path):
+    """Convert a SA-V masklet json file into a binary masklet index file."""
+    frame_annots, annotations_fps = _load_masklet_json(video_json_path)
+    num_annots = len(frame_annots)
+    num_objects = len(frame_annots[0]) if num_annots > 0 else 0
+
+    rle_offsets = np.full((num_annots, num_objects), -1, dtype=np.int64)
+    rle_lengths = np.zeros((num_annots, num_objects), dtype=np.int32)
+    blob_chunks = []
+    blob_size = 0
+    size = None
+    valid_annot_ids = [[] for _ in range(num_objects)]
+    fully_annotated_ids = []
+    for annot_idx, annot in enumerate(frame_annots):
+        if annot is None:
+            continue
+        if None not in annot:
+            fully_annotated_ids.append(annot_idx)
+        for obj_id in range(num_objects):
+            rle = annot[obj_id]
+            if rle is None:
+                continue
+            if size is None:
+                size = list(rle["size"])
+            elif list(rle["size"]) != size:
+                raise ValueError(
+                    f"Inconsistent mask sizes {rle['size']} and {size} in {video_json_path}"
+                )
+            counts = rle["counts"]
+            if isinstance(counts, str):
+                counts = counts.encode("utf-8")
+            elif isinstance(counts, list):
+                raise ValueError(
+                    f"Uncompressed RLEs are not supported (found in {video_json_path})"
+                )
+            rle_offsets[annot_idx, obj_id] = blob_size
+            rle_lengths[annot_idx, obj_id] = len(counts)
+            blob_chunks.append(counts)
+            blob_size += len(counts)
+            valid_annot_ids[obj_id].append(annot_idx)
+
+    valid_ptr = np.zeros(num_objects + 1, dtype=np.int64)
+    valid_ptr[1:] = np.cumsum([len(ids) for ids in valid_annot_ids])
+    arrays = {
+        "rle_offsets": rle_offsets,
+        "rle_lengths": rle_lengths,
+        "rle_blob": np.frombuffer(b"".join(blob_chunks), dtype=np.uint8),
+        "valid_ptr": valid_ptr,
+        "valid_annot_ids": np.array(
+            [i for ids in valid_annot_ids for i in ids], dtype=np.int32
+        ),
+        "fully_annotated_ids": np.array(fully_annotated_ids, dtype=np.int32),
+    }
+
+    header = {
+        "num_annots": num_annots,
+        "num_objects": num_objects,
+        "size": size,
+        "annotations_fps": annotations_fps,
+        "arrays": {},
+    }
+    # the array offsets depend on the header length, so we reserve some space for
+    # them in a first pass and re-encode the header until its length is stable
+    header_len = 0
+    while True:
+        offset = _align(len(MAGIC) + 8 + header_len)
+        for name, array in arrays.items():
+            header["arrays"][name] = {
+                "offset": offset,
+                "dtype": array.dtype.str,
+                "shape": list(array.shape),
+            }
+            offset = _align(offset + array.nbytes)
+        header_bytes = json.dumps(header).encode("utf-8")
+        if len(header_bytes) == header_len:
+            break
+        header_len = len(header_bytes)
+
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(np.uint64(header_len).tobytes())
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.seek(header["arrays"][name]["offset"])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(offset)
+    # rename atomically so that readers never see a partially-written index
+    os.replace(tmp_path, index_path)
+    return index_path
+
+
+class MaskletIndex:
+    """Read-only, memory-mapped view of a masklet index file."""
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self._buffer = np.memmap(index_path, dtype=np.uint8, mode="r")
+        if self._buffer[: len(MAGIC)].tobytes() != MAGIC:
+            raise ValueError(f"{index_path} is not a masklet index file")
+        header_start = len(MAGIC) + 8
+        header_len = int(self._buffer[len(MAGIC) : header_start].view(np.uint64)[0])
+        header = json.loads(
+            self._buffer[header_start : header_start + header_len].tobytes()
+        )
+        self.num_annots = header["num_annots"]
+        self.num_objects = header["num_objects"]
+        self.size = header["size"]
+        self.annotations_fps = header["annotations_fps"]
+        for name, spec in header["arrays"].items():
+            dtype = np.dtype(spec["dtype"])
+            count = int(np.prod(spec["shape"]))
+            start = spec["offset"]
+            array = self._buffer[start : start + count * dtype.itemsize].view(dtype)
+            setattr(self, name, array.reshape(spec["shape"]))
+
+    def get_rle(self, annot_idx, obj_id):
+        """Get the COCO RLE of an object on an annotated frame (None if missing)."""
+        offset = int(self.rle_offsets[annot_idx, obj_id])
+        if offset < 0:
+            return None
+        length = int(self.rle_lengths[annot_idx, obj_id])
+        counts = self.rle_blob[offset : offset + length].tobytes()
+        return {"size": self.size, "counts": counts}
+
+    def get_valid_annot_ids(self, obj_id):
+        """Get the annotation indices where an object has a valid (not None) mask."""
+        start, end = self.valid_ptr[obj_id], self.valid_ptr[obj_id + 1]
+        return self.valid_annot_ids[start:end]
+
+
+@functools.lru_cache(maxsize=INDEX_CACHE_SIZE)
+def open_masklet_index(index_path):
+    """Open a masklet index, reusing the memory maps already opened in this process."""
+    return MaskletIndex(index_path)
+
+
+def get_index_path(video_json_path, index_folder=None):
+    """Get the index path of a json file (next to it unless `index_folder` is given)."""
+    if index_folder is None:
+        return os.path.splitext(video_json_path)[0] + INDEX_SUFFIX
+    name = os.path.splitext(os.path.basename(video_json_path))[0]
+    return os.path.join(index_folder, name + INDEX_SUFFIX)
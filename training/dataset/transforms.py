@@ -20,6 +20,8 @@ import torchvision.transforms.v2.functional as Fv2
 from PIL import Image as PILImage
 
 from torchvision.transforms import InterpolationMode
+from torchvision.transforms._functional_tensor import _gen_affine_grid
+from torchvision.transforms.functional import _get_inverse_affine_matrix
 
 from training.utils.data_utils import VideoDatapoint
 
@@ -364,12 +366,9 @@ class RandomAffine:
                 shears=self.shear,
                 img_size=img_size,
             )
+            mask_sampling = get_nearest_affine_sampling(affine_params, height, width)
 
         for img_idx, img in enumerate(datapoint.frames):
-            this_masks = [
-                obj.segment.unsqueeze(0) if obj.segment is not None else None
-                for obj in img.objects
-            ]
             if not self.consistent_transform:
                 # if not consistent we create a new affine params for every frame&mask pair Create a random affine transformation
                 affine_params = T.RandomAffine.get_params(
@@ -379,28 +378,22 @@ class RandomAffine:
                     shears=self.shear,
                     img_size=img_size,
                 )
+                mask_sampling = get_nearest_affine_sampling(
+                    affine_params, height, width
+                )
 
-            transformed_bboxes, transformed_masks = [], []
-            for i in range(len(img.objects)):
-                if this_masks[i] is None:
-                    transformed_masks.append(None)
-                    # Dummy bbox for a dummy target
-                    transformed_bboxes.append(torch.tensor([[0, 0, 1, 1]]))
-                else:
-                    transformed_mask = F.affine(
-                        this_masks[i],
-                        *affine_params,
-                        interpolation=InterpolationMode.NEAREST,
-                        fill=0.0,
-                    )
-                    if img_idx == 0 and transformed_mask.max() == 0:
-                        # We are dealing with a video and the object is not visible in the first frame
-                        # Return the datapoint without transformation
-                        return None
-                    transformed_masks.append(transformed_mask.squeeze())
-
-            for i in range(len(img.objects)):
-                img.objects[i].segment = transformed_masks[i]
+            # Transform the masks of all the objects of the frame at once
+            masks = [obj.segment for obj in img.objects if obj.segment is not None]
+            if len(masks) > 0:
+                transformed_masks = affine_nearest(torch.stack(masks), *mask_sampling)
+                if img_idx == 0 and not transformed_masks.flatten(1).any(dim=1).all():
+                    # We are dealing with a video and the object is not visible in the first frame
+                    # Return the datapoint without transformation
+                    return None
+                transformed_masks = iter(transformed_masks)
+                for obj in img.objects:
+                    if obj.segment is not None:
+                        obj.segment = next(transformed_masks)
 
             img.data = F.affine(
                 img.data,
@@ -411,6 +404,37 @@ class RandomAffine:
         return datapoint
 
 
+def get_nearest_affine_sampling(affine_params, height, width):
+    """
+    The source pixel of each output pixel of `F.affine(img, *affine_params,
+    interpolation=InterpolationMode.NEAREST)` on a (height, width) image, as flat
+    [H * W] indices and a [H, W] mask of the pixels inside the source image.
+    """
+    angle, translate, scale, shear = affine_params
+    matrix = _get_inverse_affine_matrix(
+        [0.0, 0.0], angle, [float(t) for t in translate], scale, list(shear)
+    )
+    theta = torch.tensor(matrix, dtype=torch.float32).view(1, 2, 3)
+    grid = _gen_affine_grid(theta, w=width, h=height, ow=width, oh=height)[0]
+    # unnormalize the coordinates and round them as `grid_sample` (nearest mode)
+    x = ((grid[..., 0] + 1) * width - 1).div_(2).round_()
+    y = ((grid[..., 1] + 1) * height - 1).div_(2).round_()
+    valid = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+    index = (y * width + x).long().masked_fill_(~valid, 0)
+    return index.flatten(), valid
+
+
+def affine_nearest(masks, index, valid):
+    """
+    Same as `F.affine(mask, ..., interpolation=InterpolationMode.NEAREST, fill=0.0)`
+    on each of the [O, H, W] `masks`, with the sampling of
+    `get_nearest_affine_sampling`, but gathering the mask values of all the objects
+    directly (instead of sampling each mask as a float image).
+    """
+    out = masks.flatten(1).index_select(1, index).view(masks.shape)
+    return out.masked_fill_(~valid, 0)
+
+
 def random_mosaic_frame(
     datapoint,
     index,
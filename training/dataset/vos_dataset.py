@@ -7,14 +7,17 @@
 import logging
 import random
 from copy import deepcopy
+from typing import Optional
 
 import numpy as np
 
 import torch
+import torch.nn.functional as F
 from iopath.common.file_io import g_pathmgr
 from PIL import Image as PILImage
 from torchvision.datasets.vision import VisionDataset
 
+from training.dataset.frame_shards import FrameShardReader
 from training.dataset.vos_raw_dataset import VOSRawDataset
 from training.dataset.vos_sampler import VOSSampler
 from training.dataset.vos_segment_loader import JSONSegmentLoader
@@ -34,6 +37,7 @@ class VOSDataset(VisionDataset):
         multiplier: int,
         always_target=True,
         target_segments_available=True,
+        frame_shard_reader: Optional[FrameShardReader] = None,
     ):
         self._transforms = transforms
         self.training = training
@@ -47,6 +51,8 @@ class VOSDataset(VisionDataset):
         self.curr_epoch = 0  # Used in case data loader behavior changes across epochs
         self.always_target = always_target
         self.target_segments_available = target_segments_available
+        # Decoder for the frames read from packed frame shards (if any)
+        self.frame_shard_reader = frame_shard_reader
 
     def _get_datapoint(self, idx):
 
@@ -84,7 +90,7 @@ class VOSDataset(VisionDataset):
         sampled_object_ids = sampled_frms_and_objs.object_ids
 
         images = []
-        rgb_images = load_images(sampled_frames)
+        rgb_images = load_images(sampled_frames, self.frame_shard_reader)
         # Iterate over the sampled frames and store their rgb data and object data (bbox, segment)
         for frame_idx, frame in enumerate(sampled_frames):
             w, h = rgb_images[frame_idx].size
@@ -109,6 +115,10 @@ class VOSDataset(VisionDataset):
                     ), "None targets are not supported"
                     # segment is uint8 and remains uint8 throughout the transforms
                     segment = segments[obj_id].to(torch.uint8)
+                    if segment.shape != (h, w):
+                        # the frame was decoded at a reduced resolution (e.g. with
+                        # the `draft_size` of the frame shard reader)
+                        segment = resize_segment(segment, (h, w))
                 else:
                     # There is no target, we either use a zero mask target or drop this object
                     if not self.always_target:
@@ -135,11 +145,26 @@ class VOSDataset(VisionDataset):
         return len(self.video_dataset)
 
 
-def load_images(frames):
+def load_images(frames, frame_shard_reader=None):
+    # Decode the frames stored in shards in one batch (with the reader's decoder pool)
+    shard_frames = [
+        frame for frame in frames if frame.data is None and frame.shard_path is not None
+    ]
+    if len(shard_frames) > 0:
+        if frame_shard_reader is None:
+            frame_shard_reader = FrameShardReader(num_decode_threads=1)
+        shard_images = iter(
+            frame_shard_reader.load(
+                [(frame.shard_path, frame.frame_idx) for frame in shard_frames]
+            )
+        )
+
     all_images = []
     cache = {}
     for frame in frames:
-        if frame.data is None:
+        if frame.data is None and frame.shard_path is not None:
+            all_images.append(next(shard_images))
+        elif frame.data is None:
             # Load the frame rgb data from file
             path = frame.image_path
             if path in cache:
@@ -156,6 +181,12 @@ def load_images(frames):
     return all_images
 
 
+def resize_segment(segment: torch.Tensor, size) -> torch.Tensor:
+    """Resize a uint8 segment to a (h, w) size with nearest neighbor interpolation."""
+    segment = F.interpolate(segment[None, None].float(), size=size, mode="nearest")
+    return segment[0, 0].to(torch.uint8)
+
+
 def tensor_2_PIL(data: torch.Tensor) -> PILImage.Image:
     data = data.cpu().numpy().transpose((1, 2, 0)) * 255.0
     data = data.astype(np.uint8)
@@ -19,7 +19,10 @@ from iopath.common.file_io import g_pathmgr
 
 from omegaconf.listconfig import ListConfig
 
+from training.dataset.frame_shards import get_shard_path, open_frame_shard
+from training.dataset.masklet_index import get_index_path
 from training.dataset.vos_segment_loader import (
+    IndexedJSONSegmentLoader,
     JSONSegmentLoader,
     MultiplePNGSegmentLoader,
     PalettisedPNGSegmentLoader,
@@ -33,6 +36,8 @@ class VOSFrame:
     image_path: str
     data: Optional[torch.Tensor] = None
     is_conditioning_only: Optional[bool] = False
+    # the frame shard to read the frame from instead of image_path (if any)
+    shard_path: Optional[str] = None
 
 
 @dataclass
@@ -65,6 +70,7 @@ class PNGRawDataset(VOSRawDataset):
         single_object_mode=False,
         truncate_video=-1,
         frames_sampling_mult=False,
+        frame_shard_folder=None,
     ):
         self.img_folder = img_folder
         self.gt_folder = gt_folder
@@ -72,6 +78,10 @@ class PNGRawDataset(VOSRawDataset):
         self.is_palette = is_palette
         self.single_object_mode = single_object_mode
         self.truncate_video = truncate_video
+        # Where to find the packed frame shards (built with
+        # `training/scripts/build_frame_shards.py`) to read the frames from
+        # instead of the JPEG files in img_folder
+        self.frame_shard_folder = frame_shard_folder
 
         # Read the subset defined in file_list_txt
         if file_list_txt is not None:
@@ -105,10 +115,20 @@ class PNGRawDataset(VOSRawDataset):
         if frames_sampling_mult:
             video_names_mult = []
             for video_name in self.video_names:
-                num_frames = len(os.listdir(os.path.join(self.img_folder, video_name)))
+                if self.frame_shard_folder is not None:
+                    num_frames = len(self._get_shard(video_name).frame_ids)
+                else:
+                    num_frames = len(
+                        os.listdir(os.path.join(self.img_folder, video_name))
+                    )
                 video_names_mult.extend([video_name] * num_frames)
             self.video_names = video_names_mult
 
+    def _get_shard(self, video_name):
+        if self.single_object_mode:
+            video_name = os.path.dirname(video_name)
+        return open_frame_shard(get_shard_path(self.frame_shard_folder, video_name))
+
     def get_video(self, idx):
         """
         Given a VOSVideo object, return the mask tensors.
@@ -131,13 +151,26 @@ class PNGRawDataset(VOSRawDataset):
                 video_mask_root, self.single_object_mode
             )
 
-        all_frames = sorted(glob.glob(os.path.join(video_frame_root, "*.jpg")))
+        if self.frame_shard_folder is not None:
+            # the frame ids come from the shard index (no need to list the frames)
+            shard = self._get_shard(video_name)
+            all_frames = [
+                (fid, os.path.join(video_frame_root, f"{fid:05d}.jpg"))
+                for fid in shard.frame_ids
+            ]
+            shard_path = shard.shard_path
+        else:
+            all_frames = sorted(glob.glob(os.path.join(video_frame_root, "*.jpg")))
+            all_frames = [
+                (int(os.path.basename(fpath).split(".")[0]), fpath)
+                for fpath in all_frames
+            ]
+            shard_path = None
         if self.truncate_video > 0:
             all_frames = all_frames[: self.truncate_video]
         frames = []
-        for _, fpath in enumerate(all_frames[:: self.sample_rate]):
-            fid = int(os.path.basename(fpath).split(".")[0])
-            frames.append(VOSFrame(fid, image_path=fpath))
+        for fid, fpath in all_frames[:: self.sample_rate]:
+            frames.append(VOSFrame(fid, image_path=fpath, shard_path=shard_path))
         video = VOSVideo(video_name, idx, frames)
         return video, segment_loader
 
@@ -227,6 +260,9 @@ class JSONRawDataset(VOSRawDataset):
         rm_unannotated=True,
         ann_every=1,
         frames_fps=24,
+        use_masklet_index=False,
+        masklet_index_folder=None,
+        frame_shard_folder=None,
     ):
         self.gt_folder = gt_folder
         self.img_folder = img_folder
@@ -234,6 +270,15 @@ class JSONRawDataset(VOSRawDataset):
         self.rm_unannotated = rm_unannotated
         self.ann_every = ann_every
         self.frames_fps = frames_fps
+        # Whether to read the annotations from the masklet index files (built with
+        # `training/scripts/sav_build_masklet_index.py`) instead of the json files;
+        # the index files are looked up next to the json files by default
+        self.use_masklet_index = use_masklet_index
+        self.masklet_index_folder = masklet_index_folder
+        # Where to find the packed frame shards (built with
+        # `training/scripts/build_frame_shards.py`) to read the frames from
+        # instead of the JPEG files in img_folder
+        self.frame_shard_folder = frame_shard_folder
 
         # Read and process excluded files if provided
         excluded_files = []
@@ -269,18 +314,35 @@ class JSONRawDataset(VOSRawDataset):
         """
         video_name = self.video_names[video_idx]
         video_json_path = os.path.join(self.gt_folder, video_name + "_manual.json")
-        segment_loader = JSONSegmentLoader(
-            video_json_path=video_json_path,
-            ann_every=self.ann_every,
-            frames_fps=self.frames_fps,
-        )
+        if self.use_masklet_index:
+            segment_loader = IndexedJSONSegmentLoader(
+                video_index_path=get_index_path(
+                    video_json_path, self.masklet_index_folder
+                ),
+                ann_every=self.ann_every,
+                frames_fps=self.frames_fps,
+            )
+        else:
+            segment_loader = JSONSegmentLoader(
+                video_json_path=video_json_path,
+                ann_every=self.ann_every,
+                frames_fps=self.frames_fps,
+            )
 
-        frame_ids = [
-            int(os.path.splitext(frame_name)[0])
-            for frame_name in sorted(
-                os.listdir(os.path.join(self.img_folder, video_name))
+        if self.frame_shard_folder is not None:
+            shard = open_frame_shard(
+                get_shard_path(self.frame_shard_folder, video_name)
             )
-        ]
+            frame_ids = shard.frame_ids
+            shard_path = shard.shard_path
+        else:
+            frame_ids = [
+                int(os.path.splitext(frame_name)[0])
+                for frame_name in sorted(
+                    os.listdir(os.path.join(self.img_folder, video_name))
+                )
+            ]
+            shard_path = None
 
         frames = [
             VOSFrame(
@@ -288,17 +350,14 @@ class JSONRawDataset(VOSRawDataset):
                 image_path=os.path.join(
                     self.img_folder, f"{video_name}/%05d.jpg" % (frame_id)
                 ),
+                shard_path=shard_path,
             )
             for frame_id in frame_ids[:: self.sample_rate]
         ]
 
         if self.rm_unannotated:
             # Eliminate the frames that have not been annotated
-            valid_frame_ids = [
-                i * segment_loader.ann_every
-                for i, annot in enumerate(segment_loader.frame_annots)
-                if annot is not None and None not in annot
-            ]
+            valid_frame_ids = set(segment_loader.get_fully_annotated_frame_ids())
             frames = [f for f in frames if f.frame_idx in valid_frame_ids]
 
         video = VOSVideo(video_name, video_idx, frames)
@@ -14,6 +14,8 @@ import torch
 
 from PIL import Image as PILImage
 
+from training.dataset.masklet_index import open_masklet_index
+
 try:
     from pycocotools import mask as mask_utils
 except:
@@ -99,6 +101,86 @@ class JSONSegmentLoader:
 
         return res
 
+    def get_fully_annotated_frame_ids(self):
+        # Find the frames where all the objects have a valid (not None) mask
+        return [
+            i * self.ann_every
+            for i, annot in enumerate(self.frame_annots)
+            if annot is not None and None not in annot
+        ]
+
+
+class IndexedJSONSegmentLoader(JSONSegmentLoader):
+    """
+    JSONSegmentLoader reading from a masklet index file (built with
+    `training.dataset.masklet_index.build_masklet_index`) instead of the json file.
+    Only the RLEs of the loaded objects are read from the memory-mapped index.
+    """
+
+    def __init__(
+        self, video_index_path, ann_every=1, frames_fps=24, valid_obj_ids=None
+    ):
+        # Annotations in the index are provided every ann_every th frame
+        self.ann_every = ann_every
+        # Ids of the objects to consider when sampling this video
+        self.valid_obj_ids = valid_obj_ids
+        self.index = open_masklet_index(video_index_path)
+        if self.index.annotations_fps is not None:
+            assert frames_fps % self.index.annotations_fps == 0
+            self.ann_every = frames_fps // self.index.annotations_fps
+
+    def load(self, frame_id, obj_ids=None):
+        assert frame_id % self.ann_every == 0
+        annot_idx = frame_id // self.ann_every
+        if annot_idx >= self.index.num_annots:
+            raise IndexError(f"{frame_id=} is out of the annotated frames")
+
+        valid_objs_ids = set(range(self.index.num_objects))
+        if self.valid_obj_ids is not None:
+            # Remove the masklets that have been filtered out for this video
+            valid_objs_ids &= set(self.valid_obj_ids)
+        if obj_ids is not None:
+            # Only keep the objects that have been sampled
+            valid_objs_ids &= set(obj_ids)
+        valid_objs_ids = sorted(list(valid_objs_ids))
+
+        # Only read the rle masks we are interested in
+        id_2_idx = {}
+        rle_mask_filtered = []
+        for obj_id in valid_objs_ids:
+            rle = self.index.get_rle(annot_idx, obj_id)
+            if rle is not None:
+                id_2_idx[obj_id] = len(rle_mask_filtered)
+                rle_mask_filtered.append(rle)
+            else:
+                id_2_idx[obj_id] = None
+
+        # Decode the masks
+        raw_segments = torch.from_numpy(mask_utils.decode(rle_mask_filtered)).permute(
+            2, 0, 1
+        )  # （num_obj, h, w）
+        segments = {}
+        for obj_id in valid_objs_ids:
+            if id_2_idx[obj_id] is None:
+                segments[obj_id] = None
+            else:
+                segments[obj_id] = raw_segments[id_2_idx[obj_id]]
+        return segments
+
+    def get_valid_obj_frames_ids(self, num_frames_min=None):
+        # The valid frames of each object are precomputed in the index
+        res = {}
+        for obj_id in range(self.index.num_objects):
+            valid_frames = self.index.get_valid_annot_ids(obj_id)
+            if num_frames_min is not None and len(valid_frames) < num_frames_min:
+                # Remove masklets that have less than num_frames_min valid masks
+                continue
+            res[obj_id] = [int(i) * self.ann_every for i in valid_frames]
+        return res
+
+    def get_fully_annotated_frame_ids(self):
+        return [int(i) * self.ann_every for i in self.index.fully_annotated_ids]
+
 
 class PalettisedPNGSegmentLoader:
     def __init__(self, video_png_root):
@@ -0,0 +1,189 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+"""
+Standalone CPU dataloader benchmark of the frame loading in `VOSDataset`.
+
+Each sample loads `--num-frames` consecutive frames of a random video (as
+`RandomUniformSampler` does) with their masks (synthetic palettised PNG masks, written
+into a temporary folder) through `VOSDataset.construct`, either from the JPEG folders
+or from frame shards (built into a temporary folder), and the throughput is reported
+in samples/sec. The datapoints are then checked against those of the JPEG folders: the
+same frames and masks, or with `--draft-size`, masks of the size of the (downscaled)
+frames matching the full-resolution ones.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+import torch
+from PIL import Image as PILImage
+from torch.utils.data import DataLoader, Dataset
+
+from training.dataset.frame_shards import (
+    build_frame_shard,
+    FrameShardReader,
+    get_shard_path,
+)
+from training.dataset.vos_dataset import resize_segment, VOSDataset
+from training.dataset.vos_raw_dataset import PNGRawDataset
+from training.dataset.vos_sampler import SampledFramesAndObjects
+
+OBJECT_IDS = [1, 2]
+
+
+def get_args_parser():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the frame loading from JPEG folders and frame shards",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--img-folder",
+        type=str,
+        default="notebooks/videos",
+        help="Where to find the video folders of JPEG frames",
+    )
+    parser.add_argument("--num-samples", type=int, default=200)
+    parser.add_argument("--num-frames", type=int, default=8)
+    parser.add_argument("--num-workers", type=int, default=2)
+    parser.add_argument("--num-decode-threads", type=int, default=4)
+    parser.add_argument("--cache-size", type=int, default=256)
+    parser.add_argument(
+        "--draft-size",
+        type=int,
+        nargs=2,
+        default=None,
+        help="Optional (w, h) to decode the JPEG frames at a reduced resolution",
+    )
+    return parser
+
+
+def write_masks(video_frame_root, video_mask_root):
+    """Write palettised PNG masks of two moving objects for the frames of a video."""
+    os.makedirs(video_mask_root, exist_ok=True)
+    frame_names = sorted(p for p in os.listdir(video_frame_root) if p.endswith(".jpg"))
+    w, h = PILImage.open(os.path.join(video_frame_root, frame_names[0])).size
+    ys, xs = np.mgrid[:h, :w]
+    for t, frame_name in enumerate(frame_names):
+        masks = np.zeros((h, w), dtype=np.uint8)
+        cy, cx = h / 2, w / 4 + t * w / (2 * len(frame_names))
+        masks[((ys - cy) / (h / 5)) ** 2 + ((xs - cx) / (w / 7)) ** 2 < 1] = 1
+        masks[h // 8 : h // 3, w // 2 + t % 7 : 3 * w // 4] = 2
+        image = PILImage.fromarray(masks, mode="P")
+        image.putpalette([0, 0, 0, 255, 0, 0, 0, 255, 0])
+        image.save(os.path.join(video_mask_root, frame_name.replace(".jpg", ".png")))
+
+
+class FrameLoadingDataset(Dataset):
+    def __init__(self, video_dataset, num_samples, num_frames, frame_shard_reader):
+        self.vos_dataset = VOSDataset(
+            transforms=[],
+            training=False,
+            video_dataset=video_dataset,
+            sampler=None,
+            multiplier=1,
+            frame_shard_reader=frame_shard_reader,
+        )
+        self.num_samples = num_samples
+        self.num_frames = num_frames
+
+    def __getitem__(self, idx):
+        rng = random.Random(idx)
+        video_dataset = self.vos_dataset.video_dataset
+        video, segment_loader = video_dataset.get_video(
+            rng.randrange(len(video_dataset))
+        )
+        start = rng.randrange(0, len(video.frames) - self.num_frames + 1)
+        frames = video.frames[start : start + self.num_frames]
+        datapoint = self.vos_dataset.construct(
+            video, SampledFramesAndObjects(frames, OBJECT_IDS), segment_loader
+        )
+        return {
+            "images": torch.from_numpy(
+                np.stack([np.asarray(f.data)[:8, :8] for f in datapoint.frames])
+            ),
+            "frame_sizes": torch.tensor([f.data.size[::-1] for f in datapoint.frames]),
+            "size": torch.tensor(datapoint.size),
+            "masks": torch.stack(
+                [torch.stack([o.segment for o in f.objects]) for f in datapoint.frames]
+            ),
+        }
+
+    def __len__(self):
+        return self.num_samples
+
+
+def benchmark(dataset, num_workers):
+    loader = DataLoader(dataset, batch_size=1, num_workers=num_workers)
+    start_time = time.perf_counter()
+    outputs = [batch for batch in loader]
+    return len(dataset) / (time.perf_counter() - start_time), outputs
+
+
+if __name__ == "__main__":
+    parser = get_args_parser()
+    args = parser.parse_args()
+
+    video_names = sorted(
+        p
+        for p in os.listdir(args.img_folder)
+        if os.path.isdir(os.path.join(args.img_folder, p))
+    )
+    shard_folder = tempfile.mkdtemp()
+    gt_folder = tempfile.mkdtemp()
+    for video_name in video_names:
+        build_frame_shard(
+            os.path.join(args.img_folder, video_name),
+            get_shard_path(shard_folder, video_name),
+        )
+        write_masks(
+            os.path.join(args.img_folder, video_name),
+            os.path.join(gt_folder, video_name),
+        )
+
+    configs = {
+        "jpeg folders": (None, None),
+        "shards": (shard_folder, FrameShardReader(args.num_decode_threads)),
+        "shards + cache": (
+            shard_folder,
+            FrameShardReader(
+                args.num_decode_threads, args.cache_size, args.draft_size
+            ),
+        ),
+    }
+    results = {}
+    for name, (folder, reader) in configs.items():
+        video_dataset = PNGRawDataset(
+            img_folder=args.img_folder,
+            gt_folder=gt_folder,
+            file_list_txt=None,
+            frame_shard_folder=folder,
+        )
+        video_dataset.video_names = video_names
+        dataset = FrameLoadingDataset(
+            video_dataset, args.num_samples, args.num_frames, reader
+        )
+        results[name] = benchmark(dataset, args.num_workers)
+        print(f"{name:16s}: {results[name][0]:8.2f} samples/sec")
+
+    # sanity check: the shards should decode to exactly the same datapoints, and
+    # with a draft size to consistent frame and mask sizes with the same masks
+    for a, b, c in zip(
+        results["jpeg folders"][1],
+        results["shards"][1],
+        results["shards + cache"][1],
+    ):
+        for key in a:
+            assert torch.equal(a[key], b[key])
+        if args.draft_size is None:
+            for key in a:
+                assert torch.equal(a[key], c[key])
+            continue
+        size = tuple(c["size"][0].tolist())
+        assert (c["frame_sizes"][0] == c["size"][0]).all()
+        assert c["masks"].shape[-2:] == size
+        full_masks = a["masks"][0].flatten(0, 1)
+        resized_masks = torch.stack([resize_segment(m, size) for m in full_masks])
+        assert torch.equal(resized_masks, c["masks"][0].flatten(0, 1))
@@ -0,0 +1,91 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+"""
+Benchmark the SA-V segment loaders in a single process (i.e. one dataloader worker).
+
+Each sample mimics `RandomUniformSampler` + `VOSDataset.construct`: create the
+segment loader of a random video, then load `--num-frames` consecutive annotated
+frames for up to `--max-num-objects` objects.
+"""
+import argparse
+import glob
+import os
+import random
+import tempfile
+import time
+
+import torch
+
+from training.dataset.masklet_index import build_masklet_index, get_index_path
+from training.dataset.vos_segment_loader import (
+    IndexedJSONSegmentLoader,
+    JSONSegmentLoader,
+)
+
+
+def get_args_parser():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the json and indexed SA-V segment loaders",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--sav-gt-dir",
+        type=str,
+        default="sav_dataset/example",
+        help="Where to find the SA-V *_manual.json annotation files",
+    )
+    parser.add_argument("--num-samples", type=int, default=200)
+    parser.add_argument("--num-frames", type=int, default=8)
+    parser.add_argument("--max-num-objects", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+
+def sample_once(segment_loader, num_frames, max_num_objects):
+    frame_ids = segment_loader.get_fully_annotated_frame_ids()
+    start = random.randrange(0, max(len(frame_ids) - num_frames, 0) + 1)
+    frame_ids = frame_ids[start : start + num_frames]
+    first = segment_loader.load(frame_ids[0])
+    visible = [obj_id for obj_id, seg in first.items() if seg.sum()]
+    obj_ids = random.sample(visible, min(len(visible), max_num_objects))
+    return [segment_loader.load(f, obj_ids=obj_ids) for f in frame_ids]
+
+
+def run(make_loader, json_paths, args):
+    random.seed(args.seed)
+    start_time = time.perf_counter()
+    outputs = []
+    for _ in range(args.num_samples):
+        json_path = random.choice(json_paths)
+        outputs.append(
+            sample_once(make_loader(json_path), args.num_frames, args.max_num_objects)
+        )
+    return args.num_samples / (time.perf_counter() - start_time), outputs
+
+
+if __name__ == "__main__":
+    parser = get_args_parser()
+    args = parser.parse_args()
+
+    json_paths = sorted(glob.glob(os.path.join(args.sav_gt_dir, "*_manual.json")))
+    index_dir = tempfile.mkdtemp()
+    for json_path in json_paths:
+        build_masklet_index(json_path, get_index_path(json_path, index_dir))
+
+    json_sps, json_out = run(lambda p: JSONSegmentLoader(p), json_paths, args)
+    index_sps, index_out = run(
+        lambda p: IndexedJSONSegmentLoader(get_index_path(p, index_dir)),
+        json_paths,
+        args,
+    )
+
+    # sanity check: both loaders should give the same masks for the same samples
+    for json_sample, index_sample in zip(json_out, index_out):
+        for json_segms, index_segms in zip(json_sample, index_sample):
+            assert json_segms.keys() == index_segms.keys()
+            for obj_id, segm in json_segms.items():
+                assert torch.equal(segm, index_segms[obj_id])
+
+    print(f"JSONSegmentLoader:        {json_sps:8.2f} samples/sec/worker")
+    print(f"IndexedJSONSegmentLoader: {index_sps:8.2f} samples/sec/worker")
+    print(f"speedup: {index_sps / json_sps:.2f}x")
@@ -0,0 +1,200 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+"""
+Parity check and CPU-time benchmark of `RandomAffine`, which transforms the masks
+of all the objects of a frame at once with a single nearest-pixel gather, against
+the previous implementation, which called `F.affine` on each mask. Also reports
+the CPU time per sample of the video transforms of the
+`sam2.1_hiera_b+_MOSE_finetune.yaml` config on a sample video.
+"""
+import argparse
+import os
+import random
+import time
+
+import torch
+import torchvision.transforms as T
+import torchvision.transforms.functional as F
+from PIL import Image as PILImage
+from torchvision.transforms import InterpolationMode
+
+from training.dataset import transforms as PT
+from training.utils.data_utils import Frame, Object, VideoDatapoint
+
+
+def get_args_parser():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the training transforms",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--video-dir", type=str, default="notebooks/videos/bedroom")
+    parser.add_argument("--num-frames", type=int, default=8)
+    parser.add_argument("--num-objects", type=int, nargs="+", default=[3, 10])
+    parser.add_argument("--num-samples", type=int, default=20)
+    parser.add_argument("--resolution", type=int, default=1024)
+    parser.add_argument("--num-threads", type=int, default=1)
+    return parser
+
+
+class PerMaskRandomAffine(PT.RandomAffine):
+    """The previous `RandomAffine`, which transforms each mask with `F.affine`."""
+
+    def transform_datapoint(self, datapoint: VideoDatapoint):
+        _, height, width = F.get_dimensions(datapoint.frames[0].data)
+        img_size = [width, height]
+
+        if self.consistent_transform:
+            affine_params = T.RandomAffine.get_params(
+                degrees=self.degrees,
+                translate=self.translate,
+                scale_ranges=self.scale,
+                shears=self.shear,
+                img_size=img_size,
+            )
+
+        for img_idx, img in enumerate(datapoint.frames):
+            if not self.consistent_transform:
+                affine_params = T.RandomAffine.get_params(
+                    degrees=self.degrees,
+                    translate=self.translate,
+                    scale_ranges=self.scale,
+                    shears=self.shear,
+                    img_size=img_size,
+                )
+
+            transformed_masks = []
+            for obj in img.objects:
+                if obj.segment is None:
+                    transformed_masks.append(None)
+                    continue
+                transformed_mask = F.affine(
+                    obj.segment.unsqueeze(0),
+                    *affine_params,
+                    interpolation=InterpolationMode.NEAREST,
+                    fill=0.0,
+                )
+                if img_idx == 0 and transformed_mask.max() == 0:
+                    return None
+                transformed_masks.append(transformed_mask.squeeze())
+
+            for obj, transformed_mask in zip(img.objects, transformed_masks):
+                obj.segment = transformed_mask
+
+            img.data = F.affine(
+                img.data,
+                *affine_params,
+                interpolation=self.image_interpolation,
+                fill=self.fill_img,
+            )
+        return datapoint
+
+
+def get_affines(affine_cls):
+    return [
+        affine_cls(
+            degrees=25,
+            shear=20,
+            image_interpolation="bilinear",
+            consistent_transform=consistent_transform,
+        )
+        for consistent_transform in [True, False]
+    ]
+
+
+def get_pipeline(resolution):
+    return PT.ComposeAPI(
+        [
+            PT.RandomHorizontalFlip(consistent_transform=True),
+            PT.RandomAffine(
+                degrees=25,
+                shear=20,
+                image_interpolation="bilinear",
+                consistent_transform=True,
+            ),
+            PT.RandomResizeAPI(
+                sizes=resolution, square=True, consistent_transform=True
+            ),
+            PT.ColorJitter(
+                True, brightness=0.1, contrast=0.03, saturation=0.03, hue=None
+            ),
+            PT.RandomGrayscale(p=0.05, consistent_transform=True),
+            PT.ColorJitter(
+                False, brightness=0.1, contrast=0.05, saturation=0.05, hue=None
+            ),
+            PT.ToTensorAPI(),
+            PT.NormalizeAPI(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+        ]
+    )
+
+
+def make_datapoint(images, num_objects):
+    w, h = images[0].size
+    yy, xx = torch.meshgrid(torch.arange(h), torch.arange(w), indexing="ij")
+    frames = []
+    for t, image in enumerate(images):
+        objects = []
+        for obj_id in range(num_objects):
+            # an ellipse slowly moving over time
+            cy = h * (0.2 + 0.6 * (obj_id + 0.5) / num_objects)
+            cx = w * (0.3 + 0.02 * t + 0.3 * (obj_id % 2))
+            radius = 0.4 / num_objects
+            segment = ((yy - cy) / (radius * h)) ** 2 + ((xx - cx) / (0.1 * w)) ** 2 < 1
+            objects.append(Object(obj_id, t, segment.to(torch.uint8)))
+        frames.append(Frame(data=image.copy(), objects=objects))
+    return VideoDatapoint(frames=frames, video_id=0, size=(h, w))
+
+
+def run(transform, images, num_objects, seed):
+    datapoint = make_datapoint(images, num_objects)
+    random.seed(seed)
+    torch.manual_seed(seed)
+    start_time = time.process_time()
+    datapoint = transform(datapoint)
+    return time.process_time() - start_time, datapoint
+
+
+def check_equal(dp_old, dp_new):
+    for f_old, f_new in zip(dp_old.frames, dp_new.frames):
+        assert f_old.data.tobytes() == f_new.data.tobytes(), "frames don't match"
+        for o_old, o_new in zip(f_old.objects, f_new.objects):
+            assert torch.equal(o_old.segment, o_new.segment), "masks don't match"
+
+
+if __name__ == "__main__":
+    parser = get_args_parser()
+    args = parser.parse_args()
+    torch.set_num_threads(args.num_threads)
+
+    frame_names = sorted(os.listdir(args.video_dir))[: args.num_frames]
+    images = [
+        PILImage.open(os.path.join(args.video_dir, p)).convert("RGB")
+        for p in frame_names
+    ]
+    pipeline = get_pipeline(args.resolution)
+
+    for num_objects in args.num_objects:
+        affines = zip(get_affines(PerMaskRandomAffine), get_affines(PT.RandomAffine))
+        for old, new in affines:
+            old_time, new_time = 0.0, 0.0
+            for seed in range(args.num_samples):
+                t_old, dp_old = run(old, images, num_objects, seed)
+                t_new, dp_new = run(new, images, num_objects, seed)
+                old_time += t_old
+                new_time += t_new
+                check_equal(dp_old, dp_new)
+            print(
+                f"{num_objects} objects, "
+                f"consistent_transform={new.consistent_transform}: "
+                f"RandomAffine {1000 * old_time / args.num_samples:.1f} -> "
+                f"{1000 * new_time / args.num_samples:.1f} ms/sample "
+                "(frames and masks match exactly)"
+            )
+
+        pipeline_time = 0.0
+        for seed in range(args.num_samples):
+            t, _ = run(pipeline, images, num_objects, seed)
+            pipeline_time += t
+        print(
+            f"{num_objects} objects: MOSE finetune transforms "
+            f"{1000 * pipeline_time / args.num_samples:.1f} ms/sample"
+        )
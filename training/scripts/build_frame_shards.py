@@ -0,0 +1,65 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+import argparse
+import os
+from multiprocessing import Pool
+
+import tqdm
+
+from training.dataset.frame_shards import build_frame_shard, get_shard_path
+
+
+def get_args_parser():
+    parser = argparse.ArgumentParser(
+        description="[Preprocessing] Packing JPEG/PNG frame folders into frame shards",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--img-folder",
+        type=str,
+        required=True,
+        help="Where to find the video folders (each containing frames named by frame id)",
+    )
+    parser.add_argument(
+        "--output-dir", type=str, required=True, help="Where to save the frame shards"
+    )
+    parser.add_argument(
+        "--n-procs", type=int, default=8, help="Number of processes to use."
+    )
+    parser.add_argument(
+        "--overwrite", action="store_true", help="Rebuild the existing shards."
+    )
+    return parser
+
+
+def _build_one(task):
+    video_frame_root, shard_path = task
+    build_frame_shard(video_frame_root, shard_path)
+    return shard_path
+
+
+if __name__ == "__main__":
+    parser = get_args_parser()
+    args = parser.parse_args()
+
+    video_names = sorted(
+        p
+        for p in os.listdir(args.img_folder)
+        if os.path.isdir(os.path.join(args.img_folder, p))
+    )
+    os.makedirs(args.output_dir, exist_ok=True)
+    tasks = [
+        (
+            os.path.join(args.img_folder, video_name),
+            get_shard_path(args.output_dir, video_name),
+        )
+        for video_name in video_names
+    ]
+    if not args.overwrite:
+        tasks = [t for t in tasks if not os.path.exists(t[1])]
+    print(f"Packing {len(tasks)} videos ({len(video_names)} found)")
+
+    with Pool(args.n_procs) as pool:
+        for _ in tqdm.tqdm(pool.imap_unordered(_build_one, tasks), total=len(tasks)):
+            pass
+    print("Done")
@@ -0,0 +1,60 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+import argparse
+import glob
+import os
+from multiprocessing import Pool
+
+import tqdm
+
+from training.dataset.masklet_index import build_masklet_index, get_index_path
+
+
+def get_args_parser():
+    parser = argparse.ArgumentParser(
+        description="[SA-V Preprocessing] Building masklet index files",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--sav-gt-dir",
+        type=str,
+        required=True,
+        help="Where to find the SA-V *_manual.json annotation files",
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=str,
+        default=None,
+        help="Where to save the index files (next to the json files by default)",
+    )
+    parser.add_argument(
+        "--n-procs", type=int, default=8, help="Number of processes to use."
+    )
+    parser.add_argument(
+        "--overwrite", action="store_true", help="Rebuild the existing index files."
+    )
+    return parser
+
+
+def _build_one(task):
+    json_path, index_path = task
+    build_masklet_index(json_path, index_path)
+    return index_path
+
+
+if __name__ == "__main__":
+    parser = get_args_parser()
+    args = parser.parse_args()
+
+    json_paths = sorted(glob.glob(os.path.join(args.sav_gt_dir, "*_manual.json")))
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+    tasks = [(p, get_index_path(p, args.output_dir)) for p in json_paths]
+    if not args.overwrite:
+        tasks = [t for t in tasks if not os.path.exists(t[1])]
+    print(f"Building {len(tasks)} index files ({len(json_paths)} json files found)")
+
+    with Pool(args.n_procs) as pool:
+        for _ in tqdm.tqdm(pool.imap_unordered(_build_one, tasks), total=len(tasks)):
+            pass
+    print("Done")
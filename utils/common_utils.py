@@ -36,76 +36,113 @@ class CommonUtils:
             # load mask
             mask_npy_path = os.path.join(mask_path, "mask_"+raw_image_name.split(".")[0]+".npy")
             mask = np.load(mask_npy_path)
-            # color map
-            unique_ids = np.unique(mask)
-            
-            # get each mask from unique mask file
-            all_object_masks = []
-            for uid in unique_ids:
-                if uid == 0: # skip background id
-                    continue
-                else:
-                    object_mask = (mask == uid)
-                    all_object_masks.append(object_mask[None])
-            
-            if len(all_object_masks) == 0:
-                output_image_path = os.path.join(output_path, raw_image_name)
-                cv2.imwrite(output_image_path, image)
-                continue
-            # get n masks: (n, h, w)
-            all_object_masks = np.concatenate(all_object_masks, axis=0)
-            
             # load box information
             file_path = os.path.join(json_path, "mask_"+raw_image_name.split(".")[0]+".json")
-            
-            all_object_boxes = []
-            all_object_ids = []
-            all_class_names = []
-            object_id_to_name = {}
             with open(file_path, "r") as file:
                 json_data = json.load(file)
-                for obj_id, obj_item in json_data["labels"].items():
-                    # box id
-                    instance_id = obj_item["instance_id"]
-                    if instance_id not in unique_ids: # not a valid box
-                        continue
-                    # box coordinates
-                    x1, y1, x2, y2 = obj_item["x1"], obj_item["y1"], obj_item["x2"], obj_item["y2"]
-                    all_object_boxes.append([x1, y1, x2, y2])
-                    # box name
-                    class_name = obj_item["class_name"]
-                    
-                    # build id list and id2name mapping
-                    all_object_ids.append(instance_id)
-                    all_class_names.append(class_name)
-                    object_id_to_name[instance_id] = class_name
-            
-            # Adjust object id and boxes to ascending order
-            paired_id_and_box = zip(all_object_ids, all_object_boxes)
-            sorted_pair = sorted(paired_id_and_box, key=lambda pair: pair[0])
-            
-            # Because we get the mask data as ascending order, so we also need to ascend box and ids
-            all_object_ids = [pair[0] for pair in sorted_pair]
-            all_object_boxes = [pair[1] for pair in sorted_pair]
-            
-            detections = sv.Detections(
-                xyxy=np.array(all_object_boxes),
-                mask=all_object_masks,
-                class_id=np.array(all_object_ids, dtype=np.int32),
-            )
-            
-            # custom label to show both id and class name
-            labels = [
-                f"{instance_id}: {class_name}" for instance_id, class_name in zip(all_object_ids, all_class_names)
-            ]
-            
-            box_annotator = sv.BoxAnnotator()
-            annotated_frame = box_annotator.annotate(scene=image.copy(), detections=detections)
-            label_annotator = sv.LabelAnnotator()
-            annotated_frame = label_annotator.annotate(annotated_frame, detections=detections, labels=labels)
-            mask_annotator = sv.MaskAnnotator()
-            annotated_frame = mask_annotator.annotate(scene=annotated_frame, detections=detections)
+            annotated_frame = CommonUtils.annotate_frame_with_supervision(image, mask, json_data)
+
+            output_image_path = os.path.join(output_path, raw_image_name)
+            cv2.imwrite(output_image_path, annotated_frame)
+            print(f"Annotated image saved as {output_image_path}")
+
+    @staticmethod
+    def annotate_frame_with_supervision(image, mask, json_data):
+        """
+        Draw the masks, boxes and labels of a frame on a BGR image.
+
+        :param image: The (h, w, 3) BGR image.
+        :param mask: The (h, w) label map of the frame (0 being the background).
+        :param json_data: The labels of the frame (as saved by `MaskDictionaryModel.to_dict`).
+        """
+        # color map
+        unique_ids = np.unique(mask)
+        
+        # get each mask from unique mask file
+        all_object_masks = []
+        for uid in unique_ids:
+            if uid == 0: # skip background id
+                continue
+            else:
+                object_mask = (mask == uid)
+                all_object_masks.append(object_mask[None])
+        
+        if len(all_object_masks) == 0:
+            return image
+        # get n masks: (n, h, w)
+        all_object_masks = np.concatenate(all_object_masks, axis=0)
+        
+        # load box information
+        all_object_boxes = []
+        all_object_ids = []
+        all_class_names = []
+        object_id_to_name = {}
+        for obj_id, obj_item in json_data["labels"].items():
+            # box id
+            instance_id = obj_item["instance_id"]
+            if instance_id not in unique_ids: # not a valid box
+                continue
+            # box coordinates
+            x1, y1, x2, y2 = obj_item["x1"], obj_item["y1"], obj_item["x2"], obj_item["y2"]
+            all_object_boxes.append([x1, y1, x2, y2])
+            # box name
+            class_name = obj_item["class_name"]
             
+            # build id list and id2name mapping
+            all_object_ids.append(instance_id)
+            all_class_names.append(class_name)
+            object_id_to_name[instance_id] = class_name
+        
+        # Adjust object id and boxes to ascending order
+        paired_id_and_box = zip(all_object_ids, all_object_boxes)
+        sorted_pair = sorted(paired_id_and_box, key=lambda pair: pair[0])
+        
+        # Because we get the mask data as ascending order, so we also need to ascend box and ids
+        all_object_ids = [pair[0] for pair in sorted_pair]
+        all_object_boxes = [pair[1] for pair in sorted_pair]
+        
+        detections = sv.Detections(
+            xyxy=np.array(all_object_boxes),
+            mask=all_object_masks,
+            class_id=np.array(all_object_ids, dtype=np.int32),
+        )
+        
+        # custom label to show both id and class name
+        labels = [
+            f"{instance_id}: {class_name}" for instance_id, class_name in zip(all_object_ids, all_class_names)
+        ]
+        
+        box_annotator = sv.BoxAnnotator()
+        annotated_frame = box_annotator.annotate(scene=image.copy(), detections=detections)
+        label_annotator = sv.LabelAnnotator()
+        annotated_frame = label_annotator.annotate(annotated_frame, detections=detections, labels=labels)
+        mask_annotator = sv.MaskAnnotator()
+        annotated_frame = mask_annotator.annotate(scene=annotated_frame, detections=detections)
+        
+        return annotated_frame
+
+    @staticmethod
+    def draw_masks_and_box_with_supervision_from_store(raw_image_path, store_path, output_path):
+        """
+        Same as `draw_masks_and_box_with_supervision`, with the label maps and labels
+        read from a `utils.label_map_store.LabelMapWriter` store.
+        """
+        from utils.label_map_store import LabelMapStore
+
+        CommonUtils.creat_dirs(output_path)
+        store = LabelMapStore(store_path)
+        raw_image_name_list = os.listdir(raw_image_path)
+        raw_image_name_list.sort()
+        for raw_image_name in raw_image_name_list:
+            image_path = os.path.join(raw_image_path, raw_image_name)
+            image = cv2.imread(image_path)
+            if image is None:
+                raise FileNotFoundError("Image file not found.")
+            frame_name = raw_image_name.split(".")[0]
+            mask = store.get_label_map(frame_name)
+            json_data = store.frames[frame_name]
+            annotated_frame = CommonUtils.annotate_frame_with_supervision(image, mask, json_data)
+
             output_image_path = os.path.join(output_path, raw_image_name)
             cv2.imwrite(output_image_path, annotated_frame)
             print(f"Annotated image saved as {output_image_path}")
@@ -0,0 +1,89 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+import torch
+
+
+class ImageBackboneCache:
+    """
+    LRU cache of the image backbone (Swin + position encodings) outputs of a
+    Grounding DINO model, keyed by a frame key given with `frame(key)`.
+
+    The multi-scale features of a frame don't depend on the prompt (the text only
+    enters in the feature enhancer and the decoder), so re-querying a frame that was
+    already detected with another prompt only re-runs the text-conditioned parts of
+    the model. Outside of `frame(key)` (or in training mode, or with gradients), the
+    backbone runs as usual; use `enable_image_feature_cache` to install it on a model.
+    """
+
+    def __init__(self, backbone, max_size=8):
+        self.backbone = backbone
+        self.max_size = max_size
+        self.forward = backbone.forward
+        self.cache = OrderedDict()
+        self.frame_key = None
+        self.hits = 0
+        self.misses = 0
+
+    @contextmanager
+    def frame(self, frame_key):
+        """
+        Cache the backbone outputs of the model calls in this context under
+        `frame_key` (e.g. a frame index, or a hash of the frame), which must
+        identify the image content. The key is combined with the input shape, so
+        several inputs (e.g. the tiles and the full frame) of a frame can be cached.
+        """
+        previous_key, self.frame_key = self.frame_key, frame_key
+        try:
+            yield self
+        finally:
+            self.frame_key = previous_key
+
+    def __call__(self, pixel_values, *args, **kwargs):
+        if self.frame_key is None or self.backbone.training or torch.is_grad_enabled():
+            return self.forward(pixel_values, *args, **kwargs)
+
+        # the local model calls the backbone with a `NestedTensor`
+        tensors = getattr(pixel_values, "tensors", pixel_values)
+        key = (
+            self.frame_key,
+            tuple(tensors.shape),
+            str(tensors.device),
+            torch.is_autocast_enabled(tensors.device.type),
+        )
+        outputs = self.cache.get(key)
+        if outputs is None:
+            self.misses += 1
+            outputs = self.forward(pixel_values, *args, **kwargs)
+            self.cache[key] = outputs
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+        else:
+            self.hits += 1
+            self.cache.move_to_end(key)
+        # the models append the extra feature levels to the returned lists
+        return tuple(list(output) if isinstance(output, list) else output for output in outputs)
+
+    def clear(self):
+        self.cache.clear()
+
+
+def enable_image_feature_cache(model, max_size=8):
+    """
+    Cache the image backbone outputs of a Grounding DINO model per frame, either a
+    HuggingFace `AutoModelForZeroShotObjectDetection` model or a local
+    `groundingdino` model. Returns the `ImageBackboneCache`, whose `frame(key)`
+    context enables the cache for the model calls on a frame:
+
+        image_cache = enable_image_feature_cache(model)
+        with image_cache.frame(frame_idx):
+            outputs = model(...)
+    """
+    backbone = model.backbone if hasattr(model, "set_image_tensor") else model.model.backbone
+    if isinstance(backbone.forward, ImageBackboneCache):
+        backbone.forward.max_size = max_size
+        backbone.forward.clear()
+    else:
+        # replace the forward of this module instance only (the weights and the
+        # state dict of the model are unchanged)
+        backbone.forward = ImageBackboneCache(backbone, max_size)
+    return backbone.forward
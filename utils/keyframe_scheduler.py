@@ -0,0 +1,155 @@
+from collections import Counter
+import cv2
+import numpy as np
+import torch
+
+
+def get_object_score_logits(inference_state, frame_idx):
+    """
+    Get the (N,) object score logits of the tracked objects on a frame from a SAM 2
+    video predictor state (a logit <= 0 means that SAM 2 considers the object as
+    absent or occluded), or None if the frame hasn't been tracked.
+    """
+    output_dict = inference_state["output_dict"]
+    for storage_key in ["cond_frame_outputs", "non_cond_frame_outputs"]:
+        if frame_idx in output_dict[storage_key]:
+            return output_dict[storage_key][frame_idx]["object_score_logits"].flatten()
+    return None
+
+
+class KeyframeScheduler:
+    """
+    Decide on which frames to re-run the detection (Grounding DINO + SAM 2 image
+    predictor) of continuous-id tracking, instead of running it every `step` frames.
+
+    A frame is a keyframe when the last keyframe is `max_interval` frames old, or
+    when it is at least `min_interval` frames old and one of these signals fires:
+      - "object_lost": more tracked objects have a non-positive SAM 2 object score
+        than on the last keyframe (objects leaving the scene or lost by the tracker)
+      - "area_change": the mask area of a tracked object changed by more than
+        `area_change_threshold` (relative to its area on the last keyframe)
+      - "frame_diff": the mean absolute difference between a small grayscale
+        thumbnail of the frame and that of the last keyframe is above
+        `frame_diff_threshold` (new objects may have entered the scene)
+
+    Usage:
+        if scheduler.should_detect(frame_idx, frame):
+            ...  # run the detection on the frame
+            scheduler.add_keyframe(frame_idx, frame)
+        ...  # track the objects on the frame
+        scheduler.update(frame_idx, frame_masks, object_score_logits)
+    """
+
+    def __init__(
+        self,
+        min_interval=5,
+        max_interval=60,
+        frame_diff_threshold=0.1,
+        area_change_threshold=0.5,
+        thumbnail_width=64,
+    ):
+        assert 1 <= min_interval <= max_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.frame_diff_threshold = frame_diff_threshold
+        self.area_change_threshold = area_change_threshold
+        self.thumbnail_width = thumbnail_width
+        self.reset()
+
+    def reset(self):
+        """Forget the last keyframe (the next frame will be a keyframe) and the statistics."""
+        self.last_keyframe = None
+        self.num_frames = 0
+        self.num_keyframes = 0
+        self.reasons = Counter()
+        self._keyframe_thumbnail = None
+        self._keyframe_areas = None
+        self._keyframe_num_lost = 0
+        self._trigger = None
+        self._reason = None
+        self._thumbnail_cache = (None, None)
+
+    def _thumbnail(self, frame_idx, frame):
+        if self._thumbnail_cache[0] == frame_idx:
+            return self._thumbnail_cache[1]
+        frame = np.asarray(frame)
+        if frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+        h, w = frame.shape
+        size = (self.thumbnail_width, max(1, round(h * self.thumbnail_width / w)))
+        thumbnail = cv2.resize(frame, size, interpolation=cv2.INTER_AREA).astype(np.float32) / 255.0
+        self._thumbnail_cache = (frame_idx, thumbnail)
+        return thumbnail
+
+    def frame_diff(self, frame_idx, frame):
+        """Mean absolute difference (in [0, 1]) between the thumbnails of a frame and of the last keyframe."""
+        if self._keyframe_thumbnail is None:
+            return 0.0
+        return float(np.abs(self._thumbnail(frame_idx, frame) - self._keyframe_thumbnail).mean())
+
+    def should_detect(self, frame_idx, frame=None):
+        """
+        Whether the detection should run on a frame (an RGB or grayscale image of
+        any size, used for the frame difference signal).
+        """
+        self._reason = None
+        if self.last_keyframe is None:
+            self._reason = "first"
+        elif frame_idx - self.last_keyframe >= self.max_interval:
+            self._reason = "max_interval"
+        elif frame_idx - self.last_keyframe >= self.min_interval:
+            if self._trigger is not None:
+                self._reason = self._trigger
+            elif frame is not None and self.frame_diff(frame_idx, frame) > self.frame_diff_threshold:
+                self._reason = "frame_diff"
+        if self._reason is None:
+            self.num_frames += 1
+        return self._reason is not None
+
+    def add_keyframe(self, frame_idx, frame=None):
+        """Record that the detection ran on a frame (the signals are now relative to it)."""
+        self.last_keyframe = frame_idx
+        self.num_frames += 1
+        self.num_keyframes += 1
+        self.reasons[self._reason or "forced"] += 1
+        self._reason = None
+        self._keyframe_thumbnail = None if frame is None else self._thumbnail(frame_idx, frame)
+        self._keyframe_areas = None
+        self._keyframe_num_lost = 0
+        self._trigger = None
+
+    def update(self, frame_idx, frame_masks, object_score_logits=None):
+        """
+        Update the tracking signals with the results of a tracked frame: its
+        `MaskDictionaryModel` (with the mask areas of the objects, see
+        `set_tracking_masks`) and optionally the SAM 2 object score logits of the
+        objects (see `get_object_score_logits`).
+        """
+        areas = {obj_id: obj_info.area for obj_id, obj_info in frame_masks.labels.items()}
+        num_lost = 0
+        if object_score_logits is not None:
+            num_lost = int((torch.as_tensor(object_score_logits) <= 0).sum())
+        if self._keyframe_areas is None:
+            # first tracked frame since the keyframe (usually the keyframe itself)
+            self._keyframe_areas = areas
+            self._keyframe_num_lost = num_lost
+            return
+        if self._trigger is not None:
+            return
+        if num_lost > self._keyframe_num_lost:
+            self._trigger = "object_lost"
+            return
+        for obj_id, keyframe_area in self._keyframe_areas.items():
+            area = areas.get(obj_id, 0)
+            if abs(area - keyframe_area) > self.area_change_threshold * max(keyframe_area, 1):
+                self._trigger = "area_change"
+                return
+
+    def summary(self, fixed_interval=None):
+        """A summary of the detector calls (compared to a detection every `fixed_interval` frames)."""
+        reasons = ", ".join(f"{k}: {v}" for k, v in self.reasons.most_common())
+        summary = f"{self.num_keyframes} detector calls for {self.num_frames} frames ({reasons})"
+        if fixed_interval is not None:
+            num_fixed = -(-self.num_frames // fixed_interval)
+            summary += f", {num_fixed - self.num_keyframes} saved vs every {fixed_interval} frames"
+        return summary
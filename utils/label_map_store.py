@@ -0,0 +1,109 @@
+import os
+import json
+import numpy as np
+from utils.mask_dictionary_model import MaskDictionaryModel
+
+
+class LabelMapWriter:
+    """
+    Write the per-frame tracking results of a video into a single label map store,
+    instead of one `mask_*.npy` label map and one `mask_*.json` file per frame.
+
+    The store is a folder holding the uint16 label maps of `chunk_size` consecutive
+    frames per compressed `chunk_*.npz` file, and an `index.json` file with, for
+    each frame, its chunk, its offset in the chunk and its labels (instance ids,
+    class names, boxes and areas as in the per-frame json files).
+
+    Usage:
+        with LabelMapWriter(store_dir) as writer:
+            for frame_name, mask_dict in results:
+                writer.add_frame(frame_name, mask_dict)
+    """
+
+    def __init__(self, store_dir, chunk_size=64):
+        self.store_dir = store_dir
+        self.chunk_size = chunk_size
+        self.frames = {}
+        self._chunk_label_maps = []
+        self._num_chunks = 0
+        os.makedirs(store_dir, exist_ok=True)
+
+    def add_frame(self, frame_name, mask_dict):
+        """Add the results of a frame (a `MaskDictionaryModel`, possibly empty)."""
+        if len(mask_dict.labels) > 0:
+            label_map = mask_dict.to_label_map()
+        else:
+            label_map = np.zeros((mask_dict.mask_height, mask_dict.mask_width), dtype=np.uint16)
+        frame_info = mask_dict.to_dict()
+        frame_info["chunk"] = self._num_chunks
+        frame_info["offset"] = len(self._chunk_label_maps)
+        self.frames[frame_name] = frame_info
+        self._chunk_label_maps.append(label_map)
+        if len(self._chunk_label_maps) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if len(self._chunk_label_maps) == 0:
+            return
+        chunk_path = os.path.join(self.store_dir, f"chunk_{self._num_chunks:06d}.npz")
+        np.savez_compressed(chunk_path, label_maps=np.stack(self._chunk_label_maps))
+        self._chunk_label_maps = []
+        self._num_chunks += 1
+        # the index is rewritten with each chunk, so that an interrupted run can
+        # still be read up to its last complete chunk
+        index = {
+            "chunk_size": self.chunk_size,
+            "num_chunks": self._num_chunks,
+            "frames": {k: v for k, v in self.frames.items() if v["chunk"] < self._num_chunks},
+        }
+        tmp_path = os.path.join(self.store_dir, "index.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, os.path.join(self.store_dir, "index.json"))
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class LabelMapStore:
+    """
+    Read the label maps and labels of the frames in a store written by
+    `LabelMapWriter`, keeping the last decompressed chunk in memory (the frames
+    are usually read in order).
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, "index.json"), "r") as f:
+            index = json.load(f)
+        self.chunk_size = index["chunk_size"]
+        self.frames = index["frames"]
+        self._chunk_idx = None
+        self._chunk_label_maps = None
+
+    @property
+    def frame_names(self):
+        return list(self.frames.keys())
+
+    def __contains__(self, frame_name):
+        return frame_name in self.frames
+
+    def get_label_map(self, frame_name):
+        """Get the (H, W) uint16 label map of a frame (0 being the background)."""
+        frame_info = self.frames[frame_name]
+        if frame_info["chunk"] != self._chunk_idx:
+            chunk_path = os.path.join(self.store_dir, f"chunk_{frame_info['chunk']:06d}.npz")
+            with np.load(chunk_path) as data:
+                self._chunk_label_maps = data["label_maps"]
+            self._chunk_idx = frame_info["chunk"]
+        return self._chunk_label_maps[frame_info["offset"]]
+
+    def get_mask_dict(self, frame_name):
+        """Get the labels of a frame as a `MaskDictionaryModel` (without masks)."""
+        return MaskDictionaryModel().from_dict(self.frames[frame_name])
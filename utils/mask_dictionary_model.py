@@ -4,7 +4,9 @@ import torch
 import copy
 import os
 import cv2
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, replace
+from sam2.utils.amg import batched_mask_to_box
+from utils.track_utils import get_masks_geometry
 
 @dataclass
 class MaskDictionaryModel:
@@ -35,31 +37,95 @@ class MaskDictionaryModel:
         self.mask_width = mask_img.shape[1]
         self.labels = anno_2d
 
-    def update_masks(self, tracking_annotation_dict, iou_threshold=0.8, objects_count=0):
-        updated_masks = {}
+    def set_tracking_masks(self, obj_ids, masks, class_names, logits=None):
+        """
+        Set the labels from the (N, H, W) boolean masks of the tracked objects of a
+        frame. The masks of the objects are views into `masks` (no per-object copy),
+        and their boxes and areas are computed once for all objects.
+        """
+        masks = torch.as_tensor(masks).to(torch.bool)
+        boxes, areas, _ = get_masks_geometry(masks)
+        boxes, areas = boxes.tolist(), areas.tolist()
+        self.mask_height, self.mask_width = masks.shape[-2:]
+        self.labels = {}
+        for i, obj_id in enumerate(obj_ids):
+            object_info = ObjectInfo(instance_id=obj_id, mask=masks[i], class_name=class_names[i], area=areas[i])
+            if logits is not None:
+                object_info.logit = logits[i]
+            # empty masks keep an empty box (as in `ObjectInfo.update_box`)
+            if areas[i] > 0:
+                object_info.x1, object_info.y1, object_info.x2, object_info.y2 = boxes[i]
+            self.labels[obj_id] = object_info
+
+    def to_label_map(self):
+        """
+        Merge the object masks into a single (H, W) uint16 label map (0 being the
+        background), the later objects being drawn over the earlier ones.
+        """
+        masks = [torch.as_tensor(v.mask) for v in self.labels.values()]
+        device = masks[0].device if len(masks) > 0 else "cpu"
+        label_map = torch.zeros((self.mask_height, self.mask_width), dtype=torch.int32, device=device)
+        for obj_id, mask in zip(self.labels.keys(), masks):
+            label_map[mask.to(device=device, dtype=torch.bool)] = obj_id
+        return label_map.cpu().numpy().astype(np.uint16)
+
+    def copy(self):
+        """
+        Copy the labels without copying the mask buffers, which are never modified
+        in place (unlike `copy.deepcopy`, which copies every full-resolution mask).
+        """
+        return replace(self, labels={k: replace(v) for k, v in self.labels.items()})
+
+    def update_masks(
+        self,
+        tracking_annotation_dict,
+        iou_threshold=0.8,
+        objects_count=0,
+        matching="greedy",
+        iou_downsample=1,
+        box_prefilter=False,
+    ):
+        """
+        Assign the instance ids of the tracked objects in `tracking_annotation_dict`
+        to the new detections in `self.labels` (matched by mask IoU), and new ids to
+        the unmatched detections.
 
-        for seg_obj_id, seg_mask in self.labels.items():  # tracking_masks
-            flag = 0 
+        The IoUs of all (detection, tracked object) pairs are computed at once (see
+        `calculate_iou_matrix`), and each tracked object is assigned to at most one
+        detection, either greedily by decreasing IoU (`matching="greedy"`) or with an
+        optimal assignment (`matching="hungarian"`, which requires scipy).
+        `iou_downsample` computes the IoUs on every n-th row and column of the masks
+        and `box_prefilter` skips the pairs whose boxes don't overlap.
+        """
+        seg_items = list(self.labels.items())
+        track_items = list(tracking_annotation_dict.labels.items())
+        if len(seg_items) > 0:
+            # drop the empty detections
+            seg_masks = torch.stack([torch.as_tensor(v.mask) for _, v in seg_items]).to(torch.bool)
+            non_empty = seg_masks.flatten(1).any(dim=1).tolist()
+            seg_items = [item for item, keep in zip(seg_items, non_empty) if keep]
+            seg_masks = seg_masks[torch.tensor(non_empty, device=seg_masks.device)]
+
+        matched_ids = {}
+        if len(seg_items) > 0 and len(track_items) > 0:
+            track_masks = torch.stack([torch.as_tensor(v.mask) for _, v in track_items]).to(seg_masks.device)
+            iou_matrix = self.calculate_iou_matrix(
+                seg_masks, track_masks, downsample=iou_downsample, box_prefilter=box_prefilter
+            )
+            for seg_idx, track_idx in self.match_iou_matrix(iou_matrix, iou_threshold, matching):
+                matched_ids[seg_idx] = track_items[track_idx][1].instance_id
+
+        updated_masks = {}
+        for seg_idx, (seg_obj_id, seg_mask) in enumerate(seg_items):
             new_mask_copy = ObjectInfo()
-            if seg_mask.mask.sum() == 0:
-                continue
-            
-            for object_id, object_info in tracking_annotation_dict.labels.items():  # grounded_sam masks
-                iou = self.calculate_iou(seg_mask.mask, object_info.mask)  # tensor, numpy
-                # print("iou", iou)
-                if iou > iou_threshold:
-                    flag = object_info.instance_id
-                    new_mask_copy.mask = seg_mask.mask
-                    new_mask_copy.instance_id = object_info.instance_id
-                    new_mask_copy.class_name = seg_mask.class_name
-                    break
-                
-            if not flag:
+            if seg_idx in matched_ids:
+                flag = matched_ids[seg_idx]
+            else:
                 objects_count += 1
                 flag = objects_count
-                new_mask_copy.instance_id = objects_count
-                new_mask_copy.mask = seg_mask.mask
-                new_mask_copy.class_name = seg_mask.class_name
+            new_mask_copy.instance_id = flag
+            new_mask_copy.mask = seg_mask.mask
+            new_mask_copy.class_name = seg_mask.class_name
             updated_masks[flag] = new_mask_copy
         self.labels = updated_masks
         return objects_count
@@ -84,6 +150,88 @@ class MaskDictionaryModel:
         iou = intersection / union
         return iou
 
+    @staticmethod
+    def calculate_iou_matrix(masks1, masks2, downsample=1, box_prefilter=False):
+        """
+        Compute the (N, M) IoU matrix between (N, H, W) and (M, H, W) masks, with
+        the intersections of all pairs computed in a single matmul.
+
+        Args:
+            downsample: compute the IoUs on every `downsample`-th row and column of
+                the masks (an approximation which is usually good enough to match
+                objects, and `downsample ** 2` times cheaper)
+            box_prefilter: only compute the IoUs of the masks whose boxes overlap at
+                least one box of the other set (the IoUs of the others are 0), which
+                pays off when there are many objects of which few overlap
+        """
+        masks1 = masks1.to(torch.bool)
+        masks2 = masks2.to(torch.bool)
+        if downsample > 1:
+            masks1 = masks1[:, ::downsample, ::downsample]
+            masks2 = masks2[:, ::downsample, ::downsample]
+        iou_matrix = torch.zeros(len(masks1), len(masks2), device=masks1.device)
+        if len(masks1) == 0 or len(masks2) == 0:
+            return iou_matrix
+
+        rows1 = torch.arange(len(masks1), device=masks1.device)
+        rows2 = torch.arange(len(masks2), device=masks2.device)
+        if box_prefilter:
+            # (the [0, 0, 0, 0] boxes of empty masks may pass the filter, their
+            # IoUs are then computed as 0)
+            boxes1 = batched_mask_to_box(masks1)
+            boxes2 = batched_mask_to_box(masks2)
+            overlap = (
+                (boxes1[:, None, 0] <= boxes2[None, :, 2])
+                & (boxes2[None, :, 0] <= boxes1[:, None, 2])
+                & (boxes1[:, None, 1] <= boxes2[None, :, 3])
+                & (boxes2[None, :, 1] <= boxes1[:, None, 3])
+            )
+            rows1 = rows1[overlap.any(dim=1)]
+            rows2 = rows2[overlap.any(dim=0)]
+            if len(rows1) == 0:
+                return iou_matrix
+
+        # matmul is not implemented for bool; the float32 sums of 0/1 values are
+        # exact up to 2^24 pixels per mask
+        flat1 = masks1[rows1].flatten(1).to(torch.float32)
+        flat2 = masks2[rows2].flatten(1).to(torch.float32)
+        area1 = flat1.sum(dim=1)
+        area2 = flat2.sum(dim=1)
+        intersection = flat1 @ flat2.t()
+        union = area1[:, None] + area2[None, :] - intersection
+        iou = intersection / union.clamp(min=1)
+        iou_matrix[rows1[:, None], rows2[None, :]] = iou
+        return iou_matrix
+
+    @staticmethod
+    def match_iou_matrix(iou_matrix, iou_threshold, matching="greedy"):
+        """
+        One-to-one matching of the rows and columns of an IoU matrix, keeping only
+        the pairs with IoU > `iou_threshold`. Returns a list of (row, column) pairs.
+        """
+        if iou_matrix.numel() == 0:
+            return []
+        iou_np = iou_matrix.cpu().numpy()
+        if matching == "hungarian":
+            from scipy.optimize import linear_sum_assignment
+
+            rows, cols = linear_sum_assignment(iou_np, maximize=True)
+            return [(r, c) for r, c in zip(rows.tolist(), cols.tolist()) if iou_np[r, c] > iou_threshold]
+        elif matching != "greedy":
+            raise ValueError(f"Unknown matching method: {matching}")
+
+        rows, cols = np.nonzero(iou_np > iou_threshold)
+        order = np.argsort(-iou_np[rows, cols], kind="stable")
+        matches = []
+        used_rows, used_cols = set(), set()
+        for r, c in zip(rows[order].tolist(), cols[order].tolist()):
+            if r in used_rows or c in used_cols:
+                continue
+            used_rows.add(r)
+            used_cols.add(c)
+            matches.append((r, c))
+        return matches
+
 
     def save_empty_mask_and_json(self, mask_data_dir, json_data_dir, image_name_list=None):
         mask_img = torch.zeros((self.mask_height, self.mask_width))
@@ -119,11 +267,14 @@ class MaskDictionaryModel:
     def from_json(self, json_file):
         with open(json_file, "r") as f:
             data = json.load(f)
-            self.mask_name = data["mask_name"]
-            self.mask_height = data["mask_height"]
-            self.mask_width = data["mask_width"]
-            self.promote_type = data["promote_type"]
-            self.labels = {int(k): ObjectInfo(**v) for k, v in data["labels"].items()}
+        return self.from_dict(data)
+
+    def from_dict(self, data):
+        self.mask_name = data["mask_name"]
+        self.mask_height = data["mask_height"]
+        self.mask_width = data["mask_width"]
+        self.promote_type = data["promote_type"]
+        self.labels = {int(k): ObjectInfo(**v) for k, v in data["labels"].items()}
         return self
 
 
@@ -137,6 +288,7 @@ class ObjectInfo:
     x2:int = 0
     y2:int = 0
     logit:float = 0.0
+    area:int = 0
 
     def get_mask(self):
         return self.mask
@@ -145,20 +297,19 @@ class ObjectInfo:
         return self.instance_id
 
     def update_box(self):
-        # Find the indices of all non-zero values
-        nonzero_indices = torch.nonzero(self.mask)
-        
+        mask = torch.as_tensor(self.mask)
+        if mask.dtype != torch.bool:
+            mask = mask != 0
+
         # If there are no non-zero values, return an empty bounding box
-        if nonzero_indices.size(0) == 0:
-            # print("nonzero_indices", nonzero_indices)
+        # (the max over uint8 is much faster than `any` over bool on CPU)
+        if mask.view(torch.uint8).amax() == 0:
             return []
-        
-        # Calculate the minimum and maximum indices
-        y_min, x_min = torch.min(nonzero_indices, dim=0)[0]
-        y_max, x_max = torch.max(nonzero_indices, dim=0)[0]
-        
+
+        # Compute the box from the row and column projections of the mask, instead
+        # of listing all its non-zero indices
         # 创建边界框 [x_min, y_min, x_max, y_max]
-        bbox = [x_min.item(), y_min.item(), x_max.item(), y_max.item()]        
+        bbox = batched_mask_to_box(mask).tolist()
         self.x1 = bbox[0]
         self.y1 = bbox[1]
         self.x2 = bbox[2]
@@ -172,5 +323,6 @@ class ObjectInfo:
             "y1": self.y1,
             "x2": self.x2,
             "y2": self.y2,
-            "logit": self.logit
+            "logit": self.logit,
+            "area": self.area
         }
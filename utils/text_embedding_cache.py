@@ -0,0 +1,75 @@
+from collections import OrderedDict
+import torch
+
+
+class TextBackboneCache:
+    """
+    LRU cache of the text backbone (BERT) outputs of a HuggingFace Grounding DINO
+    model (`AutoModelForZeroShotObjectDetection`), keyed by the tokenized captions.
+
+    The tracking demos run the detector on every keyframe of a video with the same
+    prompt, so the text branch only needs to run once per prompt. The cache is only
+    used at inference (eval mode, without gradients); use `enable_text_embedding_cache`
+    to install it on a model.
+    """
+
+    def __init__(self, text_backbone, max_size=16):
+        self.text_backbone = text_backbone
+        self.max_size = max_size
+        self.forward = text_backbone.forward
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, input_ids, attention_mask=None, token_type_ids=None, position_ids=None, **kwargs):
+        if self.text_backbone.training or torch.is_grad_enabled():
+            return self.forward(input_ids, attention_mask, token_type_ids, position_ids, **kwargs)
+
+        # the attention masks and position ids are derived from the input ids (on
+        # the special tokens) in `GroundingDinoModel.forward`, so the token ids and
+        # types identify the outputs
+        key = (
+            tuple(input_ids.shape),
+            input_ids.cpu().numpy().tobytes(),
+            None if token_type_ids is None else token_type_ids.cpu().numpy().tobytes(),
+            str(input_ids.device),
+            torch.is_autocast_enabled(input_ids.device.type),
+            tuple(sorted(kwargs.items())),
+        )
+        outputs = self.cache.get(key)
+        if outputs is None:
+            self.misses += 1
+            outputs = self.forward(input_ids, attention_mask, token_type_ids, position_ids, **kwargs)
+            self.cache[key] = outputs
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+        else:
+            self.hits += 1
+            self.cache.move_to_end(key)
+        return outputs
+
+    def clear(self):
+        self.cache.clear()
+
+
+def enable_text_embedding_cache(model, max_size=16):
+    """
+    Cache the text embeddings of a Grounding DINO model across images, either a
+    HuggingFace `AutoModelForZeroShotObjectDetection` model or a local
+    `groundingdino` model (which has a built-in cache, see `GroundingDINO.get_text_dict`).
+    Returns the model.
+    """
+    if hasattr(model, "get_text_dict"):
+        model.text_cache_size = max_size
+        model.clear_text_cache()
+        return model
+
+    text_backbone = model.model.text_backbone
+    if isinstance(text_backbone.forward, TextBackboneCache):
+        text_backbone.forward.max_size = max_size
+        text_backbone.forward.clear()
+    else:
+        # replace the forward of this module instance only (the weights and the
+        # state dict of the model are unchanged)
+        text_backbone.forward = TextBackboneCache(text_backbone, max_size)
+    return model
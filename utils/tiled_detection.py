@@ -0,0 +1,189 @@
+import math
+import numpy as np
+import torch
+from PIL import Image
+from torchvision.ops import batched_nms, box_convert
+
+
+def get_tile_grid(height, width, model_size=(800, 1333), max_downscale=1.5, overlap=0.2):
+    """
+    Choose the tiles (SAHI-style slices) of a frame from its resolution.
+
+    Grounding DINO resizes its inputs to a shorter side of `model_size[0]` (and a
+    longer side of at most `model_size[1]`), so small objects of high-resolution
+    frames vanish. The frame is sliced only if this resize downscales it by more
+    than `max_downscale`, into square tiles of `max_downscale * model_size[0]`
+    pixels overlapping by `overlap`, spread evenly over the frame.
+
+    Returns:
+        tiles: list of (x1, y1, x2, y2) tiles, the full frame only if no slicing is needed
+    """
+    scale = min(model_size[0] / min(height, width), model_size[1] / max(height, width))
+    if 1 / scale <= max_downscale:
+        return [(0, 0, width, height)]
+
+    tile_size = round(max_downscale * model_size[0])
+    stride = tile_size * (1 - overlap)
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        num_tiles = math.ceil((length - tile_size) / stride) + 1
+        return [round(i * (length - tile_size) / (num_tiles - 1)) for i in range(num_tiles)]
+
+    return [
+        (x, y, min(x + tile_size, width), min(y + tile_size, height))
+        for y in starts(height)
+        for x in starts(width)
+    ]
+
+
+def merge_tile_detections(boxes, scores, labels, iou_threshold=0.5):
+    """
+    Merge the detections of overlapping tiles (in frame coordinates) with a
+    per-label NMS. Returns the indices of the kept detections, by decreasing score.
+    """
+    label_ids = {label: i for i, label in enumerate(dict.fromkeys(labels))}
+    idxs = torch.tensor([label_ids[label] for label in labels], dtype=torch.int64, device=boxes.device)
+    return batched_nms(boxes.float(), scores.float(), idxs, iou_threshold)
+
+
+def _merge(tiles, tile_results, iou_threshold):
+    boxes, scores, labels = [], [], []
+    for (x1, y1, _, _), (tile_boxes, tile_scores, tile_labels) in zip(tiles, tile_results):
+        boxes.append(tile_boxes + torch.tensor([x1, y1, x1, y1], dtype=tile_boxes.dtype, device=tile_boxes.device))
+        scores.append(tile_scores)
+        labels += list(tile_labels)
+    boxes, scores = torch.cat(boxes), torch.cat(scores)
+    if len(tile_results) > 1 and len(labels) > 0:
+        keep = merge_tile_detections(boxes, scores, labels, iou_threshold)
+        boxes, scores = boxes[keep], scores[keep]
+        labels = [labels[i] for i in keep.tolist()]
+    return boxes, scores, labels
+
+
+def detect_tiled_hf(
+    model,
+    processor,
+    image,
+    text,
+    box_threshold=0.25,
+    text_threshold=0.25,
+    max_downscale=1.5,
+    overlap=0.2,
+    nms_threshold=0.5,
+    include_full_frame=True,
+    image_size=800,
+):
+    """
+    Run a HuggingFace Grounding DINO model (`AutoModelForZeroShotObjectDetection`)
+    on the tiles of a high-resolution frame (see `get_tile_grid`) in a single batch,
+    and merge the detections of all the tiles with NMS. Frames that don't need
+    slicing run once, as without tiling. With `include_full_frame`, the full frame
+    also runs (in a second forward, padding the tiles to its shape would waste compute)
+    to keep the objects larger than a tile.
+
+    The tiles share the same prompt, so the text embeddings are computed once per
+    frame (and once for the whole video with `enable_text_embedding_cache`). The
+    model inputs are resized to a shorter side of `image_size` (800 by default, a
+    lower value runs the backbone faster at the cost of the small objects).
+
+    Returns:
+        a dict with the "boxes" (N, 4) in (x1, y1, x2, y2) frame coordinates, the
+        "scores" (N,) and the "labels" of the detections, as
+        `processor.post_process_grounded_object_detection`
+    """
+    image = image.convert("RGB")
+    model_size = (image_size, round(image_size * 1333 / 800))
+    tiles = get_tile_grid(image.height, image.width, model_size, max_downscale, overlap)
+    batches = [tiles]
+    if include_full_frame and len(tiles) > 1:
+        batches.append([(0, 0, image.width, image.height)])
+
+    device = next(model.parameters()).device
+    tile_results = []
+    for batch_tiles in batches:
+        tile_images = [image.crop(tile) for tile in batch_tiles]
+        inputs = processor(
+            images=tile_images,
+            text=[text] * len(tile_images),
+            size={"shortest_edge": model_size[0], "longest_edge": model_size[1]},
+            return_tensors="pt",
+        ).to(device)
+        with torch.no_grad():
+            outputs = model(**inputs)
+        results = processor.post_process_grounded_object_detection(
+            outputs,
+            inputs.input_ids,
+            threshold=box_threshold,
+            text_threshold=text_threshold,
+            target_sizes=[tile_image.size[::-1] for tile_image in tile_images],
+        )
+        tile_results += [(result["boxes"], result["scores"], result["labels"]) for result in results]
+
+    boxes, scores, labels = _merge([tile for batch_tiles in batches for tile in batch_tiles], tile_results, nms_threshold)
+    return {"boxes": boxes, "scores": scores, "labels": labels}
+
+
+def detect_tiled(
+    model,
+    image,
+    caption,
+    box_threshold=0.35,
+    text_threshold=0.25,
+    max_downscale=1.5,
+    overlap=0.2,
+    nms_threshold=0.5,
+    include_full_frame=True,
+    image_size=800,
+):
+    """
+    Same as `detect_tiled_hf` for a local Grounding DINO model (see
+    `grounding_dino.groundingdino.util.inference.load_model`), with the tiles run
+    in a single batch by `predict_batch`.
+
+    Args:
+        image: np.ndarray (H, W, 3) RGB image
+
+    Returns:
+        boxes: torch.Tensor (N, 4) in (x1, y1, x2, y2) frame coordinates
+        scores: torch.Tensor (N,)
+        phrases: list of N phrases
+    """
+    import grounding_dino.groundingdino.datasets.transforms as T
+    from grounding_dino.groundingdino.util.inference import predict_batch
+
+    model_size = (image_size, round(image_size * 1333 / 800))
+    transform = T.Compose(
+        [
+            T.RandomResize([model_size[0]], max_size=model_size[1]),
+            T.ToTensor(),
+            T.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
+        ]
+    )
+    height, width = image.shape[:2]
+    tiles = get_tile_grid(height, width, model_size, max_downscale, overlap)
+    batches = [tiles]
+    if include_full_frame and len(tiles) > 1:
+        # the full frame runs separately (padding the tiles to its shape would waste compute)
+        batches.append([(0, 0, width, height)])
+
+    results = []
+    for batch_tiles in batches:
+        images = [
+            transform(Image.fromarray(np.ascontiguousarray(image[y1:y2, x1:x2])), None)[0]
+            for x1, y1, x2, y2 in batch_tiles
+        ]
+        results += predict_batch(
+            model=model,
+            images=images,
+            captions=caption,
+            box_threshold=box_threshold,
+            text_threshold=text_threshold,
+        )
+    tiles = [tile for batch_tiles in batches for tile in batch_tiles]
+    tile_results = []
+    for (x1, y1, x2, y2), (boxes, scores, phrases) in zip(tiles, results):
+        boxes = box_convert(boxes * torch.tensor([x2 - x1, y2 - y1, x2 - x1, y2 - y1]), in_fmt="cxcywh", out_fmt="xyxy")
+        tile_results.append((boxes, scores, phrases))
+    return _merge(tiles, tile_results, nms_threshold)
@@ -1,9 +1,63 @@
 import numpy as np
+import torch
+from sam2.utils.amg import batched_mask_to_box
+
+
+def _to_bool_masks(masks, foreground_value=None):
+    masks = torch.as_tensor(masks)
+    if masks.dtype == torch.bool:
+        return masks
+    if foreground_value is not None:
+        return masks == foreground_value
+    return masks != 0
+
+
+def _count_along(masks, dim):
+    """count the foreground pixels of boolean masks along a dimension"""
+    # the counts fit in int16 below 32k pixels, and summing uint8 values into
+    # int16 is several times faster than into int32 or int64 on CPU
+    dtype = torch.int16 if masks.shape[dim] < 2**15 else torch.int32
+    return masks.view(torch.uint8).sum(dim=dim, dtype=dtype).to(torch.int64)
+
+
+def get_masks_geometry(masks):
+    """
+    compute the boxes, areas and centroids of a batch of masks at once, from the
+    row and column projections of the masks (so the cost doesn't depend on the
+    number of foreground pixels, unlike `torch.nonzero` / `np.argwhere`)
+
+    Args:
+        masks: torch.Tensor or np.array with shape (n, h, w)
+
+    Returns:
+        boxes: torch.Tensor with shape (n, 4), [x_min, y_min, x_max, y_max] ([0, 0, 0, 0] for empty masks)
+        areas: torch.Tensor with shape (n,)
+        centroids: torch.Tensor with shape (n, 2), [x, y] (nan for empty masks)
+    """
+    masks = _to_bool_masks(masks)
+    h, w = masks.shape[-2:]
+    boxes = batched_mask_to_box(masks)
+    row_counts = _count_along(masks, dim=-1)
+    col_counts = _count_along(masks, dim=-2)
+    areas = row_counts.sum(dim=-1)
+    ys = torch.arange(h, device=masks.device, dtype=torch.float64)
+    xs = torch.arange(w, device=masks.device, dtype=torch.float64)
+    centroids = torch.stack([col_counts.double() @ xs, row_counts.double() @ ys], dim=-1)
+    centroids = (centroids / areas[:, None]).float()
+    return boxes, areas, centroids
+
 
 def sample_points_from_masks(masks, num_points):
     """
     sample points from masks and return its absolute coordinates
 
+    The points are sampled for all masks at once by inverting the prefix sums
+    (cumulative counts) of the foreground pixels, first over the rows and then
+    within the sampled rows, instead of listing all the foreground pixels of each
+    mask. A mask with at least `num_points` foreground pixels gets distinct points
+    (one per stratum of its foreground pixels in raster order), otherwise points
+    are sampled with replacement.
+
     Args:
         masks: np.array with shape (n, h, w)
         num_points: int
@@ -11,31 +65,32 @@ def sample_points_from_masks(masks, num_points):
     Returns:
         points: np.array with shape (n, points, 2)
     """
+    masks = _to_bool_masks(masks, foreground_value=1)
     n, h, w = masks.shape
-    points = []
-
-    for i in range(n):
-        # find the valid mask points
-        indices = np.argwhere(masks[i] == 1)  
-        # the output format of np.argwhere is (y, x) and the shape is (num_points, 2)
-        # we should convert it to (x, y)
-        indices = indices[:, ::-1]  # (num_points, [y x]) to (num_points, [x y])
-        
-        # import pdb; pdb.set_trace()
-        if len(indices) == 0:
-            # if there are no valid points, append an empty array
-            points.append(np.array([]))
-            continue
-        
-        # resampling if there's not enough points
-        if len(indices) < num_points:
-            sampled_indices = np.random.choice(len(indices), num_points, replace=True)
-        else:
-            sampled_indices = np.random.choice(len(indices), num_points, replace=False)
-        
-        sampled_points = indices[sampled_indices]
-        points.append(sampled_points)
-
-    # convert to np.array
-    points = np.array(points, dtype=np.float32)
-    return points
+    row_counts = _count_along(masks, dim=-1)
+    row_cdf = row_counts.cumsum(dim=-1)
+    areas = row_cdf[:, -1]
+    if (areas == 0).any():
+        raise ValueError("Cannot sample points from an empty mask.")
+
+    # rank (in raster order) of the foreground pixel of each sampled point
+    rand = torch.from_numpy(np.random.random((n, num_points)))
+    strata = torch.arange(num_points + 1, dtype=torch.int64)
+    bounds = strata[None, :] * areas[:, None] // num_points
+    stratified = bounds[:, :-1] + (rand * (bounds[:, 1:] - bounds[:, :-1])).long()
+    with_replacement = (rand * areas[:, None]).long()
+    ranks = torch.where(areas[:, None] >= num_points, stratified, with_replacement)
+    # randomize the order of the points (the strata are in raster order)
+    order = torch.from_numpy(np.random.random((n, num_points))).argsort(dim=-1)
+    ranks = ranks.gather(1, order)
+
+    # find the row of each point, then its column within that row
+    rows = torch.searchsorted(row_cdf, ranks, right=True)
+    ranks_in_row = ranks - (row_cdf.gather(1, rows) - row_counts.gather(1, rows))
+    sampled_rows = masks[torch.arange(n)[:, None], rows]
+    col_cdf = sampled_rows.view(torch.uint8).cumsum(dim=-1, dtype=torch.int64)
+    cols = torch.searchsorted(col_cdf, ranks_in_row[..., None], right=True)[..., 0]
+
+    # the points are in (x, y) format
+    points = torch.stack([cols, rows], dim=-1)
+    return points.numpy().astype(np.float32)
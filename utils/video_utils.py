@@ -2,6 +2,22 @@ import cv2
 import os
 from tqdm import tqdm
 
+def read_frames(input_video_path, max_secs=10):
+    """
+    Decode the frames (BGR, as numpy arrays) of the first `max_secs` seconds of a video.
+    """
+    vidcap = cv2.VideoCapture(input_video_path)
+    max_frames = vidcap.get(cv2.CAP_PROP_FPS) * max_secs
+    try:
+        count = 1
+        success, image = vidcap.read()
+        while success and count <= max_frames:
+            yield image
+            success, image = vidcap.read()
+            count += 1
+    finally:
+        vidcap.release()
+
 def create_video_from_images(image_folder, output_video_path, frame_rate=25):
     # define valid extension
     valid_extensions = [".jpg", ".jpeg", ".JPG", ".JPEG", ".png", ".PNG"]